@@ -1,15 +1,30 @@
 import storage
+import usb_cdc
+import usb_hid
 
 import board
 import digitalio
 
-esc_row_io = digitalio.DigitalInOut(board.GPIO29)
-esc_row_io.switch_to_output(False, digitalio.DriveMode.OPEN_DRAIN)
-esc_col_io = digitalio.DigitalInOut(board.GPIO21)
-esc_col_io.switch_to_input(digitalio.Pull.UP)
-is_usb_drive_enabled = esc_col_io.value == False
+from octave_pcb.nkro_keyboard import create_nkro_device
 
-if is_usb_drive_enabled:
+
+def is_key_held(row_pin, col_pin):
+  row_io = digitalio.DigitalInOut(row_pin)
+  row_io.switch_to_output(False, digitalio.DriveMode.OPEN_DRAIN)
+  col_io = digitalio.DigitalInOut(col_pin)
+  col_io.switch_to_input(digitalio.Pull.UP)
+  is_held = col_io.value == False
+  row_io.deinit()
+  col_io.deinit()
+  return is_held
+
+
+is_usb_drive_enabled = is_key_held(board.GPIO29, board.GPIO21)  # ESC
+# A BIOS or UEFI setup needs the boot protocol, which a host only uses on USB interface 0. The serial ports and the
+# USB drive come before the HID interface, so the boot keyboard is enabled alone, and only while B is held at startup.
+is_boot_keyboard_enabled = is_key_held(board.GPIO26, board.GPIO14)  # B
+
+if is_usb_drive_enabled and not is_boot_keyboard_enabled:
   storage.remount("/", readonly=False)
   m = storage.getmount("/")
   m.label = "OCTAVE_CP"
@@ -17,3 +32,19 @@ if is_usb_drive_enabled:
   storage.enable_usb_drive()
 else:
   storage.disable_usb_drive()
+
+if is_boot_keyboard_enabled:
+  # With the boot protocol, a host reads every report of the interface as a boot keyboard report
+  usb_cdc.disable()
+  usb_hid.enable((usb_hid.Device.KEYBOARD,), boot_device=1)
+else:
+  # The 6-key keyboard comes first, as find_nkro_device() expects, and the NKRO keyboard is used. No boot device:
+  # CircuitPython goes into safe mode if the boot device is not interface 0.
+  usb_hid.enable((
+      usb_hid.Device.KEYBOARD,
+      create_nkro_device(usb_hid),
+      usb_hid.Device.MOUSE,
+      usb_hid.Device.CONSUMER_CONTROL,
+  ))
+  # The data channel serves diagnostics, e.g. the latency summary
+  usb_cdc.enable(console=True, data=True)
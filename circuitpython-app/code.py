@@ -1,25 +1,45 @@
-import collections
 import time
 
 import board
 import digitalio
+import microcontroller
+import supervisor
+import usb_cdc
 import usb_hid
-from adafruit_hid.consumer_control import ConsumerControl
-from adafruit_hid.consumer_control_code import ConsumerControlCode
-from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
-from adafruit_hid.keycode import Keycode
-from adafruit_hid.mouse import Mouse
 
-from octave_pcb.key_event import KeyEvent, KeyEventPlanner
-from octave_pcb.key_matrix import KeyMatrix
+# The startup is timed from here, the imports below being its first phase
+startup_time = supervisor.ticks_ms()
 
+from adafruit_hid.consumer_control_code import ConsumerControlCode  # noqa: E402
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
 
-class CodeType:
-  KEYBOARD = 0
-  MOUSE_MOVE = 1
-  MOUSE_BUTTON = 2
-  CONSUMER_CONTROL = 3
+from octave_pcb.binary_keymap import BinaryKeyMap  # noqa: E402
+from octave_pcb.combo import ComboEngine  # noqa: E402
+from octave_pcb.engine import KeyboardEngine  # noqa: E402
+from octave_pcb.hid_output import HID_ENDPOINT_INTERVAL, KeyboardOutput  # noqa: E402
+from octave_pcb.idle import IdleMonitor  # noqa: E402
+from octave_pcb.key_event import DebounceAlgorithm, Debouncer  # noqa: E402
+from octave_pcb.key_matrix import KeyMatrix  # noqa: E402
+from octave_pcb.keymap import (TRANSPARENT, CodeType, Combo, CompiledKeyMap, ComplexModifierAssignment,  # noqa: E402
+                               KeyAssignment, KeycodeLayer, KeyOp, LambdaAssignment, MacroAssignment)
+from octave_pcb.keymap_server import KeymapServer  # noqa: E402
+from octave_pcb.latency_trace import LatencyTrace  # noqa: E402
+from octave_pcb.main_loop import MainLoop  # noqa: E402
+from octave_pcb.macro import MacroEngine  # noqa: E402
+from octave_pcb.mouse_keys import MouseKeysCurve, MouseKeysEngine  # noqa: E402
+from octave_pcb.nkro_keyboard import NkroKeyboard, find_nkro_device  # noqa: E402
+from octave_pcb.recovery import Recovery  # noqa: E402
+from octave_pcb.scheduler import Scheduler  # noqa: E402
+from octave_pcb.startup import StartupTiming, wait_for_usb  # noqa: E402
+from octave_pcb.tap_hold import TapHoldEngine, TapHoldMode  # noqa: E402
+from octave_pcb.ticks import ticks_us  # noqa: E402
+
+
+class KeyMatrixBackend:
+  DIGITALIO = 0  # Scan with digitalio from Python
+  KEYPAD = 1  # Scan in the background with the native keypad module
+  PIO = 2  # Scan in the background with a PIO state machine, needs adafruit_pioasm
 
 
 class KeycodeJp:
@@ -29,27 +49,25 @@ class KeycodeJp:
   JAPANESE_EISUU = 0x91  # LANG2
 
 
-class KeycodeLayer:
-  MO1 = 0xFF01
-  MO2 = 0xFF02
-
-
-def is_code_mo(code):
-  return True if code == KeycodeLayer.MO1 or code == KeycodeLayer.MO2 else False
-
-
-ComplexModifierAssignment = collections.namedtuple('ComplexModifierAssignment', ['modifier', 'code_for_standalone'])
-"""
-1) If you release the key before it becomes a long press, send the standalone code.
-2) When a key becomes a long press, or just before another KeyAssignment becomes press,
-    the modifier becomes press.
-"""
-
-KeyAssignment = collections.namedtuple('KeyAssignment', ['type', 'code'])
-LambdaAssignment = collections.namedtuple('LambdaAssignment', ['on_press', 'on_release'])
-
-
-SCAN_KEY_MATRIX_INTERVAL = 0.02
+SCAN_KEY_MATRIX_INTERVAL = 1  # ms
+DEBOUNCE_ALGORITHM = DebounceAlgorithm.EAGER_PER_KEY
+DEBOUNCE_TIME = 5  # ms
+KEY_MATRIX_BACKEND = KeyMatrixBackend.DIGITALIO
+TAPPING_TERM = 500  # ms, a ComplexModifierAssignment held longer than this is a modifier
+TAP_HOLD_MODE = TapHoldMode.HOLD_ON_OTHER_KEY_PRESS
+COMBO_TERM = 50  # ms, keys of a combo are held back for this long
+MACRO_REPORT_INTERVAL = HID_ENDPOINT_INTERVAL  # ms, the host takes one HID report per poll of the endpoint
+MOUSE_KEYS_INTERVAL = 8  # ms
+MOUSE_KEYS_CURVE = MouseKeysCurve.QUADRATIC
+MOUSE_KEYS_MAX_SPEED = 10  # times the move of the key
+MOUSE_KEYS_TIME_TO_MAX = 1000  # ms
+MOUSE_KEYS_WHEEL_INTERVAL = 80  # ms
+IDLE_TIMEOUT = 1000  # ms without any key pressed, None to scan all the time
+IDLE_SCAN_INTERVAL = 4  # ms, reading only the columns with all rows selected
+LATENCY_TRACE_ENABLED = True
+LATENCY_TRACE_IN_US = False  # stamp the spans in us with time.monotonic_ns(), which allocates a long int per stamp
+KEY_MAP_IN_NVM = True  # keys set over the usb_cdc data channel are kept in microcontroller.nvm
+USB_CONNECT_TIMEOUT = 3000  # ms to wait for the host at startup, e.g. on a charger the keys are scanned after it
 
 
 KEY_MAP_LAYERS = [
@@ -129,7 +147,7 @@ KEY_MAP_LAYERS = [
     ],
     [
         # ROW0 (Layer1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.ESCAPE),
+        TRANSPARENT,  # ESCAPE
         None,
         KeyAssignment(CodeType.KEYBOARD, Keycode.F1),  # ONE
         KeyAssignment(CodeType.KEYBOARD, Keycode.F2),  # TWO
@@ -138,32 +156,32 @@ KEY_MAP_LAYERS = [
         KeyAssignment(CodeType.KEYBOARD, Keycode.F5),  # FIVE
         KeyAssignment(CodeType.KEYBOARD, Keycode.F6),  # SIX
         # ROW1 (Layer1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.TAB),
+        TRANSPARENT,  # TAB
         None,
         None,
         KeyAssignment(CodeType.KEYBOARD, Keycode.HOME),  # Q
         KeyAssignment(CodeType.KEYBOARD, Keycode.UP_ARROW),  # W
         KeyAssignment(CodeType.KEYBOARD, Keycode.END),  # E
         KeyAssignment(CodeType.KEYBOARD, Keycode.PAGE_UP),  # R
-        KeyAssignment(CodeType.KEYBOARD, Keycode.T),
+        TRANSPARENT,  # T
         # ROW2 (Layer1)
         None,  # MO(1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.Z),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.X),
+        TRANSPARENT,  # Z
+        TRANSPARENT,  # X
         KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_ARROW),  # A
         KeyAssignment(CodeType.KEYBOARD, Keycode.DOWN_ARROW),  # S
         KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_ARROW),  # D
         KeyAssignment(CodeType.KEYBOARD, Keycode.PAGE_DOWN),  # F
-        KeyAssignment(CodeType.KEYBOARD, Keycode.G),
+        TRANSPARENT,  # G
         # ROW3 (Layer1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_SHIFT),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_CONTROL),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_ALT),  # left_option
-        ComplexModifierAssignment(Keycode.LEFT_GUI, KeycodeJp.JAPANESE_EISUU),  # left_command
-        KeyAssignment(CodeType.KEYBOARD, Keycode.SPACE),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.C),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.V),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.B),
+        TRANSPARENT,  # LEFT_SHIFT
+        TRANSPARENT,  # LEFT_CONTROL
+        TRANSPARENT,  # left_option
+        TRANSPARENT,  # left_command
+        TRANSPARENT,  # SPACE
+        TRANSPARENT,  # C
+        TRANSPARENT,  # V
+        TRANSPARENT,  # B
         # ROW4 (Layer1)
         KeyAssignment(CodeType.KEYBOARD, Keycode.F7),  # SEVEN
         KeyAssignment(CodeType.KEYBOARD, Keycode.F8),  # EIGHT
@@ -171,39 +189,39 @@ KEY_MAP_LAYERS = [
         KeyAssignment(CodeType.KEYBOARD, Keycode.F10),  # ZERO
         KeyAssignment(CodeType.KEYBOARD, Keycode.F11),  # MINUS
         KeyAssignment(CodeType.KEYBOARD, Keycode.F12),  # EQUALS
-        KeyAssignment(CodeType.KEYBOARD, Keycode.BACKSLASH),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.GRAVE_ACCENT),
+        TRANSPARENT,  # BACKSLASH
+        TRANSPARENT,  # GRAVE_ACCENT
         # ROW5 (Layer1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.Y),
+        TRANSPARENT,  # Y
         KeyAssignment(CodeType.KEYBOARD, Keycode.BACKSPACE),  # U
-        KeyAssignment(CodeType.KEYBOARD, Keycode.I),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.O),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.P),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_BRACKET),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_BRACKET),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.BACKSPACE),
+        TRANSPARENT,  # I
+        TRANSPARENT,  # O
+        TRANSPARENT,  # P
+        TRANSPARENT,  # LEFT_BRACKET
+        TRANSPARENT,  # RIGHT_BRACKET
+        TRANSPARENT,  # BACKSPACE
         # ROW6 (Layer1)
         KeyAssignment(CodeType.KEYBOARD, Keycode.ENTER),  # H
         KeyAssignment(CodeType.KEYBOARD, KeycodeJp.JAPANESE_KANA),  # J
-        KeyAssignment(CodeType.KEYBOARD, Keycode.K),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.L),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.SEMICOLON),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.QUOTE),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RETURN),
+        TRANSPARENT,  # K
+        TRANSPARENT,  # L
+        TRANSPARENT,  # SEMICOLON
+        TRANSPARENT,  # QUOTE
+        TRANSPARENT,  # RETURN
         None,  # MO(2)
         # ROW7 (Layer1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.N),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.M),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.COMMA),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.PERIOD),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.FORWARD_SLASH),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_SHIFT),
-        ComplexModifierAssignment(Keycode.RIGHT_GUI, KeycodeJp.JAPANESE_KANA),  # right_command
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_ALT),  # right_option (tentative))
+        TRANSPARENT,  # N
+        TRANSPARENT,  # M
+        TRANSPARENT,  # COMMA
+        TRANSPARENT,  # PERIOD
+        TRANSPARENT,  # FORWARD_SLASH
+        TRANSPARENT,  # RIGHT_SHIFT
+        TRANSPARENT,  # right_command
+        TRANSPARENT,  # right_option (tentative))
     ],
     [
         # ROW0 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.ESCAPE),
+        TRANSPARENT,  # ESCAPE
         None,
         KeyAssignment(CodeType.KEYBOARD, Keycode.F1),  # ONE
         KeyAssignment(CodeType.KEYBOARD, Keycode.F2),  # TWO
@@ -212,32 +230,32 @@ KEY_MAP_LAYERS = [
         KeyAssignment(CodeType.KEYBOARD, Keycode.F5),  # FIVE
         KeyAssignment(CodeType.KEYBOARD, Keycode.F6),  # SIX
         # ROW1 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.TAB),
+        TRANSPARENT,  # TAB
         None,
         None,
-        KeyAssignment(CodeType.KEYBOARD, Keycode.Q),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.W),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.E),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.R),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.T),
+        TRANSPARENT,  # Q
+        TRANSPARENT,  # W
+        TRANSPARENT,  # E
+        TRANSPARENT,  # R
+        TRANSPARENT,  # T
         # ROW2 (Layer2)
         KeyAssignment(CodeType.KEYBOARD, Keycode.CAPS_LOCK),  # MO(1)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.Z),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.X),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.A),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.S),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.D),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.F),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.G),
+        TRANSPARENT,  # Z
+        TRANSPARENT,  # X
+        TRANSPARENT,  # A
+        TRANSPARENT,  # S
+        TRANSPARENT,  # D
+        TRANSPARENT,  # F
+        TRANSPARENT,  # G
         # ROW3 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_SHIFT),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_CONTROL),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_ALT),  # left_option
-        ComplexModifierAssignment(Keycode.LEFT_GUI, KeycodeJp.JAPANESE_EISUU),  # left_command
-        KeyAssignment(CodeType.KEYBOARD, Keycode.SPACE),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.C),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.V),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.B),
+        TRANSPARENT,  # LEFT_SHIFT
+        TRANSPARENT,  # LEFT_CONTROL
+        TRANSPARENT,  # left_option
+        TRANSPARENT,  # left_command
+        TRANSPARENT,  # SPACE
+        TRANSPARENT,  # C
+        TRANSPARENT,  # V
+        TRANSPARENT,  # B
         # ROW4 (Layer2)
         KeyAssignment(CodeType.KEYBOARD, Keycode.F7),  # SEVEN
         KeyAssignment(CodeType.KEYBOARD, Keycode.F8),  # EIGHT
@@ -245,174 +263,179 @@ KEY_MAP_LAYERS = [
         KeyAssignment(CodeType.KEYBOARD, Keycode.F10),  # ZERO
         KeyAssignment(CodeType.KEYBOARD, Keycode.F11),  # MINUS
         KeyAssignment(CodeType.KEYBOARD, Keycode.F12),  # EQUALS
-        KeyAssignment(CodeType.KEYBOARD, Keycode.BACKSLASH),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.GRAVE_ACCENT),
+        TRANSPARENT,  # BACKSLASH
+        TRANSPARENT,  # GRAVE_ACCENT
         # ROW5 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.Y),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.U),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.I),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.O),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.P),
+        TRANSPARENT,  # Y
+        TRANSPARENT,  # U
+        TRANSPARENT,  # I
+        TRANSPARENT,  # O
+        TRANSPARENT,  # P
         KeyAssignment(CodeType.KEYBOARD, Keycode.UP_ARROW),  # LEFT_BRACKET
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_BRACKET),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.BACKSPACE),
+        TRANSPARENT,  # RIGHT_BRACKET
+        TRANSPARENT,  # BACKSPACE
         # ROW6 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.H),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.J),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.K),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.L),
+        TRANSPARENT,  # H
+        TRANSPARENT,  # J
+        TRANSPARENT,  # K
+        TRANSPARENT,  # L
         KeyAssignment(CodeType.KEYBOARD, Keycode.LEFT_ARROW),  # SEMICOLON
         KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_ARROW),  # QUOTE
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RETURN),
+        TRANSPARENT,  # RETURN
         None,  # MO(2)
         # ROW7 (Layer2)
-        KeyAssignment(CodeType.KEYBOARD, Keycode.N),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.M),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.COMMA),
-        KeyAssignment(CodeType.KEYBOARD, Keycode.PERIOD),
+        TRANSPARENT,  # N
+        TRANSPARENT,  # M
+        TRANSPARENT,  # COMMA
+        TRANSPARENT,  # PERIOD
         KeyAssignment(CodeType.KEYBOARD, Keycode.DOWN_ARROW),  # FORWARD_SLASH
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_SHIFT),
-        ComplexModifierAssignment(Keycode.RIGHT_GUI, KeycodeJp.JAPANESE_KANA),  # right_command
-        KeyAssignment(CodeType.KEYBOARD, Keycode.RIGHT_ALT),  # right_option (tentative))
+        TRANSPARENT,  # RIGHT_SHIFT
+        TRANSPARENT,  # right_command
+        TRANSPARENT,  # right_option (tentative))
     ],
 ]
 
+# Keys are (row, col), e.g. Combo(((3, 5), (3, 6)), KeyAssignment(CodeType.KEYBOARD, Keycode.ESCAPE)) for C+V
+COMBOS = [
+]
+
+
+def create_keyboard(devices):
+  nkro_device = find_nkro_device(devices)
+  if nkro_device is not None:
+    return NkroKeyboard(nkro_device)
+  from adafruit_hid.keyboard import Keyboard
+  return Keyboard(devices)
+
+
+def has_device(devices, usage_page, usage):
+  for device in devices:
+    if device.usage_page == usage_page and device.usage == usage:
+      return True
+  return False
+
 
-class ComplexModifierStatus:
-  def __init__(self):
-    self.is_still_standalone = True
+def create_mouse(devices):
+  from adafruit_hid.mouse import Mouse
+  return Mouse(devices)
+
+
+def create_consumer_control(devices):
+  from adafruit_hid.consumer_control import ConsumerControl
+  return ConsumerControl(devices)
+
+
+def attach_hid_objects(engine, devices):
+  """
+  Attach new HID objects to the engine. The mouse and the consumer control are imported and created only if the key
+  map has keys for them and boot.py enabled their devices, which it does not for a boot keyboard.
+  """
+  key_map = engine.key_map
+  mouse = None
+  if key_map.uses(KeyOp.MOUSE_MOVE, KeyOp.MOUSE_BUTTON) and has_device(devices, 0x01, 0x02):
+    mouse = create_mouse(devices)
+  consumer_control = None
+  if key_map.uses(KeyOp.CONSUMER_CONTROL) and has_device(devices, 0x0C, 0x01):
+    consumer_control = create_consumer_control(devices)
+  engine.attach(KeyboardOutput(create_keyboard(devices)), mouse, consumer_control)
+
+
+def reload_key_map(engine, devices):
+  """
+  Resolve the layers again after keys were set over the data channel, creating the HID objects the new keys send to.
+  """
+  engine.reload_key_map()
+  key_map = engine.key_map
+  if engine.mouse is None and key_map.uses(KeyOp.MOUSE_BUTTON) and has_device(devices, 0x01, 0x02):
+    engine.mouse = create_mouse(devices)
+  if engine.consumer_control is None and key_map.uses(KeyOp.CONSUMER_CONTROL) and has_device(devices, 0x0C, 0x01):
+    engine.consumer_control = create_consumer_control(devices)
+
+
+def rebuild_hid_object(engine, device, devices):
+  """
+  Rebuild only the HID object of `device`, which is back after its sends failed. The engine keeps its key state.
+  """
+  if device.usage_page == 0x01 and device.usage == 0x06:
+    engine.keyboard_output.keyboard = create_keyboard(devices)
+  elif device.usage_page == 0x01 and device.usage == 0x02 and engine.mouse is not None:
+    engine.mouse = create_mouse(devices)
+  elif device.usage_page == 0x0C and engine.consumer_control is not None:
+    engine.consumer_control = create_consumer_control(devices)
 
 
 if __name__ == '__main__':
-  key_matrix = KeyMatrix()
-  key_event_planners = [KeyEventPlanner() for _ in range(len(key_matrix.row_ios) * len(key_matrix.col_ios))]
+  startup_timing = StartupTiming(startup_time)
+  startup_timing.mark('imports')
+  if KEY_MATRIX_BACKEND == KeyMatrixBackend.KEYPAD:
+    from octave_pcb.keypad_key_matrix import KeypadKeyMatrix
+    key_matrix = KeypadKeyMatrix(SCAN_KEY_MATRIX_INTERVAL / 1000)
+  elif KEY_MATRIX_BACKEND == KeyMatrixBackend.PIO:
+    from octave_pcb.pio_key_matrix import PioKeyMatrix
+    key_matrix = PioKeyMatrix()
+  else:
+    key_matrix = KeyMatrix()
+  debouncer = Debouncer(key_matrix.num_rows, key_matrix.num_cols, DEBOUNCE_ALGORITHM, DEBOUNCE_TIME)
+  # Macros are compiled into keycodes here, so the layout needs no keyboard
+  key_map = CompiledKeyMap(KEY_MAP_LAYERS, combos=COMBOS, keyboard_layout=KeyboardLayoutUS(None))
+  if KEY_MAP_IN_NVM:
+    # The layers stored in NVM, if any, replace KEY_MAP_LAYERS
+    keymap_server = KeymapServer(BinaryKeyMap(microcontroller.nvm, key_matrix.num_rows, key_matrix.num_cols), key_map,
+                                 lambda: reload_key_map(engine, recovery.devices))
+  else:
+    keymap_server = None
+  startup_timing.mark('key map')
+  engine = KeyboardEngine(key_map, key_matrix.num_rows, key_matrix.num_cols, TapHoldEngine(TAPPING_TERM, TAP_HOLD_MODE),
+                          ComboEngine(key_map.combos, key_matrix.num_rows, key_matrix.num_cols, COMBO_TERM),
+                          MacroEngine(key_map.macros, MACRO_REPORT_INTERVAL),
+                          MouseKeysEngine(MOUSE_KEYS_INTERVAL, MOUSE_KEYS_CURVE, MOUSE_KEYS_MAX_SPEED,
+                                          MOUSE_KEYS_TIME_TO_MAX, MOUSE_KEYS_WHEEL_INTERVAL))
+  latency_trace = LatencyTrace(ticks_us=ticks_us if LATENCY_TRACE_IN_US else None) if LATENCY_TRACE_ENABLED else None
+  if IDLE_TIMEOUT is not None and KEY_MATRIX_BACKEND == KeyMatrixBackend.DIGITALIO:
+    idle_monitor = IdleMonitor(key_matrix, IDLE_TIMEOUT, IDLE_SCAN_INTERVAL)
+  else:
+    idle_monitor = None
 
   cpu_pixpower = digitalio.DigitalInOut(board.NEOPIX_POWER)
   cpu_pixpower.switch_to_output(True, digitalio.DriveMode.PUSH_PULL)
+  startup_timing.mark('engine')
+
+  # Reports sent before the host has enumerated the keyboard are lost
+  wait_for_usb(supervisor.runtime, USB_CONNECT_TIMEOUT)
+  startup_timing.mark('usb')
+
+  # HID sends are retried, and a device that stays failed is probed once the host is back
+  recovery = Recovery(usb_hid.devices, supervisor.runtime)
 
-  # Sleep for a bit to avoid a race condition on some systems
-  time.sleep(2)
+  def on_device_recovered(device):
+    rebuild_hid_object(engine, device, recovery.devices)
+    print('HID device recovered: {} recoveries, {} failures, {} retries'.format(
+        recovery.num_recoveries, recovery.num_failures, recovery.num_retries))
 
+  if usb_cdc.data is not None:
+    # The main loop reads only the bytes that have arrived; a read never waits for more
+    usb_cdc.data.timeout = 0
+  main_loop = MainLoop(key_matrix, debouncer, engine, recovery, on_device_recovered, usb_cdc.data, keymap_server,
+                       latency_trace, idle_monitor)
   while True:
     try:
-      keyboard = Keyboard(usb_hid.devices)
-      keyboard_layout = KeyboardLayoutUS(keyboard)
-      mouse = Mouse(usb_hid.devices)
-      consumer_control = ConsumerControl(usb_hid.devices)
+      attach_hid_objects(engine, recovery.devices)
+      if startup_timing is not None:
+        startup_timing.mark('hid')
 
-      key_events = [None for _ in range(len(key_event_planners))]
-      key_map_layer = 0
-      pressed_keys = [None for _ in range(len(key_event_planners))]
-      complex_modifier_status_list = [None for _ in range(len(key_event_planners))]
-
-      scan_key_matrix_timing = time.monotonic()  # For debounce
+      scheduler = Scheduler(SCAN_KEY_MATRIX_INTERVAL)
+      main_loop.scheduler = scheduler
       while True:
-        current_time = time.monotonic()
-
-        if current_time >= scan_key_matrix_timing:
-          are_keys_pressed = key_matrix.scan_matrix()
-          for i, key_event_planner in enumerate(key_event_planners):
-            key_events[i] = key_event_planner.make_event(
-                current_time, are_keys_pressed[i])
-
-          # Check whether to stop standalone of complex modifiers
-          stop_standalone_of_complex_modifiers = False
-          for i, key_event in enumerate(key_events):
-            if key_event == KeyEvent.PRESS:
-              if isinstance(KEY_MAP_LAYERS[key_map_layer][i], KeyAssignment):
-                stop_standalone_of_complex_modifiers = True
-          if stop_standalone_of_complex_modifiers:
-            for i in range(len(complex_modifier_status_list)):
-              if complex_modifier_status_list[i] is not None and complex_modifier_status_list[i].is_still_standalone:
-                complex_modifier_status_list[i].is_still_standalone = False
-                if (pressed_keys[i].modifier == KeycodeLayer.MO1):
-                  key_map_layer = 1
-                elif (pressed_keys[i].modifier == KeycodeLayer.MO2):
-                  key_map_layer = 2
-                else:
-                  keyboard.press(pressed_keys[i].modifier)
-
-          for i, key_event in enumerate(key_events):
-            if key_event == KeyEvent.PRESS:
-              # print(f"""pressed : {i}""")
-              pressed_keys[i] = KEY_MAP_LAYERS[key_map_layer][i]
-              key_assignment = pressed_keys[i]
-              if key_assignment is None:
-                pass
-              elif isinstance(key_assignment, ComplexModifierAssignment):
-                complex_modifier_status_list[i] = ComplexModifierStatus()
-              elif isinstance(key_assignment, KeyAssignment):
-                if key_assignment.type == CodeType.KEYBOARD:
-                  if (key_assignment.code == KeycodeLayer.MO1):
-                    key_map_layer = 1
-                  elif (key_assignment.code == KeycodeLayer.MO2):
-                    key_map_layer = 2
-                  else:
-                    keyboard.press(key_assignment.code)
-                elif key_assignment.type == CodeType.MOUSE_MOVE:
-                  mouse.move(**key_assignment.code)
-                elif key_assignment.type == CodeType.MOUSE_BUTTON:
-                  mouse.press(key_assignment.code)
-                elif key_assignment.type == CodeType.CONSUMER_CONTROL:
-                  consumer_control.press(key_assignment.code)
-              elif isinstance(key_assignment, LambdaAssignment) and key_assignment.on_press is not None:
-                key_assignment.on_press()
-            elif key_event == KeyEvent.LONG_PRESS:
-              # print(f"""pressed : {i}""")
-              key_assignment = pressed_keys[i]
-              if key_assignment is None:
-                pass
-              elif isinstance(key_assignment, ComplexModifierAssignment):
-                if complex_modifier_status_list[i].is_still_standalone:
-                  complex_modifier_status_list[i].is_still_standalone = False
-                  if (key_assignment.modifier == KeycodeLayer.MO1):
-                    key_map_layer = 1
-                  elif (key_assignment.modifier == KeycodeLayer.MO2):
-                    key_map_layer = 2
-                  else:
-                    keyboard.press(key_assignment.modifier)
-              elif isinstance(key_assignment, KeyAssignment):
-                if key_assignment.type == CodeType.KEYBOARD:
-                  # print(f"""pressed : {i}""")
-                  if not is_code_mo(key_assignment.code):
-                    keyboard.press(key_assignment.code)
-                elif key_assignment.type == CodeType.MOUSE_MOVE:
-                  # print(f"""pressed : {i}""")
-                  mouse.move(**key_assignment.code)
-            elif key_event == KeyEvent.RELEASE:
-              # print(f"""released: {i}""")
-              key_assignment = pressed_keys[i]
-              pressed_keys[i] = None
-              if key_assignment is None:
-                pass
-              elif isinstance(key_assignment, ComplexModifierAssignment):
-                complex_modifier_status = complex_modifier_status_list[i]
-                if complex_modifier_status.is_still_standalone:
-                  if not is_code_mo(key_assignment.code_for_standalone):
-                    keyboard.press(key_assignment.code_for_standalone)
-                    keyboard.release(key_assignment.code_for_standalone)
-                else:
-                  if is_code_mo(key_assignment.modifier):
-                    key_map_layer = 0
-                  else:
-                    keyboard.release(key_assignment.modifier)
-                complex_modifier_status_list[i] = None
-              elif isinstance(key_assignment, KeyAssignment):
-                if key_assignment.type == CodeType.KEYBOARD:
-                  if is_code_mo(key_assignment.code):
-                    key_map_layer = 0
-                  else:
-                    keyboard.release(key_assignment.code)
-                elif key_assignment.type == CodeType.MOUSE_BUTTON:
-                  mouse.release(key_assignment.code)
-                elif key_assignment.type == CodeType.CONSUMER_CONTROL:
-                  consumer_control.release()
-              elif isinstance(key_assignment, LambdaAssignment) and key_assignment.on_release is not None:
-                key_assignment.on_release()
-
-          scan_key_matrix_timing += SCAN_KEY_MATRIX_INTERVAL
-          if scan_key_matrix_timing <= current_time:
-            scan_key_matrix_timing = current_time + SCAN_KEY_MATRIX_INTERVAL
-
-    except Exception:
-      time.sleep(3)
+        # Sleep until the next scan tick or an earlier requested deadline
+        if not main_loop.tick(scheduler.wait()):
+          continue
+
+        if startup_timing is not None:
+          startup_timing.mark('first scan')
+          print(startup_timing.format())
+          startup_timing = None
+
+    except Exception as error:
+      delay = recovery.restart_delay(error)
+      print('Restarting in {} s after {!r}, {} restarts'.format(delay, error, recovery.num_restarts))
+      time.sleep(delay)
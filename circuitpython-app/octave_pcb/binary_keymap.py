@@ -0,0 +1,186 @@
+from octave_pcb.hid_output import is_modifier
+from octave_pcb.keymap import KeyOp
+from octave_pcb.nkro_keyboard import NKRO_NUM_KEYCODES
+
+MAGIC = b'OK'
+VERSION = 1
+HEADER_LENGTH = 8
+RECORD_LENGTH = 4
+# The ops whose arg is the whole assignment; the others refer to the side table or the macros of code.py
+STORABLE_OPS = (KeyOp.NONE, KeyOp.KEYBOARD, KeyOp.LAYER, KeyOp.MOUSE_BUTTON, KeyOp.CONSUMER_CONTROL,
+                KeyOp.COMPLEX_MODIFIER, KeyOp.COMPLEX_LAYER, KeyOp.TRANSPARENT)
+
+
+def is_sendable_keycode(keycode):
+  # A modifier or a keycode of the NKRO bitmap; the keyboard raises on others
+  return 0 <= keycode < NKRO_NUM_KEYCODES or is_modifier(keycode)
+
+
+def check_storable(op, arg, num_layers):
+  """
+  Raise ValueError unless `op` is storable and `arg` is valid for it, in a key map of `num_layers` layers.
+  """
+  if op not in STORABLE_OPS:
+    raise ValueError('Op not storable: {}'.format(op))
+  if not 0 <= arg <= 0xFFFF:
+    raise ValueError('Arg out of range: {}'.format(arg))
+  if op == KeyOp.NONE or op == KeyOp.TRANSPARENT:
+    is_valid = arg == 0
+  elif op == KeyOp.KEYBOARD:
+    is_valid = is_sendable_keycode(arg)
+  elif op == KeyOp.LAYER:
+    is_valid = arg < num_layers
+  elif op == KeyOp.MOUSE_BUTTON:
+    is_valid = arg <= 0xFF
+  elif op == KeyOp.COMPLEX_MODIFIER:
+    is_valid = is_sendable_keycode(arg >> 8) and (arg & 0xFF == 0 or is_sendable_keycode(arg & 0xFF))
+  elif op == KeyOp.COMPLEX_LAYER:
+    is_valid = arg >> 8 < num_layers and (arg & 0xFF == 0 or is_sendable_keycode(arg & 0xFF))
+  else:
+    # A consumer control code is the whole 16 bits of its report
+    is_valid = True
+  if not is_valid:
+    raise ValueError('Arg {:#06x} not valid for op {}'.format(arg, op))
+
+
+def encode_record(op, arg, num_layers):
+  check_storable(op, arg, num_layers)
+  return bytes((op & 0xFF, op >> 8, arg & 0xFF, arg >> 8))
+
+
+def encode_key_map(layers, num_rows, num_cols):
+  """
+  Return the header and the records of compiled layer tables, e.g. CompiledKeyMap.layers.
+  """
+  num_keys = num_rows * num_cols
+  data = bytearray(HEADER_LENGTH + len(layers) * num_keys * RECORD_LENGTH)
+  data[0:2] = MAGIC
+  data[2] = VERSION
+  data[3] = len(layers)
+  data[4] = num_rows
+  data[5] = num_cols
+  position = HEADER_LENGTH
+  for layer in layers:
+    if len(layer) != 2 * num_keys:
+      raise ValueError('Layer of {} keys, not {}'.format(len(layer) // 2, num_keys))
+    for i in range(num_keys):
+      data[position:position + RECORD_LENGTH] = encode_record(layer[2 * i], layer[2 * i + 1], len(layers))
+      position += RECORD_LENGTH
+  return data
+
+
+class BinaryLayer:
+  """
+  A layer of a BinaryKeyMap, indexed like a compiled layer table: [2 * i] is the op and [2 * i + 1] the arg of key i.
+  """
+
+  def __init__(self, buffer, offset, num_keys):
+    self._buffer = buffer
+    self._offset = offset
+    self._num_keys = num_keys
+
+  def __len__(self):
+    return 2 * self._num_keys
+
+  def __getitem__(self, n):
+    if not 0 <= n < 2 * self._num_keys:
+      raise IndexError('Layer index out of range')
+    position = self._offset + 2 * n
+    return self._buffer[position] | self._buffer[position + 1] << 8
+
+
+class BinaryKeyMap:
+  """
+  Key map layers stored in `buffer`, e.g. microcontroller.nvm, so that keys can be changed without editing code.py:
+
+  - An 8-byte header: MAGIC, VERSION, the number of layers, rows and cols, and 2 reserved bytes
+  - A 4-byte record for each layer, row and col in this order: op and arg as little-endian uint16
+
+  The records are read in place, with no copy: through a memoryview if `buffer` supports it, otherwise by subscript,
+  as nvm.ByteArray has no buffer protocol. `layers` is empty unless the buffer holds a key map of this matrix.
+  """
+
+  def __init__(self, buffer, num_rows, num_cols):
+    try:
+      buffer = memoryview(buffer)
+    except TypeError:
+      pass
+    self._buffer = buffer
+    self.num_rows = num_rows
+    self.num_cols = num_cols
+    self.layers = []
+    self._load()
+
+  @property
+  def is_valid(self):
+    return len(self.layers) > 0
+
+  @property
+  def records_length(self):
+    return len(self.layers) * self.num_rows * self.num_cols * RECORD_LENGTH
+
+  def _load(self):
+    buffer = self._buffer
+    num_keys = self.num_rows * self.num_cols
+    self.layers = []
+    if len(buffer) < HEADER_LENGTH or buffer[0] != MAGIC[0] or buffer[1] != MAGIC[1] or buffer[2] != VERSION:
+      return
+    if buffer[4] != self.num_rows or buffer[5] != self.num_cols:
+      return
+    num_layers = buffer[3]
+    if HEADER_LENGTH + num_layers * num_keys * RECORD_LENGTH > len(buffer):
+      return
+    self.layers = [BinaryLayer(buffer, HEADER_LENGTH + layer * num_keys * RECORD_LENGTH, num_keys)
+                   for layer in range(num_layers)]
+
+  def write(self, layers):
+    """
+    Replace the key map in the buffer with compiled layer tables. Raise ValueError if any key is not storable.
+    """
+    data = encode_key_map(layers, self.num_rows, self.num_cols)
+    if len(data) > len(self._buffer):
+      raise ValueError('Key map of {} bytes does not fit in {}'.format(len(data), len(self._buffer)))
+    self._buffer[0:len(data)] = data
+    self._load()
+
+  def erase(self):
+    self._buffer[0:2] = b'\x00\x00'
+    self._load()
+
+  def get(self, layer, row, col):
+    """
+    Return the (op, arg) of a key.
+    """
+    i = self._key_index(layer, row, col)
+    return self.layers[layer][2 * i], self.layers[layer][2 * i + 1]
+
+  def set(self, layer, row, col, op, arg):
+    position = HEADER_LENGTH + (layer * self.num_rows * self.num_cols + self._key_index(layer, row, col)) \
+        * RECORD_LENGTH
+    self._buffer[position:position + RECORD_LENGTH] = encode_record(op, arg, len(self.layers))
+
+  def read_records(self, offset, size):
+    """
+    Return `size` bytes of the records from `offset`, counted from the first record.
+    """
+    if offset < 0 or size < 0 or offset + size > self.records_length:
+      raise ValueError('Out of the records: {} + {}'.format(offset, size))
+    return bytes(self._buffer[HEADER_LENGTH + offset:HEADER_LENGTH + offset + size])
+
+  def write_records(self, offset, data):
+    """
+    Overwrite whole records from `offset`, counted from the first record, with `data`.
+    """
+    if offset % RECORD_LENGTH != 0 or len(data) % RECORD_LENGTH != 0:
+      raise ValueError('Not whole records: {} + {}'.format(offset, len(data)))
+    if offset < 0 or offset + len(data) > self.records_length:
+      raise ValueError('Out of the records: {} + {}'.format(offset, len(data)))
+    for position in range(0, len(data), RECORD_LENGTH):
+      check_storable(data[position] | data[position + 1] << 8, data[position + 2] | data[position + 3] << 8,
+                     len(self.layers))
+    self._buffer[HEADER_LENGTH + offset:HEADER_LENGTH + offset + len(data)] = data
+
+  def _key_index(self, layer, row, col):
+    if not (0 <= layer < len(self.layers) and 0 <= row < self.num_rows and 0 <= col < self.num_cols):
+      raise ValueError('No key at layer {}, row {}, col {}'.format(layer, row, col))
+    return row * self.num_cols + col
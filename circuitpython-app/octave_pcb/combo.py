@@ -0,0 +1,133 @@
+from array import array
+
+from octave_pcb.ticks import ticks_add, ticks_less
+
+MAX_COMBO_KEYS = 4
+
+
+def pack_keys(key_indices):
+  """
+  Pack up to MAX_COMBO_KEYS key indices into a small int, 7 bits each in ascending order, so that a set of keys
+  is a dict key that does not allocate.
+  """
+  packed = 0
+  for i in sorted(key_indices):
+    packed = packed << 7 | (i + 1)
+  return packed
+
+
+def insert_key(packed, i):
+  """
+  Return `packed` with the key index `i` added, keeping the order of pack_keys().
+  """
+  result = 0
+  shift = 0
+  is_inserted = False
+  while packed != 0:
+    j = (packed & 0x7F) - 1
+    if not is_inserted and i > j:
+      result |= (i + 1) << shift
+      shift += 7
+      is_inserted = True
+    result |= (j + 1) << shift
+    shift += 7
+    packed >>= 7
+  if not is_inserted:
+    result |= (i + 1) << shift
+  return result
+
+
+class ComboEngine:
+  """
+  Combos (chords) indexed by the set of their keys: matching the keys held back is a dict lookup, whatever the number
+  of combos.
+
+  A key of some combo is held back for `combo_term` ms. The held-back keys fire a combo when they are exactly its
+  keys and no larger combo is possible, or when the term passes or one of them is released while they are the keys of
+  a combo. Otherwise they go out as individual key presses.
+
+  The first key of a fired combo carries its (op, arg) in the engine; the combo is released with any of its keys.
+  """
+
+  def __init__(self, combos, num_rows, num_cols, combo_term=50):
+    """
+    `combos` are the (keys, op, arg) of CompiledKeyMap.combos, keys being (row, col) pairs.
+    """
+    self.combo_term = combo_term
+    num_keys = num_rows * num_cols
+    self._is_combo_key = bytearray(num_keys)
+    # Packed keys of each combo -> index of the combo
+    self._combo_indices = {}
+    # Packed keys of each proper subset of some combo
+    self._partial_keys = set()
+    self.ops = bytearray(len(combos))
+    self.args = array('H', [0 for _ in range(len(combos))])
+    for n, (keys, op, arg) in enumerate(combos):
+      if not 2 <= len(keys) <= MAX_COMBO_KEYS:
+        raise ValueError('A combo has 2 to {} keys: {}'.format(MAX_COMBO_KEYS, keys))
+      key_indices = [row * num_cols + col for row, col in keys]
+      for i in key_indices:
+        self._is_combo_key[i] = 1
+      self._combo_indices[pack_keys(key_indices)] = n
+      for subset in range(1, (1 << len(key_indices)) - 1):
+        self._partial_keys.add(pack_keys([key_indices[k] for k in range(len(key_indices)) if subset & (1 << k)]))
+      self.ops[n] = op
+      self.args[n] = arg
+    # Keys held back, in the order of press, and their packed set
+    self.pending_keys = []
+    self.pending_packed = 0
+    self.deadline = 0
+    # For each key of a fired combo, its carrier key + 1 (0: none), and the packed keys of each carrier
+    self._carriers = bytearray(num_keys)
+    self._carried_keys = array('L', [0 for _ in range(num_keys)])
+
+  def clear(self):
+    self.pending_keys.clear()
+    self.pending_packed = 0
+    for i in range(len(self._carriers)):
+      self._carriers[i] = 0
+
+  def is_combo_key(self, i):
+    return self._is_combo_key[i] != 0
+
+  def is_pending(self, i):
+    return i in self.pending_keys
+
+  def is_expired(self, current_time):
+    return len(self.pending_keys) > 0 and not ticks_less(current_time, self.deadline)
+
+  def hold_back(self, i, current_time):
+    if len(self.pending_keys) == 0:
+      self.deadline = ticks_add(current_time, self.combo_term)
+    self.pending_keys.append(i)
+    self.pending_packed = insert_key(self.pending_packed, i)
+
+  def find(self, packed):
+    """
+    Return the index of the combo of exactly the packed keys, or -1.
+    """
+    return self._combo_indices.get(packed, -1)
+
+  def is_partial(self, packed):
+    return packed in self._partial_keys
+
+  def activate(self):
+    """
+    Fire the combo of the held-back keys and return the carrier key.
+    """
+    carrier = self.pending_keys[0]
+    for i in self.pending_keys:
+      self._carriers[i] = carrier + 1
+    self._carried_keys[carrier] = self.pending_packed
+    self.pending_keys.clear()
+    self.pending_packed = 0
+    return carrier
+
+  def carrier_of(self, i):
+    return self._carriers[i] - 1
+
+  def deactivate(self, carrier):
+    packed = self._carried_keys[carrier]
+    while packed != 0:
+      self._carriers[(packed & 0x7F) - 1] = 0
+      packed >>= 7
@@ -0,0 +1,296 @@
+from array import array
+
+from octave_pcb.combo import ComboEngine, insert_key
+from octave_pcb.key_event import KeyEvent, KeyEventPlanner
+from octave_pcb.keymap import KeyOp, is_complex_modifier_op, is_key_assignment_op
+from octave_pcb.macro import MacroEngine
+from octave_pcb.mouse_keys import MouseKeysEngine
+from octave_pcb.tap_hold import TapHoldEngine, TapHoldMode
+
+
+class KeyboardEngine:
+  """
+  The state of the main loop: turns the debounced matrix state of each scan into key events, and key events into
+  HID output through the compiled key map.
+
+  It does not touch hardware, so it runs on the host with stand-in HID devices.
+  """
+
+  def __init__(self, key_map, num_rows, num_cols, tap_hold=None, combo=None, macro=None, mouse_keys=None):
+    self.key_map = key_map
+    self._num_rows = num_rows
+    self._num_cols = num_cols
+    num_keys = num_rows * num_cols
+    self.key_event_planners = [KeyEventPlanner() for _ in range(num_keys)]
+    self._last_row_states = bytearray(num_rows)
+    # Events of the current scan, in the order of key index
+    self._key_event_indices = [0 for _ in range(num_keys)]
+    self._key_events = [None for _ in range(num_keys)]
+    self.num_key_events = 0
+    # Active layers, bit n for layer n, and the key map table of them
+    self.layer_mask = 1
+    self.layer_table = key_map.resolve(1)
+    # The op and arg of each key at the time it was pressed
+    self.pressed_ops = bytearray(num_keys)
+    self.pressed_args = array('H', [0 for _ in range(num_keys)])
+    # Tap-hold keys whose tap or hold is not decided yet
+    self.tap_hold = tap_hold if tap_hold is not None else TapHoldEngine()
+    # Combo keys held back, and fired combos
+    self.combo = combo if combo is not None else ComboEngine(key_map.combos, num_rows, num_cols)
+    # Macros being typed
+    self.macro = macro if macro is not None else MacroEngine(key_map.macros)
+    # Pointer moves of the held mouse move keys
+    self.mouse_keys = mouse_keys if mouse_keys is not None else MouseKeysEngine()
+    # The mouse and the consumer control are None while their devices are not enabled, and their keys send nothing
+    self.keyboard_output = None
+    self.mouse = None
+    self.consumer_control = None
+
+  def attach(self, keyboard_output, mouse, consumer_control):
+    """
+    Send the output to the given devices, starting over with no key assigned. The key event planners are kept.
+    """
+    self.keyboard_output = keyboard_output
+    self.mouse = mouse
+    self.consumer_control = consumer_control
+    self._set_layer_mask(1)
+    for i in range(len(self.pressed_ops)):
+      self.pressed_ops[i] = KeyOp.NONE
+    self.tap_hold.clear()
+    self.combo.clear()
+    self.macro.clear()
+    self.mouse_keys.clear()
+
+  def reload_key_map(self):
+    """
+    Resolve the active layers again after the key map changed. Pressed keys are released as they were pressed.
+    """
+    self._set_layer_mask(self.layer_mask)
+
+  @property
+  def is_quiet(self):
+    # No key is pressed and nothing is left to send
+    for row_state in self._last_row_states:
+      if row_state != 0:
+        return False
+    return not self.macro.is_playing and not self.mouse_keys.is_moving
+
+  def plan_events(self, current_time, row_states, scheduler=None):
+    """
+    Make the key events of a scan and return the number of them. Only the keys that are pressed now or were pressed
+    at the last scan are visited, i.e. changed keys and keys that may have a long press pending.
+    """
+    key_event_planners = self.key_event_planners
+    last_row_states = self._last_row_states
+    num_cols = self._num_cols
+    num_key_events = 0
+    for row in range(self._num_rows):
+      row_state = row_states[row]
+      visit_bits = row_state | last_row_states[row]
+      last_row_states[row] = row_state
+      if visit_bits == 0:
+        continue
+      for col in range(num_cols):
+        bit = 1 << col
+        if visit_bits & bit:
+          i = row * num_cols + col
+          key_event_planner = key_event_planners[i]
+          key_event = key_event_planner.make_event(current_time, (row_state & bit) != 0)
+          if scheduler is not None and key_event_planner.long_press_timing is not None:
+            scheduler.request(key_event_planner.long_press_timing)
+          if key_event is not None:
+            self._key_event_indices[num_key_events] = i
+            self._key_events[num_key_events] = key_event
+            num_key_events += 1
+    self.num_key_events = num_key_events
+    return num_key_events
+
+  def dispatch_events(self, current_time, scheduler=None):
+    """
+    Dispatch the key events of the last plan_events. Tap-hold keys (complex modifiers) are decided by the tap-hold
+    engine, which only tracks the undecided ones.
+    """
+    tap_hold = self.tap_hold
+
+    if len(tap_hold.pending_keys) > 0 and tap_hold.mode == TapHoldMode.HOLD_ON_OTHER_KEY_PRESS:
+      # Any key pressed in this scan decides hold before it is dispatched
+      layer_table = self.layer_table
+      for n in range(self.num_key_events):
+        if self._key_events[n] == KeyEvent.PRESS and is_key_assignment_op(layer_table[2 * self._key_event_indices[n]]):
+          self._hold_pending_keys()
+          break
+
+    for n in range(self.num_key_events):
+      self._handle_combo_event(current_time, self._key_event_indices[n], self._key_events[n])
+    if self.combo.is_expired(current_time):
+      self._resolve_combo(current_time)
+
+    while True:
+      i = tap_hold.expired_key(current_time)
+      if i < 0:
+        break
+      self._hold(i)
+      if len(tap_hold.pending_keys) == 0 and len(tap_hold.queued_keys) > 0:
+        self._dispatch_queued_events(current_time)
+    self.macro.play(current_time, self.keyboard_output)
+    if self.mouse is not None:
+      self.mouse_keys.update(current_time, self.mouse)
+    if scheduler is not None:
+      if len(tap_hold.pending_keys) > 0:
+        scheduler.request(tap_hold.next_deadline())
+      if len(self.combo.pending_keys) > 0:
+        scheduler.request(self.combo.deadline)
+      if self.mouse_keys.is_moving:
+        scheduler.request(self.mouse_keys.next_timing)
+
+  def _set_layer_mask(self, layer_mask):
+    # Layer 0 is always active
+    self.layer_mask = layer_mask | 1
+    self.layer_table = self.key_map.resolve(self.layer_mask)
+
+  def _hold(self, i):
+    self.tap_hold.remove(i)
+    if self.pressed_ops[i] == KeyOp.COMPLEX_LAYER:
+      self._set_layer_mask(self.layer_mask | 1 << (self.pressed_args[i] >> 8))
+    else:
+      self.keyboard_output.press(self.pressed_args[i] >> 8)
+
+  def _hold_pending_keys(self):
+    pending_keys = self.tap_hold.pending_keys
+    while len(pending_keys) > 0:
+      self._hold(pending_keys[0])
+
+  def _handle_combo_event(self, current_time, i, key_event):
+    combo = self.combo
+    carrier = combo.carrier_of(i)
+    if carrier >= 0:
+      # A key of a fired combo: the combo is released with any of its keys, and only repeats on its carrier key
+      if key_event == KeyEvent.RELEASE:
+        combo.deactivate(carrier)
+        self._handle_event(current_time, carrier, KeyEvent.RELEASE)
+      elif key_event == KeyEvent.LONG_PRESS and i == carrier:
+        self._handle_event(current_time, i, key_event)
+      return
+    if key_event == KeyEvent.PRESS:
+      if len(combo.pending_keys) > 0:
+        packed = insert_key(combo.pending_packed, i)
+        if combo.is_partial(packed):
+          combo.hold_back(i, current_time)
+          return
+        if combo.find(packed) >= 0:
+          # No larger combo is possible
+          combo.hold_back(i, current_time)
+          self._resolve_combo(current_time)
+          return
+        self._resolve_combo(current_time)
+      if combo.is_combo_key(i):
+        combo.hold_back(i, current_time)
+        return
+    elif combo.is_pending(i):
+      # A held-back key is released (or long pressed) before the combo term
+      self._resolve_combo(current_time)
+      self._handle_combo_event(current_time, i, key_event)
+      return
+    self._handle_event(current_time, i, key_event)
+
+  def _resolve_combo(self, current_time):
+    # Fire the combo of the held-back keys, or send them as individual key presses
+    combo = self.combo
+    n = combo.find(combo.pending_packed)
+    if n >= 0:
+      carrier = combo.activate()
+      self._press(current_time, carrier, combo.ops[n], combo.args[n])
+    else:
+      pending_keys = combo.pending_keys[:]
+      combo.pending_keys.clear()
+      combo.pending_packed = 0
+      for i in pending_keys:
+        self._handle_event(current_time, i, KeyEvent.PRESS)
+
+  def _handle_event(self, current_time, i, key_event):
+    tap_hold = self.tap_hold
+    if len(tap_hold.pending_keys) > 0 and tap_hold.mode == TapHoldMode.PERMISSIVE_HOLD \
+        and (key_event == KeyEvent.PRESS or tap_hold.is_queued(i)):
+      if key_event == KeyEvent.RELEASE or tap_hold.is_queue_full():
+        # Another key was pressed and released within the tapping term
+        self._hold_pending_keys()
+        self._dispatch_queued_events(current_time)
+        # A queued tap-hold key may be undecided again
+        self._handle_event(current_time, i, key_event)
+      else:
+        tap_hold.queue(i, key_event)
+      return
+    self._dispatch_event(current_time, i, key_event)
+    if len(tap_hold.pending_keys) == 0 and len(tap_hold.queued_keys) > 0:
+      self._dispatch_queued_events(current_time)
+
+  def _dispatch_queued_events(self, current_time):
+    # The queued events are handled again in order, as a queued tap-hold key may become undecided
+    tap_hold = self.tap_hold
+    queued_keys = tap_hold.queued_keys[:]
+    queued_events = tap_hold.queued_events[:]
+    tap_hold.queued_keys.clear()
+    tap_hold.queued_events.clear()
+    for n in range(len(queued_keys)):
+      self._handle_event(current_time, queued_keys[n], queued_events[n])
+
+  def _press(self, current_time, i, op, arg):
+    key_map = self.key_map
+    self.pressed_ops[i] = op
+    self.pressed_args[i] = arg
+    if op == KeyOp.KEYBOARD:
+      self.keyboard_output.press(arg)
+    elif op == KeyOp.LAYER:
+      self._set_layer_mask(self.layer_mask | 1 << arg)
+    elif is_complex_modifier_op(op):
+      self.tap_hold.press(i, current_time)
+    elif op == KeyOp.MOUSE_MOVE:
+      self.mouse_keys.press(current_time, key_map.side_table[arg])
+    elif op == KeyOp.MOUSE_BUTTON and self.mouse is not None:
+      self.mouse.press(arg)
+    elif op == KeyOp.CONSUMER_CONTROL and self.consumer_control is not None:
+      self.consumer_control.press(arg)
+    elif op == KeyOp.LAMBDA and key_map.side_table[arg].on_press is not None:
+      key_map.side_table[arg].on_press()
+    elif op == KeyOp.MACRO:
+      self.macro.start(arg)
+
+  def _dispatch_event(self, current_time, i, key_event):
+    key_map = self.key_map
+    keyboard_output = self.keyboard_output
+    pressed_ops = self.pressed_ops
+    pressed_args = self.pressed_args
+    if key_event == KeyEvent.PRESS:
+      # print(f"""pressed : {i}""")
+      self._press(current_time, i, self.layer_table[2 * i], self.layer_table[2 * i + 1])
+    elif key_event == KeyEvent.LONG_PRESS:
+      # print(f"""pressed : {i}""")
+      op = pressed_ops[i]
+      arg = pressed_args[i]
+      if op == KeyOp.KEYBOARD:
+        keyboard_output.press(arg)
+    elif key_event == KeyEvent.RELEASE:
+      # print(f"""released: {i}""")
+      op = pressed_ops[i]
+      arg = pressed_args[i]
+      pressed_ops[i] = KeyOp.NONE
+      if op == KeyOp.KEYBOARD:
+        keyboard_output.release(arg)
+      elif op == KeyOp.LAYER:
+        self._set_layer_mask(self.layer_mask & ~(1 << arg))
+      elif is_complex_modifier_op(op):
+        if self.tap_hold.remove(i):
+          if arg & 0xFF:
+            keyboard_output.tap(arg & 0xFF)
+        elif op == KeyOp.COMPLEX_LAYER:
+          self._set_layer_mask(self.layer_mask & ~(1 << (arg >> 8)))
+        else:
+          keyboard_output.release(arg >> 8)
+      elif op == KeyOp.MOUSE_MOVE:
+        self.mouse_keys.release(key_map.side_table[arg])
+      elif op == KeyOp.MOUSE_BUTTON and self.mouse is not None:
+        self.mouse.release(arg)
+      elif op == KeyOp.CONSUMER_CONTROL and self.consumer_control is not None:
+        self.consumer_control.release()
+      elif op == KeyOp.LAMBDA and key_map.side_table[arg].on_release is not None:
+        key_map.side_table[arg].on_release()
@@ -0,0 +1,64 @@
+# The host polls the HID IN endpoint of CircuitPython 8, which all the devices share, every bInterval of 8 ms.
+# send_report() blocks until the host has taken the previous report, so one report goes out per poll.
+HID_ENDPOINT_INTERVAL = 8  # ms
+
+
+def is_modifier(keycode):
+  return 0xE0 <= keycode <= 0xE7
+
+
+class KeyboardOutput:
+  """
+  Collects the key changes of one scan tick and sends them with as few keyboard reports as possible on `flush()`.
+
+  Ordering rules kept from sending each change immediately:
+  - A modifier pressed in the tick is sent in a report before the keys pressed after it, and after the ones pressed
+    before it, as some hosts apply a modifier only to keys pressed in a later report.
+  - A key pressed and released in the same tick (a tap) is sent in separate reports.
+  - A key pressed in the tick is sent while the modifiers released after it in the tick are still held.
+  """
+
+  def __init__(self, keyboard):
+    self.keyboard = keyboard
+    self._pressed_modifiers = []
+    self._pressed_keycodes = []
+    self._released_keycodes = []
+
+  @property
+  def has_pending_changes(self):
+    return len(self._pressed_modifiers) > 0 or len(self._pressed_keycodes) > 0 or len(self._released_keycodes) > 0
+
+  def press(self, keycode):
+    if keycode in self._released_keycodes or (is_modifier(keycode) and len(self._pressed_keycodes) > 0):
+      self.flush()
+    if is_modifier(keycode):
+      self._pressed_modifiers.append(keycode)
+    else:
+      self._pressed_keycodes.append(keycode)
+
+  def release(self, keycode):
+    if keycode in self._pressed_modifiers or keycode in self._pressed_keycodes \
+        or (is_modifier(keycode) and len(self._pressed_keycodes) > 0):
+      self.flush()
+    self._released_keycodes.append(keycode)
+
+  def tap(self, keycode):
+    self.press(keycode)
+    self.release(keycode)
+
+  def flush(self):
+    # Return the number of reports sent: the releases, then the modifiers pressed, then the other keys pressed
+    num_reports = 0
+    if len(self._released_keycodes) > 0:
+      self.keyboard.release(*self._released_keycodes)
+      self._released_keycodes.clear()
+      num_reports += 1
+    if len(self._pressed_modifiers) > 0:
+      self.keyboard.press(*self._pressed_modifiers)
+      self._pressed_modifiers.clear()
+      num_reports += 1
+    if len(self._pressed_keycodes) > 0:
+      self.keyboard.press(*self._pressed_keycodes)
+      self._pressed_keycodes.clear()
+      num_reports += 1
+    return num_reports
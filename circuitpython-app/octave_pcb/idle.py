@@ -0,0 +1,54 @@
+from octave_pcb.ticks import ticks_diff
+
+
+class IdleMonitor:
+  """
+  Switches the matrix to idle after `idle_timeout` ms with no key pressed: every row is driven low and only the
+  columns are read, every `idle_scan_interval` ms instead of every scan tick. The first column that reads low wakes
+  it up, and the same tick scans the whole matrix, so the key that woke it up is not lost.
+
+  Only for KeyMatrix; the keypad backend scans in the background.
+  """
+
+  def __init__(self, key_matrix, idle_timeout=1000, idle_scan_interval=4):
+    self.key_matrix = key_matrix
+    self.idle_timeout = idle_timeout
+    self.idle_scan_interval = idle_scan_interval
+    self.is_idle = False
+    self._is_quiet = False
+    self._quiet_time = 0
+    self._scan_interval = None
+    # Counters for the host simulation
+    self.num_idle_polls = 0
+    self.num_wakes = 0
+
+  def poll(self, scheduler):
+    """
+    Return True while idle, in which case the tick skips the scan. Wake up if any key is pressed.
+    """
+    if not self.is_idle:
+      return False
+    if not self.key_matrix.is_any_key_pressed():
+      self.num_idle_polls += 1
+      return True
+    self.key_matrix.select_row(-1)
+    scheduler.scan_interval = self._scan_interval
+    self.is_idle = False
+    self._is_quiet = False
+    self.num_wakes += 1
+    return False
+
+  def update(self, current_time, is_quiet, scheduler):
+    """
+    Go idle once the engine has been quiet (no key pressed, nothing to send) for `idle_timeout`.
+    """
+    if not is_quiet:
+      self._is_quiet = False
+    elif not self._is_quiet:
+      self._is_quiet = True
+      self._quiet_time = current_time
+    elif ticks_diff(current_time, self._quiet_time) >= self.idle_timeout:
+      self.key_matrix.select_all_rows()
+      self._scan_interval = scheduler.scan_interval
+      scheduler.scan_interval = self.idle_scan_interval
+      self.is_idle = True
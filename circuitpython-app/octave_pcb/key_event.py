@@ -1,27 +1,141 @@
+from octave_pcb.ticks import ticks_add, ticks_less
+
+
 class KeyEvent:
   PRESS = 0
   LONG_PRESS = 1
   RELEASE = 2
 
 
+LONG_PRESS_DELAY = 500  # ms
+LONG_PRESS_REPEAT_INTERVAL = 100  # ms
+
+
 class KeyEventPlanner:
+  """
+  Times are ticks in milliseconds, see octave_pcb.ticks.
+  """
+
   def __init__(self):
     self._is_pressed = False
     self._long_press_timing = None
 
+  @property
+  def long_press_timing(self):
+    return self._long_press_timing
+
   def make_event(self, current_time, is_pressed):
     key_event = None
 
     if is_pressed == True:
       if self._is_pressed != is_pressed:
         key_event = KeyEvent.PRESS
-        self._long_press_timing = current_time + 0.5
-      elif current_time >= self._long_press_timing:
+        self._long_press_timing = ticks_add(current_time, LONG_PRESS_DELAY)
+      elif not ticks_less(current_time, self._long_press_timing):
         key_event = KeyEvent.LONG_PRESS
-        self._long_press_timing = current_time + 0.1
+        # Keep the repeat cadence, unless the loop has fallen behind by a whole interval
+        self._long_press_timing = ticks_add(self._long_press_timing, LONG_PRESS_REPEAT_INTERVAL)
+        if not ticks_less(current_time, self._long_press_timing):
+          self._long_press_timing = ticks_add(current_time, LONG_PRESS_REPEAT_INTERVAL)
     elif self._is_pressed != is_pressed:
       key_event = KeyEvent.RELEASE
       self._long_press_timing = None
 
     self._is_pressed = is_pressed
     return key_event
+
+
+class DebounceAlgorithm:
+  EAGER_PER_KEY = 0  # Report the first edge of a key, then ignore the key for the debounce time
+  DEFER_PER_KEY = 1  # Report an edge after the key has been stable for the debounce time
+  DEFER_GLOBAL = 2  # Report all edges after the whole matrix has been stable for the debounce time
+
+
+class Debouncer:
+  """
+  Times are ticks in milliseconds, see octave_pcb.ticks.
+  """
+
+  def __init__(self, num_rows, num_cols, algorithm=DebounceAlgorithm.EAGER_PER_KEY, debounce_time=5):
+    self._num_rows = num_rows
+    self._num_cols = num_cols
+    self._algorithm = algorithm
+    self._debounce_time = debounce_time
+    # Keys whose deadlines are running, one byte per row
+    self._pending_row_states = bytearray(num_rows)
+    self._deadlines = [0 for _ in range(num_rows * num_cols)]
+    self._raw_row_states = bytearray(num_rows)
+    self._global_deadline = None
+    # Debounced state, one byte per row
+    self.row_states = bytearray(num_rows)
+
+  def debounce(self, current_time, raw_row_states):
+    """
+    Update `row_states` from the raw state of a scan and return it. The buffer is reused by every call.
+    """
+    if self._algorithm == DebounceAlgorithm.EAGER_PER_KEY:
+      self._debounce_eager_per_key(current_time, raw_row_states)
+    elif self._algorithm == DebounceAlgorithm.DEFER_PER_KEY:
+      self._debounce_defer_per_key(current_time, raw_row_states)
+    else:
+      self._debounce_defer_global(current_time, raw_row_states)
+    return self.row_states
+
+  def _debounce_eager_per_key(self, current_time, raw_row_states):
+    row_states = self.row_states
+    deadlines = self._deadlines
+    for row in range(self._num_rows):
+      changed_bits = raw_row_states[row] ^ row_states[row]
+      pending_bits = self._pending_row_states[row]
+      if (changed_bits | pending_bits) == 0:
+        continue
+      for col in range(self._num_cols):
+        bit = 1 << col
+        i = row * self._num_cols + col
+        if pending_bits & bit:
+          if ticks_less(current_time, deadlines[i]):
+            continue
+          pending_bits &= ~bit
+        if changed_bits & bit:
+          row_states[row] ^= bit
+          deadlines[i] = ticks_add(current_time, self._debounce_time)
+          pending_bits |= bit
+      self._pending_row_states[row] = pending_bits
+
+  def _debounce_defer_per_key(self, current_time, raw_row_states):
+    row_states = self.row_states
+    deadlines = self._deadlines
+    for row in range(self._num_rows):
+      changed_bits = raw_row_states[row] ^ row_states[row]
+      pending_bits = self._pending_row_states[row]
+      if (changed_bits | pending_bits) == 0:
+        continue
+      for col in range(self._num_cols):
+        bit = 1 << col
+        i = row * self._num_cols + col
+        if changed_bits & bit:
+          if not pending_bits & bit:
+            deadlines[i] = ticks_add(current_time, self._debounce_time)
+            pending_bits |= bit
+          elif not ticks_less(current_time, deadlines[i]):
+            row_states[row] ^= bit
+            pending_bits &= ~bit
+        elif pending_bits & bit:
+          # Bounced back before the deadline
+          pending_bits &= ~bit
+      self._pending_row_states[row] = pending_bits
+
+  def _debounce_defer_global(self, current_time, raw_row_states):
+    last_raw_row_states = self._raw_row_states
+    is_changed = False
+    for row in range(self._num_rows):
+      if raw_row_states[row] != last_raw_row_states[row]:
+        last_raw_row_states[row] = raw_row_states[row]
+        is_changed = True
+    if is_changed:
+      self._global_deadline = ticks_add(current_time, self._debounce_time)
+    elif self._global_deadline is not None and not ticks_less(current_time, self._global_deadline):
+      self._global_deadline = None
+      row_states = self.row_states
+      for row in range(self._num_rows):
+        row_states[row] = last_raw_row_states[row]
@@ -6,21 +6,29 @@ import digitalio
 DIGITALIO_HIGH = True
 DIGITALIO_LOW = False
 
+ROW_PINS = (board.GPIO29, board.GPIO28, board.GPIO27, board.GPIO26,
+            board.GPIO25, board.GPIO24, board.GPIO23, board.GPIO22)
+COL_PINS = (board.GPIO21, board.GPIO20, board.GPIO19, board.GPIO18,
+            board.GPIO17, board.GPIO16, board.GPIO15, board.GPIO14)
+
 
 class KeyMatrix:
   def __init__(self):
-    row_pins = [board.GPIO29, board.GPIO28, board.GPIO27, board.GPIO26,
-                board.GPIO25, board.GPIO24, board.GPIO23, board.GPIO22]
-    self.row_ios = [digitalio.DigitalInOut(pin) for pin in row_pins]
+    self.row_ios = [digitalio.DigitalInOut(pin) for pin in ROW_PINS]
     for row_io in self.row_ios:
       row_io.switch_to_output(DIGITALIO_HIGH, digitalio.DriveMode.OPEN_DRAIN)
 
-    col_pins = [board.GPIO21, board.GPIO20, board.GPIO19, board.GPIO18,
-                board.GPIO17, board.GPIO16, board.GPIO15, board.GPIO14]
-    self.col_ios = [digitalio.DigitalInOut(pin) for pin in col_pins]
+    self.col_ios = [digitalio.DigitalInOut(pin) for pin in COL_PINS]
     for col_io in self.col_ios:
       col_io.switch_to_input(digitalio.Pull.UP)
 
+    self.num_rows = len(self.row_ios)
+    self.num_cols = len(self.col_ios)
+
+    self._selected_row = -1
+    # One byte per row, bit N is set while the key on column N is pressed
+    self.row_states = bytearray(len(self.row_ios))
+
   def deinit(self):
     self.select_row(-1)
     for row_io in self.row_ios:
@@ -32,8 +40,36 @@ class KeyMatrix:
     # Once deselect all rows
     for row_io in self.row_ios:
       row_io.value = DIGITALIO_HIGH
-    if 0 <= row <= len(self.row_ios):
+    if 0 <= row < len(self.row_ios):
       self.row_ios[row].value = DIGITALIO_LOW
+      self._selected_row = row
+    else:
+      self._selected_row = -1
+
+  def select_all_rows(self):
+    # Drive every row low, so that any pressed key pulls its column low. Deselect with select_row(-1).
+    for row_io in self.row_ios:
+      row_io.value = DIGITALIO_LOW
+    self._selected_row = -1
+
+  def is_any_key_pressed(self):
+    """
+    Read the columns only. With all rows selected, this tells whether any key is pressed.
+    """
+    for col_io in self.col_ios:
+      if col_io.value == DIGITALIO_LOW:
+        return True
+    return False
+
+  def switch_row(self, row):
+    # Drive only the previously selected row and the next one
+    if row == self._selected_row:
+      return
+    if self._selected_row >= 0:
+      self.row_ios[self._selected_row].value = DIGITALIO_HIGH
+    if row >= 0:
+      self.row_ios[row].value = DIGITALIO_LOW
+    self._selected_row = row
 
   def scan_matrix(self):
     are_keys_pressed = []
@@ -44,3 +80,20 @@ class KeyMatrix:
       )
       # time.sleep(0.001)
     return are_keys_pressed
+
+  def scan_matrix_rows(self):
+    """
+    Scan the matrix into `row_states` and return it. The buffer is reused by every scan.
+    """
+    row_states = self.row_states
+    col_ios = self.col_ios
+    for row in range(len(self.row_ios)):
+      self.switch_row(row)
+      state = 0
+      bit = 1
+      for col_io in col_ios:
+        if col_io.value == DIGITALIO_LOW:
+          state |= bit
+        bit <<= 1
+      row_states[row] = state
+    return row_states
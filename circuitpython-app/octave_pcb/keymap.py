@@ -0,0 +1,191 @@
+import collections
+from array import array
+
+from octave_pcb.macro import compile_macro
+
+
+class CodeType:
+  KEYBOARD = 0
+  MOUSE_MOVE = 1
+  MOUSE_BUTTON = 2
+  CONSUMER_CONTROL = 3
+
+
+class KeycodeLayer:
+  MO1 = 0xFF01
+  MO2 = 0xFF02
+
+
+def is_code_mo(code):
+  return True if code == KeycodeLayer.MO1 or code == KeycodeLayer.MO2 else False
+
+
+ComplexModifierAssignment = collections.namedtuple('ComplexModifierAssignment', ['modifier', 'code_for_standalone'])
+"""
+1) If you release the key within the tapping term, send the standalone code.
+2) When the tapping term passes, or just before another KeyAssignment becomes press (see TapHoldMode),
+    the modifier becomes press. A modifier of MO(n) activates layer n.
+"""
+
+KeyAssignment = collections.namedtuple('KeyAssignment', ['type', 'code'])
+LambdaAssignment = collections.namedtuple('LambdaAssignment', ['on_press', 'on_release'])
+MacroAssignment = collections.namedtuple('MacroAssignment', ['sequence'])
+"""
+Types `sequence` on press: a str is typed with the keyboard layout, an int keycode is tapped, and a tuple of
+keycodes is pressed together, e.g. MacroAssignment(('Best regards,', Keycode.ENTER, 'Takayoshi')).
+"""
+
+Combo = collections.namedtuple('Combo', ['keys', 'key_assignment'])
+"""
+Pressing all of `keys`, (row, col) pairs, within the combo term acts as `key_assignment`.
+"""
+
+TransparentAssignment = collections.namedtuple('TransparentAssignment', [])
+TRANSPARENT = TransparentAssignment()
+"""
+The key falls through to the highest active layer below.
+"""
+
+
+class KeyOp:
+  NONE = 0
+  # KeyAssignment
+  KEYBOARD = 1  # arg: keycode
+  LAYER = 2  # arg: layer number of MO
+  MOUSE_MOVE = 3  # arg: index of the keyword arguments of Mouse.move() in the side table
+  MOUSE_BUTTON = 4  # arg: buttons
+  CONSUMER_CONTROL = 5  # arg: consumer control code
+  # ComplexModifierAssignment
+  COMPLEX_MODIFIER = 6  # arg: modifier keycode << 8 | standalone keycode (0: none)
+  COMPLEX_LAYER = 7  # arg: layer number << 8 | standalone keycode (0: none)
+  # LambdaAssignment
+  LAMBDA = 8  # arg: index of the LambdaAssignment in the side table
+  # TRANSPARENT, only in the layers, never in a resolved table
+  TRANSPARENT = 9
+  # MacroAssignment
+  MACRO = 10  # arg: index of the compiled stream in `macros`
+
+
+def is_key_assignment_op(op):
+  return KeyOp.KEYBOARD <= op <= KeyOp.CONSUMER_CONTROL
+
+
+def is_complex_modifier_op(op):
+  return op == KeyOp.COMPLEX_MODIFIER or op == KeyOp.COMPLEX_LAYER
+
+
+class CompiledKeyMap:
+  """
+  KEY_MAP_LAYERS compiled into one array('H') per layer, holding an (op, arg) pair per key, so that dispatching
+  an event is a table lookup. Values that do not fit in 16 bits go to `side_table`.
+
+  The active layers are a bitmask, bit n for layer n. `resolve()` returns the table of a layer mask with TRANSPARENT
+  resolved, and keeps the last `max_resolved_tables` of them.
+
+  `combos` are compiled into (keys, op, arg) in the same way. MacroAssignment sequences are compiled into `macros`,
+  typing text with `keyboard_layout`.
+  """
+
+  def __init__(self, key_map_layers, max_resolved_tables=4, combos=(), keyboard_layout=None):
+    self.side_table = []
+    self.macros = []
+    self._keyboard_layout = keyboard_layout
+    self.layers = [self._compile_layer(key_map_layer) for key_map_layer in key_map_layers]
+    self.combos = [(combo.keys,) + self._compile_key_assignment(combo.key_assignment) for combo in combos]
+    self._max_resolved_tables = max_resolved_tables
+    self._resolved_layer_masks = []
+    self._resolved_tables = []
+
+  def resolve(self, layer_mask):
+    for n in range(len(self._resolved_layer_masks)):
+      if self._resolved_layer_masks[n] == layer_mask:
+        return self._resolved_tables[n]
+    table = self._resolve(layer_mask)
+    if len(self._resolved_layer_masks) >= self._max_resolved_tables:
+      # Drop the oldest one
+      self._resolved_layer_masks.pop(0)
+      self._resolved_tables.pop(0)
+    self._resolved_layer_masks.append(layer_mask)
+    self._resolved_tables.append(table)
+    return table
+
+  def replace_layers(self, layers):
+    """
+    Use `layers`, e.g. the layers of a BinaryKeyMap, instead of the compiled ones. Call it again after they changed.
+    """
+    self.layers = layers
+    self._resolved_layer_masks.clear()
+    self._resolved_tables.clear()
+
+  def uses(self, *ops):
+    """
+    Return True if any key or combo is assigned one of `ops`, e.g. to leave out the HID objects nothing sends to.
+    """
+    for layer in self.layers:
+      for i in range(0, len(layer), 2):
+        if layer[i] in ops:
+          return True
+    for _, op, _ in self.combos:
+      if op in ops:
+        return True
+    return False
+
+  def _resolve(self, layer_mask):
+    num_keys = len(self.layers[0]) // 2
+    table = array('H', [0 for _ in range(2 * num_keys)])
+    for i in range(num_keys):
+      for layer in range(len(self.layers) - 1, -1, -1):
+        if layer_mask & (1 << layer) and self.layers[layer][2 * i] != KeyOp.TRANSPARENT:
+          table[2 * i] = self.layers[layer][2 * i]
+          table[2 * i + 1] = self.layers[layer][2 * i + 1]
+          break
+    return table
+
+  def _compile_layer(self, key_map_layer):
+    table = array('H', [0 for _ in range(2 * len(key_map_layer))])
+    for i, key_assignment in enumerate(key_map_layer):
+      op, arg = self._compile_key_assignment(key_assignment)
+      table[2 * i] = op
+      table[2 * i + 1] = arg
+    return table
+
+  def _compile_key_assignment(self, key_assignment):
+    if key_assignment is None:
+      return KeyOp.NONE, 0
+    elif isinstance(key_assignment, TransparentAssignment):
+      return KeyOp.TRANSPARENT, 0
+    elif isinstance(key_assignment, ComplexModifierAssignment):
+      if is_code_mo(key_assignment.code_for_standalone):
+        standalone = 0
+      else:
+        standalone = _check_byte(key_assignment.code_for_standalone)
+      if is_code_mo(key_assignment.modifier):
+        return KeyOp.COMPLEX_LAYER, (key_assignment.modifier & 0xFF) << 8 | standalone
+      return KeyOp.COMPLEX_MODIFIER, _check_byte(key_assignment.modifier) << 8 | standalone
+    elif isinstance(key_assignment, KeyAssignment):
+      if key_assignment.type == CodeType.KEYBOARD:
+        if is_code_mo(key_assignment.code):
+          return KeyOp.LAYER, key_assignment.code & 0xFF
+        return KeyOp.KEYBOARD, key_assignment.code
+      elif key_assignment.type == CodeType.MOUSE_MOVE:
+        return KeyOp.MOUSE_MOVE, self._add_to_side_table(key_assignment.code)
+      elif key_assignment.type == CodeType.MOUSE_BUTTON:
+        return KeyOp.MOUSE_BUTTON, key_assignment.code
+      elif key_assignment.type == CodeType.CONSUMER_CONTROL:
+        return KeyOp.CONSUMER_CONTROL, key_assignment.code
+    elif isinstance(key_assignment, LambdaAssignment):
+      return KeyOp.LAMBDA, self._add_to_side_table(key_assignment)
+    elif isinstance(key_assignment, MacroAssignment):
+      self.macros.append(compile_macro(key_assignment.sequence, self._keyboard_layout))
+      return KeyOp.MACRO, len(self.macros) - 1
+    raise ValueError('Unknown key assignment: {}'.format(key_assignment))
+
+  def _add_to_side_table(self, value):
+    self.side_table.append(value)
+    return len(self.side_table) - 1
+
+
+def _check_byte(code):
+  if not 0 <= code <= 0xFF:
+    raise ValueError('Keycode out of range: {}'.format(code))
+  return code
@@ -0,0 +1,115 @@
+from octave_pcb.binary_keymap import BinaryKeyMap, encode_key_map
+
+
+class KeymapCommand:
+  # The command IDs of the VIA dynamic keymap protocol, which Vial speaks (see vial-porting/keymaps/vial)
+  GET_KEYCODE = 0x04  # layer, row, col -> layer, row, col, record
+  SET_KEYCODE = 0x05  # layer, row, col, record -> the same
+  RESET = 0x06  # back to KEY_MAP_LAYERS of code.py
+  GET_LAYER_COUNT = 0x11  # -> number of layers
+  GET_BUFFER = 0x12  # offset (big-endian uint16), size -> offset, size, records
+  SET_BUFFER = 0x13  # offset, size, records -> offset, size
+  UNHANDLED = 0xFF
+
+
+class KeymapServer:
+  """
+  Serves the key map over the usb_cdc data channel, so that keys are changed live, without remounting or rebooting.
+
+  A command is its ID followed by its arguments, and the reply is the ID followed by the results, modeled on the VIA
+  dynamic keymap commands. Keys are the 4-byte (op, arg) records of BinaryKeyMap instead of QMK keycodes. A command
+  that fails, e.g. with an op that cannot be stored, is answered with UNHANDLED alone. The main loop collects the
+  bytes of a command over its ticks, up to `command_length()`, so that it never waits for the rest of one.
+
+  The key map is stored in `binary_key_map` on the first change, starting from the compiled layers of `key_map`;
+  `on_change()` is called after each change so that the engine resolves its layers again.
+  """
+
+  def __init__(self, binary_key_map, key_map, on_change=None):
+    self.binary_key_map = binary_key_map
+    self.key_map = key_map
+    self._on_change = on_change
+    # The layers of code.py, restored by RESET
+    self._default_layers = key_map.layers
+    if binary_key_map.is_valid:
+      key_map.replace_layers(binary_key_map.layers)
+
+  @staticmethod
+  def command_length(data):
+    """
+    Return the length of the key map command that starts `data`, which may be only its first bytes: at least one more
+    byte than `data` while the length depends on bytes not received yet. Return 0 if it is not a key map command.
+    """
+    command = data[0]
+    if command in (KeymapCommand.RESET, KeymapCommand.GET_LAYER_COUNT):
+      return 1
+    if command in (KeymapCommand.GET_KEYCODE, KeymapCommand.GET_BUFFER):
+      return 4
+    if command == KeymapCommand.SET_KEYCODE:
+      return 8
+    if command == KeymapCommand.SET_BUFFER:
+      # The size of the records is its 4th byte
+      return 4 + data[3] if len(data) >= 4 else 4
+    return 0
+
+  def handle_command(self, data, serial):
+    """
+    Serve the complete command `data`, its ID followed by its arguments, and write the reply to `serial`.
+    """
+    try:
+      reply = self._handle(data[0], bytes(data[1:]))
+    except ValueError:
+      reply = None
+    serial.write(reply if reply is not None else bytes((KeymapCommand.UNHANDLED,)))
+
+  def _handle(self, command, arguments):
+    binary_key_map = self.binary_key_map
+    if command == KeymapCommand.GET_LAYER_COUNT:
+      return bytes((command, len(self.key_map.layers)))
+    if command == KeymapCommand.RESET:
+      binary_key_map.erase()
+      self._change(self._default_layers)
+      return bytes((command,))
+    if command == KeymapCommand.GET_KEYCODE or command == KeymapCommand.SET_KEYCODE:
+      layer, row, col = arguments[0], arguments[1], arguments[2]
+      if command == KeymapCommand.SET_KEYCODE:
+        self._store()
+        binary_key_map.set(layer, row, col, arguments[3] | arguments[4] << 8, arguments[5] | arguments[6] << 8)
+        self._change(binary_key_map.layers)
+        return bytes((command,)) + arguments
+      op, arg = self._get(layer, row, col)
+      return bytes((command, layer, row, col, op & 0xFF, op >> 8, arg & 0xFF, arg >> 8))
+    offset = arguments[0] << 8 | arguments[1]
+    size = arguments[2]
+    if command == KeymapCommand.GET_BUFFER:
+      if binary_key_map.is_valid:
+        records = binary_key_map.read_records(offset, size)
+      else:
+        records = BinaryKeyMap(encode_key_map(self._default_layers, binary_key_map.num_rows, binary_key_map.num_cols),
+                               binary_key_map.num_rows, binary_key_map.num_cols).read_records(offset, size)
+      return bytes((command,)) + arguments + records
+    self._store()
+    binary_key_map.write_records(offset, arguments[3:])
+    self._change(binary_key_map.layers)
+    return bytes((command,)) + arguments[:3]
+
+  def _get(self, layer, row, col):
+    if self.binary_key_map.is_valid:
+      return self.binary_key_map.get(layer, row, col)
+    num_cols = self.binary_key_map.num_cols
+    if not (0 <= layer < len(self._default_layers) and 0 <= row < self.binary_key_map.num_rows
+            and 0 <= col < num_cols):
+      raise ValueError('No key at layer {}, row {}, col {}'.format(layer, row, col))
+    i = row * num_cols + col
+    return self._default_layers[layer][2 * i], self._default_layers[layer][2 * i + 1]
+
+  def _store(self):
+    # Start from the layers of code.py; ValueError if any of them is not storable, e.g. a MacroAssignment
+    if not self.binary_key_map.is_valid:
+      self.binary_key_map.write(self._default_layers)
+
+  def _change(self, layers):
+    self.key_map.replace_layers(layers)
+    if self._on_change is not None:
+      self._on_change()
+
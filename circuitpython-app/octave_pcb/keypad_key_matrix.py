@@ -0,0 +1,70 @@
+import keypad
+
+from octave_pcb.key_matrix import COL_PINS, ROW_PINS
+
+
+class KeypadKeyMatrix:
+  """
+  KeyMatrix backed by the native `keypad.KeyMatrix`, which scans the matrix in the background.
+  """
+
+  def __init__(self, interval=0.02):
+    self.num_rows = len(ROW_PINS)
+    self.num_cols = len(COL_PINS)
+    # COL2ROW diodes: the anodes are on the column pins
+    self._keys = keypad.KeyMatrix(ROW_PINS, COL_PINS, columns_to_anodes=True, interval=interval,
+                                  max_events=self.num_rows * self.num_cols)
+    self._event = keypad.Event()
+    self._has_pending_event = False
+    self._changed_row_states = bytearray(self.num_rows)
+    # One byte per row, bit N is set while the key on column N is pressed
+    self.row_states = bytearray(self.num_rows)
+
+  def deinit(self):
+    self._keys.deinit()
+
+  def scan_matrix(self):
+    row_states = self.scan_matrix_rows()
+    are_keys_pressed = []
+    for row in range(self.num_rows):
+      are_keys_pressed.extend(
+          [True if row_states[row] & (1 << col) else False for col in range(self.num_cols)]
+      )
+    return are_keys_pressed
+
+  def scan_matrix_rows(self):
+    """
+    Apply the queued events to `row_states` and return it. The buffer is reused by every scan.
+
+    A key changes at most once per call, so a press and release queued between two calls is reported over two
+    calls instead of being lost.
+    """
+    row_states = self.row_states
+    events = self._keys.events
+    if events.overflowed:
+      # Events were dropped, so start over from the current state of the keys
+      events.clear()
+      self._keys.reset()
+      self._has_pending_event = False
+      for row in range(self.num_rows):
+        row_states[row] = 0
+
+    changed_row_states = self._changed_row_states
+    for row in range(self.num_rows):
+      changed_row_states[row] = 0
+
+    event = self._event
+    while self._has_pending_event or events.get_into(event):
+      row, col = divmod(event.key_number, self.num_cols)
+      bit = 1 << col
+      if changed_row_states[row] & bit:
+        # Keep the event for the next call
+        self._has_pending_event = True
+        break
+      self._has_pending_event = False
+      changed_row_states[row] |= bit
+      if event.pressed:
+        row_states[row] |= bit
+      else:
+        row_states[row] &= ~bit
+    return row_states
@@ -0,0 +1,143 @@
+from array import array
+
+from octave_pcb.ticks import ticks_diff, ticks_ms
+
+
+class LatencyStage:
+  SCAN_START = 0
+  SCAN_END = 1
+  EVENT_DETECTED = 2
+  DISPATCH = 3
+  REPORT_SENT = 4
+
+
+NUM_LATENCY_STAGES = 5
+
+# A scan interval left out, as the scan had no previous scan
+_NO_SCAN_INTERVAL = 0xFFFF
+
+# (name, from stage, to stage) of the summarized latencies
+LATENCY_SPANS = (
+    ('scan', LatencyStage.SCAN_START, LatencyStage.SCAN_END),
+    ('detect_to_dispatch', LatencyStage.EVENT_DETECTED, LatencyStage.DISPATCH),
+    ('dispatch_to_report', LatencyStage.DISPATCH, LatencyStage.REPORT_SENT),
+    ('scan_to_report', LatencyStage.SCAN_START, LatencyStage.REPORT_SENT),
+)
+
+
+class LatencyTrace:
+  """
+  Records timestamps of the stages of the main loop into preallocated ring buffers, with no allocation. The stages
+  are stamped in milliseconds, or in microseconds with `ticks_us` given: most spans are well under a millisecond, but
+  ticks_us() allocates a long int per stamp, which the garbage collector then pauses the loop for. The scan intervals
+  are counted in milliseconds, the unit of the scan ticks.
+
+  Every tick goes into the scan ring (duration and interval since the previous tick). Only ticks with key events go
+  into the event ring, so that idle ticks do not push keypresses out.
+  """
+
+  def __init__(self, num_scans=512, num_events=256, ticks_ms=ticks_ms, ticks_us=None):
+    self._ticks_ms = ticks_ms
+    self._ticks_stage = ticks_ms if ticks_us is None else ticks_us
+    self.span_unit = 'ms' if ticks_us is None else 'us'
+    self._marks = array('L', [0 for _ in range(NUM_LATENCY_STAGES)])
+    self._marked_stages = 0
+    self._scan_start = 0
+    self._last_scan_start = None
+    self._scan_durations = array('H', [0 for _ in range(num_scans)])
+    self._scan_intervals = array('H', [0 for _ in range(num_scans)])
+    self._num_scans = 0
+    self._scan_index = 0
+    self._event_marks = array('L', [0 for _ in range(num_events * NUM_LATENCY_STAGES)])
+    self._event_marked_stages = bytearray(num_events)
+    self._num_events = 0
+    self._event_index = 0
+
+  def start_scan(self):
+    self._marked_stages = 0
+    self._scan_start = self._ticks_ms()
+    self.mark(LatencyStage.SCAN_START)
+
+  def mark(self, stage):
+    self._marks[stage] = self._ticks_stage()
+    self._marked_stages |= 1 << stage
+
+  def end_tick(self):
+    marks = self._marks
+    scan_start = self._scan_start
+    i = self._scan_index
+    # Saturated at 0xFFFF rather than wrapped
+    self._scan_durations[i] = min(ticks_diff(marks[LatencyStage.SCAN_END], marks[LatencyStage.SCAN_START]), 0xFFFF)
+    if self._last_scan_start is None:
+      self._scan_intervals[i] = _NO_SCAN_INTERVAL
+    else:
+      self._scan_intervals[i] = min(ticks_diff(scan_start, self._last_scan_start), _NO_SCAN_INTERVAL - 1)
+    self._last_scan_start = scan_start
+    self._scan_index = i + 1 if i + 1 < len(self._scan_durations) else 0
+    if self._num_scans < len(self._scan_durations):
+      self._num_scans += 1
+
+    if self._marked_stages & (1 << LatencyStage.EVENT_DETECTED):
+      i = self._event_index
+      offset = i * NUM_LATENCY_STAGES
+      for stage in range(NUM_LATENCY_STAGES):
+        self._event_marks[offset + stage] = marks[stage]
+      self._event_marked_stages[i] = self._marked_stages
+      self._event_index = i + 1 if i + 1 < len(self._event_marked_stages) else 0
+      if self._num_events < len(self._event_marked_stages):
+        self._num_events += 1
+
+  def skip_scan_interval(self):
+    """
+    Leave out the interval to the next scan, e.g. after the loop was idle without scanning.
+    """
+    self._last_scan_start = None
+
+  def clear(self):
+    self._num_scans = 0
+    self._scan_index = 0
+    self._num_events = 0
+    self._event_index = 0
+    self._last_scan_start = None
+
+  def summarize(self):
+    """
+    Return [(name, unit, p50, p99, max, count), ...], the spans in `span_unit` and the scan interval in 'ms'. This
+    allocates, so call it only on request.
+    """
+    spans = []
+    for name, from_stage, to_stage in LATENCY_SPANS:
+      values = []
+      if from_stage == LatencyStage.SCAN_START and to_stage == LatencyStage.SCAN_END:
+        values = list(self._scan_durations[:self._num_scans])
+      else:
+        required_stages = (1 << from_stage) | (1 << to_stage)
+        for i in range(self._num_events):
+          if self._event_marked_stages[i] & required_stages == required_stages:
+            offset = i * NUM_LATENCY_STAGES
+            values.append(ticks_diff(self._event_marks[offset + to_stage], self._event_marks[offset + from_stage]))
+      spans.append(_summarize_values(name, self.span_unit, values))
+    intervals = [interval for interval in self._scan_intervals[:self._num_scans] if interval != _NO_SCAN_INTERVAL]
+    spans.append(_summarize_values('scan_interval', 'ms', intervals))
+    return spans
+
+  def handle_command(self, command, serial):
+    """
+    Serve `command`, a byte read from `serial` (usb_cdc.data): 's' writes the summary, 'c' clears the buffers.
+    """
+    if command == b's':
+      serial.write(b'span unit p50 p99 max count\r\n')
+      for name, unit, p50, p99, maximum, count in self.summarize():
+        serial.write('{} {} {} {} {} {}\r\n'.format(name, unit, p50, p99, maximum, count).encode())
+      serial.write(b'.\r\n')
+    elif command == b'c':
+      self.clear()
+      serial.write(b'.\r\n')
+
+
+def _summarize_values(name, unit, values):
+  if len(values) == 0:
+    return (name, unit, 0, 0, 0, 0)
+  values.sort()
+  return (name, unit, values[len(values) // 2], values[min(len(values) - 1, len(values) * 99 // 100)], values[-1],
+          len(values))
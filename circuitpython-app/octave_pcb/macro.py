@@ -0,0 +1,122 @@
+from array import array
+
+from octave_pcb.hid_output import HID_ENDPOINT_INTERVAL, is_modifier
+from octave_pcb.ticks import ticks_add, ticks_diff, ticks_less
+
+
+def compile_macro(sequence, keyboard_layout):
+  """
+  Compile the items of a MacroAssignment into a stream of chords: for each chord, the number of keycodes followed by
+  the keycodes. A str is typed with `keyboard_layout`, an int keycode is tapped, and a tuple of keycodes is pressed
+  together.
+  """
+  stream = array('B')
+  for item in sequence:
+    if isinstance(item, str):
+      if keyboard_layout is None:
+        raise ValueError('A keyboard layout is needed to type: {}'.format(repr(item)))
+      for char in item:
+        _append_chord(stream, keyboard_layout.keycodes(char))
+    elif isinstance(item, int):
+      _append_chord(stream, (item,))
+    else:
+      _append_chord(stream, item)
+  return stream
+
+
+def _append_chord(stream, keycodes):
+  stream.append(len(keycodes))
+  for keycode in keycodes:
+    if not 0 <= keycode <= 0xFF:
+      raise ValueError('Keycode out of range: {}'.format(keycode))
+    stream.append(keycode)
+
+
+# Steps of a chord, one report each
+_PRESS_MODIFIERS = 0
+_PRESS_KEYS = 1
+_RELEASE = 2
+
+
+class MacroEngine:
+  """
+  Plays compiled macro streams one report every `report_interval` ms, so that scanning and other keys keep going
+  during a long snippet, and no send blocks on the HID endpoint, which the host polls every HID_ENDPOINT_INTERVAL ms.
+  A chord takes a report for its modifiers, one for its other keys and one for its release.
+  """
+
+  def __init__(self, streams, report_interval=HID_ENDPOINT_INTERVAL, max_queued_macros=4):
+    self.streams = streams
+    self.report_interval = report_interval
+    self._max_queued_macros = max_queued_macros
+    # None while no macro plays, as ticks only compare within half their period
+    self._next_report_time = None
+    # The tick of the last report made, until the next tick, or None
+    self._report_tick = None
+    # Macros to play, the first one is playing the step `_step` of the chord at `_position`
+    self._queued_macros = []
+    self._position = 0
+    self._step = _PRESS_MODIFIERS
+
+  @property
+  def is_playing(self):
+    return len(self._queued_macros) > 0
+
+  def clear(self):
+    self._queued_macros.clear()
+    self._position = 0
+    self._step = _PRESS_MODIFIERS
+    self._next_report_time = None
+    self._report_tick = None
+
+  def start(self, n):
+    # Macros started while another one is playing follow it; more than can be queued are dropped
+    if len(self.streams[n]) > 0 and len(self._queued_macros) < self._max_queued_macros:
+      self._queued_macros.append(n)
+
+  def play(self, current_time, keyboard_output):
+    """
+    Make the next step of the chords through `keyboard_output` when its report is due. The report is left to its
+    flush() of the tick, and a tick with keys typed along leaves its report to them.
+    """
+    if len(self._queued_macros) == 0:
+      return
+    if self._report_tick is not None:
+      if ticks_diff(current_time, self._report_tick) > 1:
+        # The send of the last report blocked until a poll of the host, which takes it at the next poll
+        self._next_report_time = ticks_add(current_time, self.report_interval)
+      self._report_tick = None
+    if keyboard_output.has_pending_changes:
+      # The report of the keys typed along takes the endpoint
+      self._next_report_time = ticks_add(current_time, self.report_interval)
+      self._report_tick = current_time
+      return
+    if self._next_report_time is not None and ticks_less(current_time, self._next_report_time):
+      return
+    num_changes = 0
+    # A step with nothing to press, e.g. the modifiers of a chord without any, takes no report
+    while len(self._queued_macros) > 0 and num_changes == 0:
+      stream = self.streams[self._queued_macros[0]]
+      position = self._position
+      step = self._step
+      for n in range(position + 1, position + 1 + stream[position]):
+        keycode = stream[n]
+        if step == _RELEASE:
+          keyboard_output.release(keycode)
+          num_changes += 1
+        elif is_modifier(keycode) == (step == _PRESS_MODIFIERS):
+          keyboard_output.press(keycode)
+          num_changes += 1
+      if step == _RELEASE:
+        self._step = _PRESS_MODIFIERS
+        self._position = position + 1 + stream[position]
+        if self._position >= len(stream):
+          self._queued_macros.pop(0)
+          self._position = 0
+      else:
+        self._step = step + 1
+    if len(self._queued_macros) > 0:
+      self._next_report_time = ticks_add(current_time, self.report_interval)
+      self._report_tick = current_time
+    else:
+      self._next_report_time = None
@@ -0,0 +1,124 @@
+from octave_pcb.latency_trace import LatencyStage
+from octave_pcb.ticks import ticks_diff
+
+# The longest command of the data channel: SET_BUFFER with 255 bytes of records
+MAX_COMMAND_LENGTH = 4 + 255
+
+
+class MainLoop:
+  """
+  The body of the main loop of code.py, one scan tick per `tick()`. tools/simulate.py runs the same ticks on the
+  stand-in devices.
+
+  `scheduler` is set by the caller, which creates a new one with the HID objects after each restart.
+  `on_device_recovered(device)` rebuilds the HID object of a device that is back after its sends failed.
+
+  The bytes of a command on `data_serial` are collected over the ticks, reading only what has arrived, so a command
+  cut short or a stray byte never blocks the scan. A command not complete after `command_timeout` ms is dropped.
+  """
+
+  def __init__(self, key_matrix, debouncer, engine, recovery, on_device_recovered, data_serial=None,
+               keymap_server=None, latency_trace=None, idle_monitor=None, command_timeout=100):
+    self.key_matrix = key_matrix
+    self.debouncer = debouncer
+    self.engine = engine
+    self.recovery = recovery
+    self.on_device_recovered = on_device_recovered
+    self.data_serial = data_serial
+    self.keymap_server = keymap_server
+    self.latency_trace = latency_trace
+    self.idle_monitor = idle_monitor
+    self.command_timeout = command_timeout
+    self.scheduler = None
+    self._command = bytearray(MAX_COMMAND_LENGTH)
+    self._num_command_bytes = 0
+    self._command_start_time = 0
+    self.num_dropped_commands = 0
+
+  def tick(self, current_time):
+    """
+    Run the tick of `current_time`, the tick the scheduler woke up at. Return False if the tick was idle, without a
+    scan.
+    """
+    engine = self.engine
+    scheduler = self.scheduler
+    recovered_device = self.recovery.poll(current_time)
+    if recovered_device is not None:
+      self.on_device_recovered(recovered_device)
+    if self.data_serial is not None and (self._num_command_bytes > 0 or self.data_serial.in_waiting > 0):
+      self._poll_command(current_time)
+
+    idle_monitor = self.idle_monitor
+    latency_trace = self.latency_trace
+    if idle_monitor is not None and idle_monitor.is_idle:
+      if idle_monitor.poll(scheduler):
+        # Idle: only the columns were read, and no key is pressed
+        scheduler.schedule_next_scan(current_time)
+        return False
+      if latency_trace is not None:
+        # Woken up: the time spent idle is not a scan interval
+        latency_trace.skip_scan_interval()
+
+    if latency_trace is not None:
+      latency_trace.start_scan()
+
+    row_states = self.debouncer.debounce(current_time, self.key_matrix.scan_matrix_rows())
+    if latency_trace is not None:
+      latency_trace.mark(LatencyStage.SCAN_END)
+
+    num_key_events = engine.plan_events(current_time, row_states, scheduler)
+    if latency_trace is not None and num_key_events > 0:
+      latency_trace.mark(LatencyStage.EVENT_DETECTED)
+    engine.dispatch_events(current_time, scheduler)
+    if latency_trace is not None and num_key_events > 0:
+      latency_trace.mark(LatencyStage.DISPATCH)
+
+    # Send the key changes of this tick together
+    is_report_sent = engine.keyboard_output.flush()
+
+    if latency_trace is not None:
+      if is_report_sent:
+        latency_trace.mark(LatencyStage.REPORT_SENT)
+      latency_trace.end_tick()
+
+    if idle_monitor is not None:
+      idle_monitor.update(current_time, engine.is_quiet, scheduler)
+    scheduler.schedule_next_scan(current_time)
+    return True
+
+  def _poll_command(self, current_time):
+    # Read what has arrived of a command, and serve it once complete
+    serial = self.data_serial
+    command = self._command
+    if self._num_command_bytes > 0 and ticks_diff(current_time, self._command_start_time) > self.command_timeout:
+      # The rest never came, e.g. after a stray XON or XOFF, which are also key map command IDs
+      self._num_command_bytes = 0
+      self.num_dropped_commands += 1
+    num_waiting = serial.in_waiting
+    if num_waiting == 0:
+      return
+    if self._num_command_bytes == 0:
+      self._command_start_time = current_time
+    length = self._command_length()
+    while num_waiting > 0 and self._num_command_bytes < length:
+      size = min(num_waiting, length - self._num_command_bytes)
+      command[self._num_command_bytes:self._num_command_bytes + size] = serial.read(size)
+      self._num_command_bytes += size
+      num_waiting -= size
+      # SET_BUFFER tells its length in its 4th byte
+      length = self._command_length()
+    if self._num_command_bytes < length:
+      return
+    self._num_command_bytes = 0
+    data = memoryview(command)[:length]
+    # The key map commands are control bytes, and the latency ones are letters
+    if self.keymap_server is not None and self.keymap_server.command_length(data) > 0:
+      self.keymap_server.handle_command(data, serial)
+    elif self.latency_trace is not None:
+      self.latency_trace.handle_command(bytes(data), serial)
+
+  def _command_length(self):
+    # The latency commands are one byte
+    if self._num_command_bytes == 0 or self.keymap_server is None:
+      return 1
+    return max(1, self.keymap_server.command_length(memoryview(self._command)[:self._num_command_bytes]))
@@ -0,0 +1,139 @@
+from array import array
+
+from octave_pcb.ticks import ticks_add, ticks_diff, ticks_less
+
+SPEED_ONE = 16  # Speed factors are fixed point, 1/16 each
+
+
+class MouseKeysCurve:
+  CONSTANT = 0  # Always the speed of the key
+  LINEAR = 1
+  QUADRATIC = 2  # Slow at first for fine moves, then faster
+
+
+def make_speed_table(curve, max_speed, time_to_max, interval):
+  """
+  Return the speed factor of each move, in 1/SPEED_ONE, from 1 at the first move to `max_speed` after
+  `time_to_max` ms. The last one holds from then on.
+  """
+  num_steps = max(1, time_to_max // interval) + 1
+  table = array('H', [SPEED_ONE for _ in range(num_steps)])
+  if curve == MouseKeysCurve.CONSTANT:
+    return table
+  for step in range(num_steps):
+    if num_steps == 1:
+      ratio = 1.0
+    else:
+      ratio = step / (num_steps - 1)
+    if curve == MouseKeysCurve.QUADRATIC:
+      ratio = ratio * ratio
+    table[step] = round(SPEED_ONE * (1 + (max_speed - 1) * ratio))
+  return table
+
+
+class MouseKeysEngine:
+  """
+  Moves the pointer while CodeType.MOUSE_MOVE keys are held, one Mouse report every `interval` ms that combines all
+  held keys, accelerating along a speed table. The x and y of a key are its move at the first report; the wheel
+  moves every `wheel_interval` ms without acceleration.
+
+  The state is a few ints, so a tick allocates nothing but the report.
+  """
+
+  def __init__(self, interval=8, curve=MouseKeysCurve.QUADRATIC, max_speed=10, time_to_max=1000,
+               wheel_interval=80):
+    self.interval = interval
+    self.wheel_interval = wheel_interval
+    self._speed_table = make_speed_table(curve, max_speed, time_to_max, interval)
+    # Sum of the moves of the held keys, and the number of them
+    self._held_x = 0
+    self._held_y = 0
+    self._held_wheel = 0
+    self._num_held_keys = 0
+    self._step = 0
+    self._next_move_time = 0
+    self._next_wheel_time = 0
+    # Remainders of x and y below one count, in 1/SPEED_ONE
+    self._remainder_x = 0
+    self._remainder_y = 0
+
+  @property
+  def is_moving(self):
+    return self._num_held_keys > 0
+
+  @property
+  def next_timing(self):
+    if self._num_held_keys == 0:
+      return None
+    if self._held_wheel != 0 and ticks_less(self._next_wheel_time, self._next_move_time):
+      return self._next_wheel_time
+    return self._next_move_time
+
+  def clear(self):
+    self._held_x = 0
+    self._held_y = 0
+    self._held_wheel = 0
+    self._num_held_keys = 0
+
+  def press(self, current_time, move):
+    """
+    `move` is the keyword arguments of Mouse.move() of the key.
+    """
+    if self._num_held_keys == 0:
+      self._step = 0
+      self._next_move_time = current_time
+      self._next_wheel_time = current_time
+      self._remainder_x = 0
+      self._remainder_y = 0
+    elif move.get('wheel', 0) != 0 and self._held_wheel == 0:
+      self._next_wheel_time = current_time
+    self._held_x += move.get('x', 0)
+    self._held_y += move.get('y', 0)
+    self._held_wheel += move.get('wheel', 0)
+    self._num_held_keys += 1
+
+  def release(self, move):
+    self._held_x -= move.get('x', 0)
+    self._held_y -= move.get('y', 0)
+    self._held_wheel -= move.get('wheel', 0)
+    self._num_held_keys -= 1
+
+  def update(self, current_time, mouse):
+    """
+    Send the report of this tick if a move or wheel is due, and return True if it was sent.
+    """
+    if self._num_held_keys == 0:
+      return False
+    x = 0
+    y = 0
+    wheel = 0
+    if not ticks_less(current_time, self._next_move_time):
+      speed = self._speed_table[min(self._step, len(self._speed_table) - 1)]
+      self._remainder_x += self._held_x * speed
+      self._remainder_y += self._held_y * speed
+      x = _limit(self._remainder_x // SPEED_ONE)
+      y = _limit(self._remainder_y // SPEED_ONE)
+      self._remainder_x -= x * SPEED_ONE
+      self._remainder_y -= y * SPEED_ONE
+      self._step += 1
+      self._next_move_time = _next_time(self._next_move_time, current_time, self.interval)
+    if self._held_wheel != 0 and not ticks_less(current_time, self._next_wheel_time):
+      wheel = _limit(self._held_wheel)
+      self._next_wheel_time = _next_time(self._next_wheel_time, current_time, self.wheel_interval)
+    if x == 0 and y == 0 and wheel == 0:
+      return False
+    mouse.move(x, y, wheel)
+    return True
+
+
+def _next_time(timing, current_time, interval):
+  # Keep the cadence, unless a whole interval behind
+  timing = ticks_add(timing, interval)
+  if ticks_diff(current_time, timing) >= 0:
+    timing = ticks_add(current_time, interval)
+  return timing
+
+
+def _limit(count):
+  # One Mouse report moves by -127..127
+  return min(127, max(-127, count))
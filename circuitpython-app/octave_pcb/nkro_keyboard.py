@@ -0,0 +1,106 @@
+NKRO_REPORT_ID = 4
+NKRO_NUM_KEYCODES = 0xA0  # The bitmap covers keycodes 0x00..0x9F, including LANG1 and LANG2
+NKRO_REPORT_LENGTH = 1 + NKRO_NUM_KEYCODES // 8
+
+NKRO_REPORT_DESCRIPTOR = bytes((
+    0x05, 0x01,  # Usage Page (Generic Desktop)
+    0x09, 0x06,  # Usage (Keyboard)
+    0xA1, 0x01,  # Collection (Application)
+    0x85, NKRO_REPORT_ID,  # Report ID
+    # Modifiers
+    0x05, 0x07,  # Usage Page (Keyboard)
+    0x19, 0xE0,  # Usage Minimum (Left Control)
+    0x29, 0xE7,  # Usage Maximum (Right GUI)
+    0x15, 0x00,  # Logical Minimum (0)
+    0x25, 0x01,  # Logical Maximum (1)
+    0x75, 0x01,  # Report Size (1)
+    0x95, 0x08,  # Report Count (8)
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    # Keycode bitmap
+    0x19, 0x00,  # Usage Minimum (0)
+    0x29, NKRO_NUM_KEYCODES - 1,  # Usage Maximum
+    0x95, NKRO_NUM_KEYCODES,  # Report Count
+    0x81, 0x02,  # Input (Data, Variable, Absolute)
+    # LEDs
+    0x05, 0x08,  # Usage Page (LEDs)
+    0x19, 0x01,  # Usage Minimum (Num Lock)
+    0x29, 0x05,  # Usage Maximum (Kana)
+    0x95, 0x05,  # Report Count (5)
+    0x91, 0x02,  # Output (Data, Variable, Absolute)
+    0x75, 0x03,  # Report Size (3)
+    0x95, 0x01,  # Report Count (1)
+    0x91, 0x01,  # Output (Constant)
+    0xC0,  # End Collection
+))
+
+
+def create_nkro_device(usb_hid):
+  """
+  Create the usb_hid.Device of the NKRO keyboard. Call from boot.py.
+  """
+  return usb_hid.Device(
+      report_descriptor=NKRO_REPORT_DESCRIPTOR,
+      usage_page=0x01,
+      usage=0x06,
+      report_ids=(NKRO_REPORT_ID,),
+      in_report_lengths=(NKRO_REPORT_LENGTH,),
+      out_report_lengths=(1,),
+  )
+
+
+def find_nkro_device(devices):
+  """
+  Return the NKRO keyboard device enabled by boot.py, or None. It is the keyboard that follows the boot keyboard.
+  """
+  is_boot_keyboard_found = False
+  for device in devices:
+    if device.usage_page == 0x01 and device.usage == 0x06:
+      if is_boot_keyboard_found:
+        return device
+      is_boot_keyboard_found = True
+  return None
+
+
+class NkroKeyboard:
+  """
+  Keyboard with the same press/release interface as adafruit_hid.keyboard.Keyboard, sending a bitmap report.
+  The report buffer is updated in place.
+  """
+
+  def __init__(self, device):
+    self._device = device
+    self.report = bytearray(NKRO_REPORT_LENGTH)
+    self.release_all()
+
+  def press(self, *keycodes):
+    for keycode in keycodes:
+      index, bit = self._locate(keycode)
+      self.report[index] |= bit
+    self._device.send_report(self.report, NKRO_REPORT_ID)
+
+  def release(self, *keycodes):
+    for keycode in keycodes:
+      index, bit = self._locate(keycode)
+      self.report[index] &= ~bit
+    self._device.send_report(self.report, NKRO_REPORT_ID)
+
+  def release_all(self):
+    for index in range(len(self.report)):
+      self.report[index] = 0
+    self._device.send_report(self.report, NKRO_REPORT_ID)
+
+  def send(self, *keycodes):
+    self.press(*keycodes)
+    self.release_all()
+
+  @property
+  def led_status(self):
+    return self._device.get_last_received_report(NKRO_REPORT_ID)
+
+  @staticmethod
+  def _locate(keycode):
+    if 0xE0 <= keycode <= 0xE7:
+      return 0, 1 << (keycode - 0xE0)
+    if 0 <= keycode < NKRO_NUM_KEYCODES:
+      return 1 + (keycode >> 3), 1 << (keycode & 0x07)
+    raise ValueError('Keycode not in the NKRO report: {}'.format(keycode))
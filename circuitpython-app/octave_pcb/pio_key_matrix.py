@@ -0,0 +1,123 @@
+from array import array
+
+import board
+
+from octave_pcb.key_matrix import COL_PINS, ROW_PINS
+
+# PIO counts pins up from the first one: the rows are GPIO22..29 and the columns GPIO14..21, both in the reverse
+# order of ROW_PINS and COL_PINS
+FIRST_ROW_PIN = board.GPIO22
+FIRST_COL_PIN = board.GPIO14
+PIO_FREQUENCY = 2_000_000  # Hz, 0.5 us per cycle
+SETTLE_CYCLES = 19  # The columns settle for 20 cycles, 10 us, after a row is selected
+
+# For each trigger word written to it, selects each row in turn and pushes one word per row, with the same bit order as
+# KeyMatrix.row_states. The rows are driven low and selected by their pin directions, as with the open-drain outputs
+# of KeyMatrix.
+PROGRAM = """
+.program key_matrix
+    pull block          ; the row selections of rows 0..3, one byte each
+    mov x, osr
+    pull block          ; and of rows 4..7
+    mov y, osr
+.wrap_target
+    pull block          ; wait for the trigger word of a scan
+    mov osr, x
+rows_0_3:
+    out pindirs, 8 [{settle_cycles}]
+    mov isr, ::pins     ; reversed: column N at bit 24 + N
+    mov isr, ~isr       ; set while pressed
+    in null, 24         ; down to bit N
+    push block
+    jmp !osre rows_0_3
+    mov osr, y
+rows_4_7:
+    out pindirs, 8 [{settle_cycles}]
+    mov isr, ::pins
+    mov isr, ~isr
+    in null, 24
+    push block
+    jmp !osre rows_4_7
+.wrap
+"""
+
+
+def row_select_words(num_rows):
+  """
+  Return the two words that the program selects the rows from: byte n of a word is the pin directions of the row
+  pins while row 4 * word + n is selected.
+  """
+  words = array('L', (0, 0))
+  for row in range(num_rows):
+    # Row 0 is the last pin from FIRST_ROW_PIN
+    words[row // 4] |= (1 << (num_rows - 1 - row)) << 8 * (row % 4)
+  return words
+
+
+def decode_snapshot(snapshot, row_states):
+  """
+  Copy a snapshot, one word per row as pushed by the program, into `row_states` and return it.
+  """
+  for row in range(len(row_states)):
+    row_states[row] = snapshot[row] & 0xFF
+  return row_states
+
+
+class PioKeyMatrix:
+  """
+  KeyMatrix scanned by a PIO state machine of the RP2040, which scans the matrix once per trigger word.
+
+  On CircuitPython 9.1 or later, DMA writes the trigger words and copies each scan into a snapshot buffer in the
+  background, so a scan is a copy of the last one. Otherwise each call writes a trigger word and reads the scan it
+  starts: the RX FIFO holds only 4 of the 8 rows, so a state machine scanning freely would wait on a full FIFO with
+  rows 0..3 of a scan as old as the previous call.
+  """
+
+  def __init__(self):
+    import adafruit_pioasm
+    import rp2pio
+
+    self.num_rows = len(ROW_PINS)
+    self.num_cols = len(COL_PINS)
+    program = adafruit_pioasm.Program(PROGRAM.format(settle_cycles=SETTLE_CYCLES))
+    self._state_machine = rp2pio.StateMachine(
+        program.assembled, PIO_FREQUENCY,
+        first_out_pin=FIRST_ROW_PIN, out_pin_count=self.num_rows, initial_out_pin_state=0,
+        initial_out_pin_direction=0,
+        first_in_pin=FIRST_COL_PIN, in_pin_count=self.num_cols, pull_in_pin_up=(1 << self.num_cols) - 1,
+        out_shift_right=True, in_shift_right=True,
+        **program.pio_kwargs)
+    # One word per row, preallocated so that no scan allocates
+    self._snapshot = array('L', [0] * self.num_rows)
+    self._trigger = array('L', [0])
+    self._is_read_in_background = hasattr(self._state_machine, 'background_read')
+    if self._is_read_in_background:
+      # Before the program starts scanning, so that each loop of the buffer is one scan
+      self._state_machine.background_read(loop=self._snapshot)
+    self._state_machine.write(row_select_words(self.num_rows))
+    if self._is_read_in_background:
+      # After the row selections, so that the program takes every later word as a trigger, and scans over and over
+      self._state_machine.background_write(loop=self._trigger)
+    # One byte per row, bit N is set while the key on column N is pressed
+    self.row_states = bytearray(self.num_rows)
+
+  def deinit(self):
+    self._state_machine.deinit()
+
+  def scan_matrix(self):
+    row_states = self.scan_matrix_rows()
+    are_keys_pressed = []
+    for row in range(self.num_rows):
+      are_keys_pressed.extend(
+          [True if row_states[row] & (1 << col) else False for col in range(self.num_cols)]
+      )
+    return are_keys_pressed
+
+  def scan_matrix_rows(self):
+    """
+    Copy the last scan into `row_states` and return it. The buffer is reused by every scan.
+    """
+    if not self._is_read_in_background:
+      # A scan from now, about 100 us
+      self._state_machine.write_readinto(self._trigger, self._snapshot)
+    return decode_snapshot(self._snapshot, self.row_states)
@@ -0,0 +1,205 @@
+import time
+
+from octave_pcb.nkro_keyboard import NKRO_REPORT_LENGTH
+from octave_pcb.ticks import ticks_add, ticks_diff, ticks_less, ticks_ms
+
+# Input report lengths of the devices of boot.py by (usage page, usage), after the report ID
+BOOT_KEYBOARD_REPORT_LENGTH = 8
+MOUSE_REPORT_LENGTH = 4
+CONSUMER_CONTROL_REPORT_LENGTH = 2
+
+# A restart this long after the previous one is not part of a restart loop
+RESTART_LOOP_WINDOW = 10000  # ms
+# send_report() of CircuitPython 8 waits this long for the endpoint before it raises OSError('USB busy')
+SEND_TIMEOUT = 2000  # ms
+
+
+class FailureKind:
+  HID_SEND = 0  # OSError from sending a HID report, e.g. while the host is suspended
+  OTHER = 1  # Anything else, e.g. a bug; the main loop restarts
+
+
+def classify_failure(error):
+  return FailureKind.HID_SEND if isinstance(error, OSError) else FailureKind.OTHER
+
+
+def in_report_lengths(devices):
+  """
+  Return the input report length of each of `devices`, which usb_hid.Device does not tell. The first keyboard is the
+  boot keyboard and the next one the NKRO keyboard, as find_nkro_device() expects.
+  """
+  lengths = []
+  is_boot_keyboard_found = False
+  for device in devices:
+    if device.usage_page == 0x01 and device.usage == 0x06:
+      lengths.append(NKRO_REPORT_LENGTH if is_boot_keyboard_found else BOOT_KEYBOARD_REPORT_LENGTH)
+      is_boot_keyboard_found = True
+    elif device.usage_page == 0x01 and device.usage == 0x02:
+      lengths.append(MOUSE_REPORT_LENGTH)
+    elif device.usage_page == 0x0C and device.usage == 0x01:
+      lengths.append(CONSUMER_CONTROL_REPORT_LENGTH)
+    else:
+      raise ValueError('Unknown HID device: usage page {:#04x}, usage {:#04x}'.format(device.usage_page, device.usage))
+  return lengths
+
+
+class RetryingDevice:
+  """
+  A usb_hid.Device that retries a send_report() that failed at once after short delays. A send that timed out, after
+  send_report() waited SEND_TIMEOUT for the endpoint, is not retried, and neither is a send while `runtime` tells that
+  the host is not ready, e.g. suspended. The device is then marked failed and its reports are dropped until Recovery
+  brings it back, so a host that takes no reports stalls the scan loop once, and not on every report.
+  """
+
+  def __init__(self, device, report_length, runtime, retry_delays, ticks_ms, sleep):
+    self.device = device
+    self.usage_page = device.usage_page
+    self.usage = device.usage
+    self.report_length = report_length
+    self._runtime = runtime
+    self._retry_delays = retry_delays
+    self._ticks_ms = ticks_ms
+    self._sleep = sleep
+    self.is_failed = False
+    self.num_retries = 0
+    self.num_failures = 0
+
+  def send_report(self, report, report_id=None):
+    if self.is_failed:
+      return
+    if self._runtime is not None and not self._runtime.usb_connected:
+      # Sending would wait out SEND_TIMEOUT
+      self.is_failed = True
+      self.num_failures += 1
+      return
+    for attempt in range(len(self._retry_delays) + 1):
+      send_time = self._ticks_ms()
+      try:
+        if report_id is None:
+          self.device.send_report(report)
+        else:
+          self.device.send_report(report, report_id)
+        return
+      except OSError:
+        if attempt == len(self._retry_delays) or ticks_diff(self._ticks_ms(), send_time) >= SEND_TIMEOUT:
+          self.is_failed = True
+          self.num_failures += 1
+          return
+        self.num_retries += 1
+        self._sleep(self._retry_delays[attempt] / 1000)
+
+  def get_last_received_report(self, report_id=None):
+    if report_id is None:
+      return self.device.get_last_received_report()
+    return self.device.get_last_received_report(report_id)
+
+  def probe(self):
+    """
+    Send an all-released report directly, and return True if the host took it. This blocks for SEND_TIMEOUT if the
+    host takes no report.
+    """
+    try:
+      # Without a report ID, the first report of the device
+      self.device.send_report(bytes(self.report_length))
+      return True
+    except OSError:
+      return False
+
+
+class Recovery:
+  """
+  Recovers from failures without throwing away the key state:
+
+  - A HID send that fails at once is retried after `retry_delays` ms. A failed device, whose retries all failed or
+    whose send timed out, is probed with an all-released report as soon as `runtime.usb_connected` (supervisor.runtime)
+    tells that the host is back, e.g. resumed from suspend, and otherwise every `probe_interval` ms, as each probe of
+    a host that takes no report blocks for SEND_TIMEOUT. Once a probe goes through, `poll()` returns the device so that
+    only its HID object is rebuilt.
+  - Other failures restart the main loop after `restart_delays` seconds, longer for each restart in a row.
+
+  The counters are for diagnostics.
+  """
+
+  def __init__(self, devices, runtime=None, retry_delays=(1, 2, 4), probe_interval=10000,
+               restart_delays=(0.01, 0.1, 1.0, 3.0), ticks_ms=ticks_ms, sleep=time.sleep):
+    self.devices = tuple(RetryingDevice(device, report_length, runtime, retry_delays, ticks_ms, sleep)
+                         for device, report_length in zip(devices, in_report_lengths(devices)))
+    self._runtime = runtime
+    self.probe_interval = probe_interval
+    self._restart_delays = restart_delays
+    self._ticks_ms = ticks_ms
+    # None while no device is failed: ticks only compare within half their period, 3.1 days
+    self._probe_timing = None
+    self._was_host_ready = True
+    self._num_restarts_in_row = 0
+    self._last_restart_time = None
+    self.num_recoveries = 0
+    self.num_restarts = 0
+    self.last_failure_kind = None
+
+  @property
+  def num_retries(self):
+    return sum(device.num_retries for device in self.devices)
+
+  @property
+  def num_failures(self):
+    return sum(device.num_failures for device in self.devices)
+
+  def poll(self, current_time):
+    """
+    Probe the failed devices when due, and return the first one that is back, or None. Called every tick, it also
+    forgets a restart once it is too old to be part of a restart loop.
+    """
+    self._forget_old_restart(current_time)
+    is_host_ready = self._runtime is None or self._runtime.usb_connected
+    is_host_back = is_host_ready and not self._was_host_ready
+    self._was_host_ready = is_host_ready
+    if not self._is_any_device_failed():
+      self._probe_timing = None
+      return None
+    if self._probe_timing is None:
+      # The failure may have just blocked for SEND_TIMEOUT
+      self._probe_timing = ticks_add(current_time, self.probe_interval)
+    if not is_host_ready or not is_host_back and ticks_less(current_time, self._probe_timing):
+      return None
+    for device in self.devices:
+      if device.is_failed:
+        if not device.probe():
+          # The devices share the endpoint, so the probes of the others would block as long
+          self._probe_timing = ticks_add(current_time, self.probe_interval)
+          return None
+        device.is_failed = False
+        self.num_recoveries += 1
+        # The next failed device on the next tick
+        self._probe_timing = current_time
+        return device
+    return None
+
+  def restart_delay(self, error):
+    """
+    Count a restart of the main loop for `error`, and return the seconds to wait before it. A HID send failure that
+    got through, e.g. from an unwrapped device, waits the shortest delay; other failures wait longer for each restart
+    in a row.
+    """
+    current_time = self._ticks_ms()
+    self._forget_old_restart(current_time)
+    self._last_restart_time = current_time
+    self.num_restarts += 1
+    self.last_failure_kind = classify_failure(error)
+    if self.last_failure_kind == FailureKind.HID_SEND:
+      return self._restart_delays[0]
+    delay = self._restart_delays[min(self._num_restarts_in_row, len(self._restart_delays) - 1)]
+    self._num_restarts_in_row += 1
+    return delay
+
+  def _is_any_device_failed(self):
+    for device in self.devices:
+      if device.is_failed:
+        return True
+    return False
+
+  def _forget_old_restart(self, current_time):
+    if self._last_restart_time is not None and ticks_diff(current_time, self._last_restart_time) > RESTART_LOOP_WINDOW:
+      # Not a restart loop
+      self._last_restart_time = None
+      self._num_restarts_in_row = 0
@@ -0,0 +1,50 @@
+import time
+
+from octave_pcb.ticks import ticks_add, ticks_diff, ticks_less, ticks_ms
+
+
+class Scheduler:
+  """
+  Sleeps the main loop until its next deadline: the next scan tick or an earlier deadline requested during the
+  current iteration, e.g. a long press or pending HID output.
+
+  Times are ticks in milliseconds, see octave_pcb.ticks. `ticks_ms` and `sleep` can be replaced with a virtual clock.
+  """
+
+  def __init__(self, scan_interval, ticks_ms=ticks_ms, sleep=time.sleep):
+    self.scan_interval = scan_interval
+    self._ticks_ms = ticks_ms
+    self._sleep = sleep
+    self._requested_timing = None
+    self.scan_timing = ticks_ms()
+
+  def request(self, timing):
+    # Wake up no later than `timing`
+    if self._requested_timing is None or ticks_less(timing, self._requested_timing):
+      self._requested_timing = timing
+
+  def next_timing(self):
+    if self._requested_timing is not None and ticks_less(self._requested_timing, self.scan_timing):
+      return self._requested_timing
+    return self.scan_timing
+
+  def wait(self):
+    """
+    Sleep until the next deadline and return the current time.
+    """
+    timing = self.next_timing()
+    self._requested_timing = None
+    current_time = self._ticks_ms()
+    wait_time = ticks_diff(timing, current_time)
+    if wait_time > 0:
+      self._sleep(wait_time / 1000)
+      current_time = self._ticks_ms()
+    return current_time
+
+  def schedule_next_scan(self, current_time):
+    if ticks_less(current_time, self.scan_timing):
+      # Woken up early by a requested deadline
+      return
+    self.scan_timing = ticks_add(self.scan_timing, self.scan_interval)
+    if not ticks_less(current_time, self.scan_timing):
+      self.scan_timing = ticks_add(current_time, self.scan_interval)
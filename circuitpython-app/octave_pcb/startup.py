@@ -0,0 +1,40 @@
+import time
+
+from octave_pcb.ticks import ticks_diff, ticks_ms
+
+
+class StartupTiming:
+  """
+  Milliseconds spent in each phase of the startup, from `start_time` to the first `mark()` and between the marks.
+  """
+
+  def __init__(self, start_time, ticks_ms=ticks_ms):
+    self._ticks_ms = ticks_ms
+    self._start_time = start_time
+    self._last_time = start_time
+    self.phases = []
+
+  @property
+  def total(self):
+    return ticks_diff(self._last_time, self._start_time)
+
+  def mark(self, name):
+    current_time = self._ticks_ms()
+    self.phases.append((name, ticks_diff(current_time, self._last_time)))
+    self._last_time = current_time
+
+  def format(self):
+    return 'Startup: {} ms ({})'.format(self.total, ', '.join('{} {} ms'.format(name, ms) for name, ms in self.phases))
+
+
+def wait_for_usb(runtime, timeout, ticks_ms=ticks_ms, sleep=time.sleep):
+  """
+  Wait until the host has enumerated the keyboard (`runtime` is supervisor.runtime), or for `timeout` ms without a
+  host, e.g. on a charger. Return True if connected.
+  """
+  start_time = ticks_ms()
+  while not runtime.usb_connected:
+    if ticks_diff(ticks_ms(), start_time) >= timeout:
+      return False
+    sleep(0.005)
+  return True
@@ -0,0 +1,69 @@
+from octave_pcb.ticks import ticks_add, ticks_less
+
+
+class TapHoldMode:
+  HOLD_ON_OTHER_KEY_PRESS = 0  # Hold as soon as another key is pressed
+  PERMISSIVE_HOLD = 1  # Hold when another key is pressed and released; the other key waits for the decision
+
+
+class TapHoldEngine:
+  """
+  Tracks the tap-hold keys (ComplexModifierAssignment) whose tap or hold is not decided yet, and in
+  PERMISSIVE_HOLD mode the key events held back until the decision. Only these few keys are ever visited.
+
+  Times are ticks in milliseconds, see octave_pcb.ticks.
+  """
+
+  def __init__(self, tapping_term=500, mode=TapHoldMode.HOLD_ON_OTHER_KEY_PRESS, max_queued_events=16):
+    self.tapping_term = tapping_term
+    self.mode = mode
+    self._max_queued_events = max_queued_events
+    # Undecided keys and their deadlines, in the order of press
+    self.pending_keys = []
+    self._deadlines = []
+    # Key events held back until the decision, in the order of occurrence
+    self.queued_keys = []
+    self.queued_events = []
+
+  def clear(self):
+    self.pending_keys.clear()
+    self._deadlines.clear()
+    self.queued_keys.clear()
+    self.queued_events.clear()
+
+  def press(self, i, current_time):
+    self.pending_keys.append(i)
+    self._deadlines.append(ticks_add(current_time, self.tapping_term))
+
+  def remove(self, i):
+    """
+    Stop tracking the key, and return True if it was undecided.
+    """
+    for n in range(len(self.pending_keys)):
+      if self.pending_keys[n] == i:
+        self.pending_keys.pop(n)
+        self._deadlines.pop(n)
+        return True
+    return False
+
+  def next_deadline(self):
+    # Deadlines are in the order of press, so the first one is the earliest
+    return self._deadlines[0] if len(self._deadlines) > 0 else None
+
+  def expired_key(self, current_time):
+    """
+    Return the first key whose tapping term has passed, or -1.
+    """
+    if len(self._deadlines) > 0 and not ticks_less(current_time, self._deadlines[0]):
+      return self.pending_keys[0]
+    return -1
+
+  def is_queue_full(self):
+    return len(self.queued_keys) >= self._max_queued_events
+
+  def queue(self, i, key_event):
+    self.queued_keys.append(i)
+    self.queued_events.append(key_event)
+
+  def is_queued(self, i):
+    return i in self.queued_keys
@@ -0,0 +1,34 @@
+"""
+Wraparound-safe arithmetic on supervisor.ticks_ms(), which counts milliseconds as a small int modulo 2**29.
+Unlike time.monotonic(), it keeps millisecond resolution however long the keyboard has been up.
+
+ticks_us() wraps the same way, every 537 s, which is plenty for the spans of a scan. It is built on
+time.monotonic_ns(), which allocates a long int per call, so use it for diagnostics only.
+"""
+import time
+
+import supervisor
+
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+ticks_ms = supervisor.ticks_ms
+
+
+def ticks_us():
+  return time.monotonic_ns() // 1000 & TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+  return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+  # Signed ticks1 - ticks2, correct while the two are less than half a period apart
+  diff = (ticks1 - ticks2) & TICKS_MAX
+  return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def ticks_less(ticks1, ticks2):
+  return ticks_diff(ticks1, ticks2) < 0
@@ -0,0 +1,54 @@
+"""
+Host-side benchmark of the combo engine with many combos defined.
+
+  % python tools/bench_combo.py
+
+The typing and rolls traces of tools/simulate.py are played with 0 to a few hundred random combos of 2 to 4 keys.
+Combos are indexed by the set of their keys, so the CPU time per tick should not grow with their number.
+"""
+import os
+import random
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, CORPUS, find_key_positions, percentile, rolls_trace, run, typing_trace  # noqa: E402
+
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.keymap import CodeType, Combo, CompiledKeyMap, KeyAssignment  # noqa: E402
+
+NUM_COMBOS = (0, 10, 100, 300, 600)
+
+
+def make_combos(rng, num_combos, num_rows=8, num_cols=8):
+  combos = []
+  key_sets = set()
+  while len(combos) < num_combos:
+    keys = tuple(sorted(rng.sample([(row, col) for row in range(num_rows) for col in range(num_cols)],
+                                   rng.randint(2, 4))))
+    if keys not in key_sets:
+      key_sets.add(keys)
+      combos.append(Combo(keys, KeyAssignment(CodeType.KEYBOARD, Keycode.F13)))
+  return combos
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  positions = find_key_positions(CompiledKeyMap(app['KEY_MAP_LAYERS']), 8)
+  traces = {
+      'typing': typing_trace(positions, CORPUS),
+      'rolls': rolls_trace(positions),
+  }
+  print(f'{"trace":8s} {"combos":>6s} {"p50 us":>8s} {"p99 us":>8s} {"p50 us (event ticks)":>21s}')
+  for name, trace in traces.items():
+    for num_combos in NUM_COMBOS:
+      app['COMBOS'] = make_combos(random.Random(num_combos), num_combos)
+      _, result = run(app, trace)
+      event_tick_ns = [ns for ns, num_key_events in zip(result.tick_ns, result.tick_key_events) if num_key_events > 0]
+      print(f'{name:8s} {num_combos:6d} {percentile(result.tick_ns, 0.5) / 1000:8.1f}'
+            f' {percentile(result.tick_ns, 0.99) / 1000:8.1f} {percentile(event_tick_ns, 0.5) / 1000:21.1f}')
+
+
+if __name__ == '__main__':
+  main()
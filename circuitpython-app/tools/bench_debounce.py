@@ -0,0 +1,101 @@
+"""
+Host-side simulation of the debounce algorithms on synthetic bounce traces.
+
+  % python tools/bench_debounce.py
+
+Each trace presses one key with contact bounce, holds it and releases it with bounce. The matrix is sampled every
+scan interval and the latency is measured from the first physical edge to the debounced edge. "throttle 20ms" is
+the former behavior: a raw sample every 20 ms without a debouncer.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'host'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from octave_pcb.key_event import DebounceAlgorithm, Debouncer  # noqa: E402
+
+DEBOUNCE_TIME = 5  # ms
+NUM_TRACES = 200
+
+
+def make_bounce_trace(rng):
+  """
+  Return the physical edges [(time, is_pressed), ...] of one keystroke, starting at a random phase.
+  """
+  edges = []
+  t = rng.uniform(0.0, 0.02)
+  press_time = t
+  for _ in range(rng.randint(0, 4)):
+    edges.append((t, True))
+    t += rng.uniform(0.0001, 0.0008)
+    edges.append((t, False))
+    t += rng.uniform(0.0001, 0.0005)
+  edges.append((t, True))
+  t = press_time + rng.uniform(0.04, 0.12)
+  release_time = t
+  for _ in range(rng.randint(0, 4)):
+    edges.append((t, False))
+    t += rng.uniform(0.0001, 0.0008)
+    edges.append((t, True))
+    t += rng.uniform(0.0001, 0.0005)
+  edges.append((t, False))
+  return press_time, release_time, edges
+
+
+def level_at(edges, t):
+  is_pressed = False
+  for edge_time, edge_is_pressed in edges:
+    if edge_time > t:
+      break
+    is_pressed = edge_is_pressed
+  return is_pressed
+
+
+def simulate(algorithm, scan_interval, trace):
+  press_time, release_time, edges = trace
+  debouncer = Debouncer(1, 1, algorithm, DEBOUNCE_TIME) if algorithm is not None else None
+  raw_row_states = bytearray(1)
+  reported = []
+  last_state = 0
+  end_time = edges[-1][0] + 0.05
+  n = 0
+  while n * scan_interval < end_time:
+    t = n * scan_interval
+    raw_row_states[0] = 1 if level_at(edges, t) else 0
+    row_states = debouncer.debounce(round(t * 1000), raw_row_states) if debouncer is not None else raw_row_states
+    if row_states[0] != last_state:
+      last_state = row_states[0]
+      reported.append((t, last_state == 1))
+    n += 1
+  is_clean = [is_pressed for _, is_pressed in reported] == [True, False]
+  press_latency = reported[0][0] - press_time if reported else None
+  release_latency = reported[-1][0] - release_time if reported else None
+  return is_clean, press_latency, release_latency
+
+
+def summarize(name, results):
+  clean = sum(1 for is_clean, _, _ in results if is_clean)
+  press = sorted(r[1] for r in results if r[0])
+  release = sorted(r[2] for r in results if r[0])
+
+  def ms(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float('nan')
+
+  print(f'{name:<18} clean {clean:3d}/{len(results)}'
+        f'  press p50 {ms(press, 0.5):5.1f} ms max {ms(press, 1.0):5.1f} ms'
+        f'  release p50 {ms(release, 0.5):5.1f} ms max {ms(release, 1.0):5.1f} ms')
+
+
+if __name__ == '__main__':
+  rng = random.Random(0)
+  traces = [make_bounce_trace(rng) for _ in range(NUM_TRACES)]
+  cases = [
+      ('throttle 20ms', None, 0.02),
+      ('eager per key', DebounceAlgorithm.EAGER_PER_KEY, 0.001),
+      ('defer per key', DebounceAlgorithm.DEFER_PER_KEY, 0.001),
+      ('defer global', DebounceAlgorithm.DEFER_GLOBAL, 0.001),
+  ]
+  for name, algorithm, scan_interval in cases:
+    summarize(name, [simulate(algorithm, scan_interval, trace) for trace in traces])
@@ -0,0 +1,78 @@
+"""
+Host-side benchmark of one matrix scan plus key event planning, with fake `board` and `digitalio` pins.
+
+  % python tools/bench_key_matrix.py
+
+"full" is `KeyMatrix.scan_matrix()` followed by `make_event` on all planners, "incremental" is
+`KeyMatrix.scan_matrix_rows()` followed by `make_event` on the changed or held keys only, as in code.py.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'host'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import board  # noqa: E402
+import digitalio  # noqa: E402
+
+from octave_pcb.key_event import KeyEventPlanner  # noqa: E402
+from octave_pcb.key_matrix import KeyMatrix  # noqa: E402
+
+NUM_SCANS = 2000
+
+
+def scan_full(key_matrix, key_event_planners, current_time):
+  are_keys_pressed = key_matrix.scan_matrix()
+  for i, key_event_planner in enumerate(key_event_planners):
+    key_event_planner.make_event(current_time, are_keys_pressed[i])
+
+
+def scan_incremental(key_matrix, key_event_planners, current_time, last_row_states):
+  num_cols = len(key_matrix.col_ios)
+  row_states = key_matrix.scan_matrix_rows()
+  for row in range(len(row_states)):
+    row_state = row_states[row]
+    visit_bits = row_state | last_row_states[row]
+    last_row_states[row] = row_state
+    if visit_bits == 0:
+      continue
+    for col in range(num_cols):
+      bit = 1 << col
+      if visit_bits & bit:
+        key_event_planners[row * num_cols + col].make_event(current_time, (row_state & bit) != 0)
+
+
+def run(name, pressed_positions):
+  digitalio.reset()
+  key_matrix = KeyMatrix()
+  for row, col in pressed_positions:
+    digitalio.closed_switches.add((key_matrix.row_ios[row]._pin, key_matrix.col_ios[col]._pin))
+  num_keys = len(key_matrix.row_ios) * len(key_matrix.col_ios)
+
+  results = []
+  for mode in ('full', 'incremental'):
+    key_event_planners = [KeyEventPlanner() for _ in range(num_keys)]
+    last_row_states = bytearray(len(key_matrix.row_ios))
+    digitalio.stats['reads'] = 0
+    digitalio.stats['writes'] = 0
+    start = time.perf_counter()
+    for n in range(NUM_SCANS):
+      if mode == 'full':
+        scan_full(key_matrix, key_event_planners, n * 20)
+      else:
+        scan_incremental(key_matrix, key_event_planners, n * 20, last_row_states)
+    elapsed = time.perf_counter() - start
+    results.append((mode, elapsed / NUM_SCANS * 1e6,
+                    digitalio.stats['writes'] / NUM_SCANS, digitalio.stats['reads'] / NUM_SCANS))
+
+  print(name)
+  for mode, us_per_scan, writes, reads in results:
+    print(f'  {mode:<12} {us_per_scan:8.1f} us/scan {writes:6.1f} writes/scan {reads:6.1f} reads/scan')
+  key_matrix.deinit()
+
+
+if __name__ == '__main__':
+  run('idle', [])
+  run('2 keys held', [(3, 0), (2, 3)])
+  run('6 keys held', [(3, 0), (2, 3), (2, 4), (2, 5), (6, 1), (6, 2)])
@@ -0,0 +1,184 @@
+"""
+Host-side check of the key map stored in NVM and of its get/set commands over the usb_cdc data channel.
+
+  % python tools/check_binary_keymap.py
+
+The key map is stored in the stand-in of microcontroller.nvm, which has no buffer protocol like nvm.ByteArray. Keys
+are set through tools/push_keymap.py while the main loop of tools/simulate.py runs, and typed right after. It exits
+with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from check_recovery import run_with_faults  # noqa: E402
+from check_tap_hold import decode_states  # noqa: E402
+from push_keymap import DEFAULT_LAYOUT, KeymapClient, load_keymap_c, load_layout, push, to_record  # noqa: E402
+from simulate import APP_DIR, Firmware, VirtualClock, check, find_key_positions  # noqa: E402
+
+import microcontroller  # noqa: E402
+import usb_cdc  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.binary_keymap import HEADER_LENGTH, BinaryKeyMap, encode_key_map  # noqa: E402
+from octave_pcb.keymap import KeyOp  # noqa: E402
+from octave_pcb.keymap_server import KeymapCommand  # noqa: E402
+
+KEYMAP_C = os.path.join(APP_DIR, '..', 'vial-porting', 'keymaps', 'vial', 'keymap.c')
+
+
+class FirmwareConnection:
+  """
+  A pyserial-like connection to the data channel of a Firmware, which runs one tick for each write.
+  """
+
+  def __init__(self, firmware):
+    self.firmware = firmware
+
+  def write(self, data):
+    usb_cdc.data.feed(data)
+    self.firmware.tick(self.firmware.scheduler.wait())
+
+  def read(self, size):
+    data = bytes(usb_cdc.data.written[:size])
+    del usb_cdc.data.written[:size]
+    return data
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  nvm = microcontroller.nvm
+  nvm.reset()
+  results = []
+
+  firmware = Firmware(app, VirtualClock())
+  key_map = firmware.key_map
+  layers = key_map.layers
+  results.append(check('empty NVM: the layers of code.py', not firmware.keymap_server.binary_key_map.is_valid
+                       and firmware.key_map.layers is layers, ''))
+
+  binary_key_map = BinaryKeyMap(nvm, 8, 8)
+  binary_key_map.write(layers)
+  records = [list(layer) for layer in binary_key_map.layers]
+  results.append(check(f'{len(layers)} layers written in {nvm.num_writes} write, read back in place',
+                       nvm.num_writes == 1 and records == [list(layer) for layer in layers], ''))
+  buffer = encode_key_map(layers, 8, 8)
+  view = BinaryKeyMap(buffer, 8, 8)
+  buffer[HEADER_LENGTH + 2] = 0x2A
+  results.append(check('a bytearray is read through a memoryview, with no copy', view.get(0, 0, 0)[1] == 0x2A,
+                       str(view.get(0, 0, 0))))
+  results.append(check('a key map of another matrix is ignored', not BinaryKeyMap(nvm, 8, 7).is_valid, ''))
+  nvm.reset()
+
+  firmware = Firmware(app, VirtualClock())
+  connection = FirmwareConnection(firmware)
+  client = KeymapClient(connection)
+  positions = find_key_positions(key_map, 8)
+  a_row, a_col = positions[Keycode.A]
+  results.append(check('get layer count', client.get_layer_count() == len(layers), ''))
+  reply = client.request(KeymapCommand.GET_KEYCODE, bytes((0, a_row, a_col)), 7)
+  results.append(check('get keycode of A from code.py', reply[3:] == bytes((KeyOp.KEYBOARD, 0, Keycode.A, 0)),
+                       reply.hex()))
+  client.request(KeymapCommand.SET_KEYCODE, bytes((0, a_row, a_col, KeyOp.KEYBOARD, 0, Keycode.B, 0)), 7)
+  results.append(check('set keycode stores the key map', firmware.keymap_server.binary_key_map.is_valid
+                       and firmware.key_map.layers is not layers, ''))
+  connection.write(b's')
+  summary = connection.read(len(usb_cdc.data.written))
+  results.append(check('the latency summary is still served', summary.startswith(b'span'), repr(summary[:20])))
+  for name, arguments in (('an op with a side table', bytes((0, 0, 0, KeyOp.MACRO, 0, 0, 0))),
+                          ('a layer out of range', bytes((9, 0, 0, KeyOp.KEYBOARD, 0, Keycode.C, 0)))):
+    connection.write(bytes((KeymapCommand.SET_KEYCODE,)) + arguments)
+    reply = connection.read(8)
+    results.append(check(f'set keycode of {name} fails', reply == bytes((KeymapCommand.UNHANDLED,)), reply.hex()))
+
+  # Args out of range for their op, by SET_KEYCODE and by SET_BUFFER: the stored key map is left as it was
+  num_layers = len(layers)
+  invalid_records = (
+      ('a keycode over 255', KeyOp.KEYBOARD, 0x104),
+      ('a keycode the NKRO keyboard cannot send', KeyOp.KEYBOARD, 0xA5),
+      ('a layer key to a layer out of range', KeyOp.LAYER, num_layers),
+      ('mouse buttons over a byte', KeyOp.MOUSE_BUTTON, 0x100),
+      ('a complex modifier with an invalid modifier', KeyOp.COMPLEX_MODIFIER, 0xF0 << 8 | Keycode.A),
+      ('a complex modifier with an invalid standalone key', KeyOp.COMPLEX_MODIFIER, Keycode.LEFT_SHIFT << 8 | 0xA5),
+      ('a complex layer to a layer out of range', KeyOp.COMPLEX_LAYER, num_layers << 8 | Keycode.A),
+      ('no key with an arg', KeyOp.NONE, 1),
+  )
+  stored_records = firmware.keymap_server.binary_key_map.read_records(0, 4)
+  for name, op, arg in invalid_records:
+    record = bytes((op & 0xFF, op >> 8, arg & 0xFF, arg >> 8))
+    connection.write(bytes((KeymapCommand.SET_KEYCODE, 0, 0, 0)) + record)
+    set_keycode_reply = connection.read(8)
+    connection.write(bytes((KeymapCommand.SET_BUFFER, 0, 0, len(record))) + record)
+    set_buffer_reply = connection.read(4)
+    results.append(check(f'set keycode and set buffer of {name} fail', set_keycode_reply == set_buffer_reply
+                         == bytes((KeymapCommand.UNHANDLED,)) and firmware.keymap_server.binary_key_map.read_records(
+                             0, 4) == stored_records, f'{set_keycode_reply.hex()}, {set_buffer_reply.hex()}'))
+
+  # A command cut short: the scan goes on, and the command is served once the rest arrives, or dropped
+  main_loop = firmware.main_loop
+  command = bytes((KeymapCommand.SET_KEYCODE, 0, a_row, a_col, KeyOp.KEYBOARD, 0, Keycode.D, 0))
+  connection.write(command[:3])
+  is_scanned = firmware.tick(firmware.scheduler.wait())
+  partial_reply = connection.read(8)
+  connection.write(command[3:])
+  reply = connection.read(8)
+  results.append(check('a command in two parts is served when complete, scanning in between', is_scanned
+                       and partial_reply == b'' and reply == command, f'{partial_reply.hex()}, {reply.hex()}'))
+  # A stray XOFF, which is also the ID of SET_BUFFER, then nothing for longer than the command timeout
+  connection.write(b'\x13')
+  start_ms = firmware.clock.now_ms
+  while firmware.clock.now_ms - start_ms <= main_loop.command_timeout:
+    firmware.tick(firmware.scheduler.wait())
+  connection.write(b's')
+  summary = connection.read(len(usb_cdc.data.written))
+  results.append(check('a stray XOFF is dropped after the command timeout', main_loop.num_dropped_commands == 1
+                       and summary.startswith(b'span'), repr(summary[:20])))
+  results.append(check('no read of the data channel waits for bytes', usb_cdc.data.num_short_reads == 0,
+                       f'{usb_cdc.data.num_short_reads} reads'))
+  connection.write(bytes((KeymapCommand.SET_KEYCODE, 0, a_row, a_col, KeyOp.KEYBOARD, 0, Keycode.B, 0)))
+  connection.read(8)
+
+  # Live: the key typed right after the change sends the new keycode, with no reboot
+  trace = [(0.1, a_row, a_col, True), (0.15, a_row, a_col, False)]
+  firmware, _ = run_with_faults(app, trace, [], 0.3)
+  states = decode_states(firmware.nkro_device.sent_reports)
+  results.append(check('the stored key map is used after a reboot', states == [{Keycode.B}, set()], str(states)))
+
+  def set_a_to_c(firmware):
+    FirmwareConnection(firmware).write(bytes((KeymapCommand.SET_KEYCODE, 0, a_row, a_col, KeyOp.KEYBOARD, 0,
+                                              Keycode.C, 0)))
+
+  trace = [(0.1, a_row, a_col, True), (0.15, a_row, a_col, False), (0.3, a_row, a_col, True),
+           (0.35, a_row, a_col, False)]
+  firmware, _ = run_with_faults(app, trace, [(0.2, set_a_to_c)], 0.5)
+  states = decode_states(firmware.nkro_device.sent_reports)
+  results.append(check('set keycode changes the key live', states == [{Keycode.B}, set(), {Keycode.C}, set()],
+                       str(states)))
+
+  # tools/push_keymap.py: the keymap.c of the Vial port is the key map of code.py
+  num_rows, num_cols, layout_positions = load_layout(DEFAULT_LAYOUT)
+  vial_layers = load_keymap_c(KEYMAP_C, layout_positions)
+  mismatches = [(layer, position, keycode) for layer, keycodes in enumerate(vial_layers)
+                for position, keycode in keycodes.items()
+                if to_record(keycode) != (layers[layer][2 * (position[0] * 8 + position[1])],
+                                          layers[layer][2 * (position[0] * 8 + position[1]) + 1])]
+  results.append(check('keymap.c of the Vial port converts to the layers of code.py', mismatches == [],
+                       str(mismatches[:5])))
+  firmware = Firmware(app, VirtualClock())
+  client = KeymapClient(FirmwareConnection(firmware))
+  num_writes = nvm.num_writes
+  num_changed = push(client, vial_layers, num_rows, num_cols)
+  results.append(check(f'push keymap.c: {num_changed} key changed back, in {nvm.num_writes - num_writes} write',
+                       num_changed == 1 and nvm.num_writes - num_writes == 1
+                       and list(firmware.key_map.layers[0]) == list(layers[0]), ''))
+  client.reset()
+  results.append(check('reset: back to the layers of code.py', not BinaryKeyMap(nvm, 8, 8).is_valid
+                       and [list(layer) for layer in firmware.key_map.layers] == [list(layer) for layer in layers], ''))
+  nvm.reset()
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
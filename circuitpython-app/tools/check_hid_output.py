@@ -0,0 +1,136 @@
+"""
+Host-side check of the report ordering of KeyboardOutput.
+
+  % python tools/check_hid_output.py
+
+The key changes of each case are sent through KeyboardOutput and NkroKeyboard to the usb_hid stand-in, and the
+number of reports, the keys each report newly presses and the final keyboard state are compared with the expected
+ones. Random ticks then check that no report presses a modifier together with another key. Last, a MacroAssignment
+types the corpus of tools/simulate.py through the main loop, where the host polls the HID endpoint every 8 ms. It
+exits with a non-zero status if any case fails.
+"""
+import os
+import random
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, CORPUS, check, run, with_key_assignments  # noqa: E402
+
+import usb_hid  # noqa: E402
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.hid_output import KeyboardOutput, is_modifier  # noqa: E402
+from octave_pcb.keymap import MacroAssignment  # noqa: E402
+from octave_pcb.nkro_keyboard import NkroKeyboard, create_nkro_device  # noqa: E402
+
+A = Keycode.A
+B = Keycode.B
+SHIFT = Keycode.LEFT_SHIFT
+CONTROL = Keycode.LEFT_CONTROL
+NUM_RANDOM_TICKS = 2000
+
+# (name, changes [(is_pressed, keycode)] of one tick, keys held before it, expected [keys newly pressed per report])
+CASES = (
+    ('a modifier and a key', [(True, SHIFT), (True, A)], (), [{SHIFT}, {A}]),
+    ('a key, then a modifier', [(True, A), (True, SHIFT)], (), [{A}, {SHIFT}]),
+    ('two modifiers and two keys', [(True, SHIFT), (True, CONTROL), (True, A), (True, B)], (),
+     [{SHIFT, CONTROL}, {A, B}]),
+    ('a key with a held modifier', [(True, A)], (SHIFT,), [{A}]),
+    ('a modifier alone', [(True, SHIFT)], (), [{SHIFT}]),
+    ('a tap', [(True, A), (False, A)], (), [{A}, set()]),
+    ('a modifier tap', [(True, SHIFT), (False, SHIFT)], (), [{SHIFT}, set()]),
+    ('a key, then its modifier released', [(True, A), (False, SHIFT)], (SHIFT,), [{A}, set()]),
+    ('a modifier released, then a key', [(False, SHIFT), (True, A)], (SHIFT,), [set(), {A}]),
+    ('a modifier swapped for another before a key', [(False, SHIFT), (True, CONTROL), (True, A)], (SHIFT,),
+     [set(), {CONTROL}, {A}]),
+    ('nothing', [], (A,), []),
+)
+
+
+def decode_state(report):
+  keycodes = {0xE0 + bit for bit in range(8) if report[0] & 1 << bit}
+  return keycodes | {keycode for keycode in range((len(report) - 1) * 8) if report[1 + keycode // 8] & 1 << keycode % 8}
+
+
+def send_tick(keyboard_output, device, changes, state):
+  """
+  Send the changes of one tick from `state` and return [keys newly pressed per report] and the state after the tick.
+  """
+  num_reports = len(device.sent_reports)
+  for is_pressed, keycode in changes:
+    (keyboard_output.press if is_pressed else keyboard_output.release)(keycode)
+  keyboard_output.flush()
+  pressed = []
+  for _, report in device.sent_reports[num_reports:]:
+    new_state = decode_state(report)
+    pressed.append(new_state - state)
+    state = new_state
+  return pressed, state
+
+
+def main():
+  results = []
+  device = create_nkro_device(usb_hid)
+  for name, changes, held_keys, expected in CASES:
+    keyboard_output = KeyboardOutput(NkroKeyboard(device))
+    if held_keys:
+      keyboard_output.keyboard.press(*held_keys)
+    device.sent_reports.clear()
+    pressed, state = send_tick(keyboard_output, device, changes, set(held_keys))
+    expected_state = set(held_keys)
+    for is_pressed, keycode in changes:
+      (expected_state.add if is_pressed else expected_state.discard)(keycode)
+    results.append(check(f'{name}: {len(pressed)} reports', pressed == expected and state == expected_state,
+                         f'{pressed} != {expected}, or {state} != {expected_state}'))
+
+  # Random ticks: the state follows the changes, and a report never presses a modifier together with another key
+  random.seed(1)
+  keycodes = (A, B, Keycode.C, SHIFT, CONTROL, Keycode.RIGHT_ALT)
+  keyboard_output = KeyboardOutput(NkroKeyboard(device))
+  state = set()
+  expected_state = set()
+  wrong_states = 0
+  mixed_reports = 0
+  num_reports = 0
+  for _ in range(NUM_RANDOM_TICKS):
+    changes = []
+    for _ in range(random.randint(0, 4)):
+      keycode = random.choice(keycodes)
+      is_pressed = keycode not in expected_state
+      (expected_state.add if is_pressed else expected_state.discard)(keycode)
+      changes.append((is_pressed, keycode))
+    pressed, state = send_tick(keyboard_output, device, changes, state)
+    num_reports += len(pressed)
+    wrong_states += state != expected_state
+    mixed_reports += sum(1 for keys in pressed if any(map(is_modifier, keys)) and not all(map(is_modifier, keys)))
+  results.append(check(f'{NUM_RANDOM_TICKS} random ticks, {num_reports} reports: the state follows the changes',
+                       wrong_states == 0, f'{wrong_states} wrong'))
+  results.append(check('no report presses a modifier with another key', mixed_reports == 0, f'{mixed_reports} do'))
+
+  # A macro typing the corpus, alone on the keyboard
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  macro_app = with_key_assignments(app, {(1, 1): MacroAssignment((CORPUS,))})
+  firmware, _ = run(macro_app, [(0.1, 1, 1, True), (0.15, 1, 1, False)])
+  layout = KeyboardLayoutUS(None)
+  chars = {frozenset(layout.keycodes(char)): char for char in set(CORPUS)}
+  typed = []
+  state = set()
+  for _, report in firmware.nkro_device.sent_reports:
+    new_state = decode_state(report)
+    if any(not is_modifier(keycode) for keycode in new_state - state):
+      typed.append(chars.get(frozenset(new_state), '?'))
+    state = new_state
+  typed = ''.join(typed)
+  results.append(check(f'a macro types {len(CORPUS)} chars in order', typed == CORPUS and state == set(),
+                       f'{typed!r}, {state} held'))
+  num_blocked_sends = firmware.nkro_device.num_blocked_sends
+  results.append(check(f'the macro sends one report per poll of the endpoint, every {usb_hid.ENDPOINT_INTERVAL} ms, '
+                       'without blocking', num_blocked_sends == 0, f'{num_blocked_sends} sends blocked'))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
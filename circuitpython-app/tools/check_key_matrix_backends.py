@@ -0,0 +1,96 @@
+"""
+Host-side check that the keypad backend gives the same key events as the digitalio one.
+
+  % python tools/check_key_matrix_backends.py
+
+Each trace of tools/simulate.py is scanned every 1 ms by KeyMatrix, on the digitalio stand-in, and by KeypadKeyMatrix,
+on the keypad stand-in, and the key events planned from the two scans are compared. A tap shorter than a scan, which
+only the keypad backend sees, is checked on its own. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import (APP_DIR, CORPUS, find_key_positions, held_modifiers_trace, key_repeat_trace,  # noqa: E402
+                      rolls_trace, typing_trace)
+
+import digitalio  # noqa: E402
+from octave_pcb.engine import KeyboardEngine  # noqa: E402
+from octave_pcb.key_event import KeyEvent  # noqa: E402
+from octave_pcb.key_matrix import COL_PINS, ROW_PINS, KeyMatrix  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap  # noqa: E402
+from octave_pcb.keypad_key_matrix import KeypadKeyMatrix  # noqa: E402
+
+
+def plan_events(key_matrix, key_map, trace):
+  """
+  Scan `key_matrix` every ms through `trace` and return the planned key events, [(ms, key index, event), ...].
+  """
+  digitalio.reset()
+  engine = KeyboardEngine(key_map, key_matrix.num_rows, key_matrix.num_cols)
+  trace = sorted(trace)
+  end_ms = round(trace[-1][0] * 1000) + 1000
+  pressed_keys = set()
+  next_event = 0
+  events = []
+  for current_time in range(end_ms):
+    while next_event < len(trace) and trace[next_event][0] * 1000 <= current_time:
+      _, row, col, is_pressed = trace[next_event]
+      (pressed_keys.add if is_pressed else pressed_keys.discard)((row, col))
+      next_event += 1
+    digitalio.closed_switches.clear()
+    for row, col in pressed_keys:
+      digitalio.closed_switches.add((ROW_PINS[row], COL_PINS[col]))
+    for n in range(engine.plan_events(current_time, key_matrix.scan_matrix_rows())):
+      events.append((current_time, engine._key_event_indices[n], engine._key_events[n]))
+  key_matrix.deinit()
+  return events
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  key_map = CompiledKeyMap(app['KEY_MAP_LAYERS'])
+  positions = find_key_positions(key_map, len(COL_PINS))
+  traces = (
+      ('typing', typing_trace(positions, CORPUS)),
+      ('rolls', rolls_trace(positions)),
+      ('held_modifiers', held_modifiers_trace(positions)),
+      ('key_repeat', key_repeat_trace(positions)),
+  )
+  num_failures = 0
+  for name, trace in traces:
+    digitalio_events = plan_events(KeyMatrix(), key_map, trace)
+    keypad_events = plan_events(KeypadKeyMatrix(), key_map, trace)
+    if keypad_events == digitalio_events:
+      print(f'ok    {name}: the same {len(keypad_events)} key events')
+    else:
+      mismatch = next(n for n in range(len(keypad_events) + 1)
+                      if n >= len(digitalio_events) or n >= len(keypad_events)
+                      or keypad_events[n] != digitalio_events[n])
+      print(f'FAIL  {name}: event {mismatch} differs, {keypad_events[mismatch:mismatch + 1]} != '
+            f'{digitalio_events[mismatch:mismatch + 1]}')
+      num_failures += 1
+
+  # A press and release queued between two scans are reported over two scans, not dropped
+  digitalio.reset()
+  key_matrix = KeypadKeyMatrix()
+  engine = KeyboardEngine(key_map, key_matrix.num_rows, key_matrix.num_cols)
+  key_matrix._keys.events.put(10, True, 0)
+  key_matrix._keys.events.put(10, False, 0)
+  events = []
+  for current_time in range(3):
+    for n in range(engine.plan_events(current_time, key_matrix.scan_matrix_rows())):
+      events.append((current_time, engine._key_event_indices[n], engine._key_events[n]))
+  expected_events = [(0, 10, KeyEvent.PRESS), (1, 10, KeyEvent.RELEASE)]
+  if events == expected_events:
+    print('ok    a tap shorter than a scan: pressed, then released at the next scan')
+  else:
+    print(f'FAIL  a tap shorter than a scan: {events} != {expected_events}')
+    num_failures += 1
+  sys.exit(1 if num_failures > 0 else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,201 @@
+"""
+Host-side check that the compiled key map sends the same HID actions as the KEY_MAP_LAYERS namedtuples.
+
+  % python tools/check_keymap.py
+
+Every key on every combination of layers is tapped and held through KeyboardEngine, which dispatches from the tables
+of CompiledKeyMap.resolve(), and the actions sent to the keyboard, mouse, consumer control and layers are compared with
+the ones of the press, long press and release of the namedtuple, interpreted as the main loop did before the key map
+was compiled. Besides KEY_MAP_LAYERS of code.py, a key map with every other kind of key is checked. It exits with a
+non-zero status if any key differs.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, with_key_assignments  # noqa: E402
+
+from adafruit_hid.consumer_control_code import ConsumerControlCode  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from adafruit_hid.mouse import Mouse  # noqa: E402
+from octave_pcb.engine import KeyboardEngine  # noqa: E402
+from octave_pcb.key_event import LONG_PRESS_DELAY  # noqa: E402
+from octave_pcb.keymap import (TRANSPARENT, CodeType, CompiledKeyMap, ComplexModifierAssignment,  # noqa: E402
+                               KeyAssignment, KeycodeLayer, LambdaAssignment, TransparentAssignment, is_code_mo)
+from octave_pcb.mouse_keys import MouseKeysCurve, MouseKeysEngine  # noqa: E402
+from octave_pcb.tap_hold import TapHoldEngine  # noqa: E402
+
+NUM_ROWS = 8
+NUM_COLS = 8
+
+
+class Recorder:
+  """
+  Stands in for KeyboardOutput, Mouse and ConsumerControl, and records what each is asked to send in `actions`.
+  """
+
+  def __init__(self, actions):
+    self.actions = actions
+
+  def press(self, code):
+    self.actions.append(('press', code))
+
+  def release(self, code=None):
+    self.actions.append(('release', code))
+
+  def tap(self, keycode):
+    self.press(keycode)
+    self.release(keycode)
+
+  def flush(self):
+    return False
+
+  def move(self, x=0, y=0, wheel=0):
+    self.actions.append(('move', x, y, wheel))
+
+
+def layer_of(code):
+  return code & 0xFF
+
+
+def interpret(key_assignment, is_held, base_layer_mask):
+  """
+  Return the actions of tapping `key_assignment`, or holding it past the long-press delay and the tapping term, as the
+  main loop did on the namedtuples. A layer is switched on unless it is already active, and off on release.
+  """
+  keyboard = []
+  mouse = []
+  consumer_control = []
+  layers = []
+  if key_assignment is None:
+    pass
+  elif isinstance(key_assignment, ComplexModifierAssignment):
+    if not is_held:
+      if not is_code_mo(key_assignment.code_for_standalone):
+        keyboard += [('press', key_assignment.code_for_standalone), ('release', key_assignment.code_for_standalone)]
+    elif is_code_mo(key_assignment.modifier):
+      layer = layer_of(key_assignment.modifier)
+      layers += ([] if base_layer_mask & 1 << layer else [('on', layer)]) + [('off', layer)]
+    else:
+      keyboard += [('press', key_assignment.modifier), ('release', key_assignment.modifier)]
+  elif isinstance(key_assignment, KeyAssignment):
+    code = key_assignment.code
+    if key_assignment.type == CodeType.KEYBOARD:
+      if is_code_mo(code):
+        layer = layer_of(code)
+        layers += ([] if base_layer_mask & 1 << layer else [('on', layer)]) + [('off', layer)]
+      else:
+        # A long press repeats the key
+        keyboard += [('press', code)] * (2 if is_held else 1) + [('release', code)]
+    elif key_assignment.type == CodeType.MOUSE_MOVE:
+      move = ('move', code.get('x', 0), code.get('y', 0), code.get('wheel', 0))
+      mouse += [move] * (2 if is_held else 1)
+    elif key_assignment.type == CodeType.MOUSE_BUTTON:
+      mouse += [('press', code), ('release', code)]
+    elif key_assignment.type == CodeType.CONSUMER_CONTROL:
+      consumer_control += [('press', code), ('release', None)]
+  elif isinstance(key_assignment, LambdaAssignment):
+    if key_assignment.on_press is not None:
+      key_assignment.on_press()
+    if key_assignment.on_release is not None:
+      key_assignment.on_release()
+  return keyboard, mouse, consumer_control, layers
+
+
+def key_assignment_on(key_map_layers, layer_mask, i):
+  # The key of the highest active layer, falling through TRANSPARENT
+  for layer in range(len(key_map_layers) - 1, -1, -1):
+    if layer_mask & 1 << layer and not isinstance(key_map_layers[layer][i], TransparentAssignment):
+      return key_map_layers[layer][i]
+  return None
+
+
+def dispatch(engine, i, is_held, hold_time):
+  """
+  Tap or hold key `i` through `engine` and return the layers switched on and off, as interpret() does.
+  """
+  row_states = bytearray(NUM_ROWS)
+  layers = []
+  layer_mask = engine.layer_mask
+  row, col = divmod(i, NUM_COLS)
+  times = (0, hold_time, hold_time + 1) if is_held else (0, 1)
+  for n, current_time in enumerate(times):
+    row_states[row] = 1 << col if n < len(times) - 1 else 0
+    engine.plan_events(current_time, row_states)
+    engine.dispatch_events(current_time)
+    for layer in range(16):
+      if (engine.layer_mask ^ layer_mask) & 1 << layer:
+        layers.append(('on' if engine.layer_mask & 1 << layer else 'off', layer))
+    layer_mask = engine.layer_mask
+  return layers
+
+
+def check_key_map(name, app, key_map_layers, lambda_actions):
+  """
+  Compare every key on every layer mask with layer 0 active, print the result and return the number of mismatches.
+  """
+  key_map = CompiledKeyMap(key_map_layers)
+  tapping_term = app['TAPPING_TERM']
+  # Repeats keep the move of the key, as the long press did
+  engine = KeyboardEngine(key_map, NUM_ROWS, NUM_COLS, TapHoldEngine(tapping_term, app['TAP_HOLD_MODE']),
+                          mouse_keys=MouseKeysEngine(curve=MouseKeysCurve.CONSTANT, wheel_interval=LONG_PRESS_DELAY))
+  keyboard = []
+  mouse = []
+  consumer_control = []
+  engine.attach(Recorder(keyboard), Recorder(mouse), Recorder(consumer_control))
+  hold_time = max(LONG_PRESS_DELAY, tapping_term)
+  mismatches = []
+  num_cases = 0
+  for layer_mask in range(1, 1 << len(key_map_layers), 2):
+    for i in range(NUM_ROWS * NUM_COLS):
+      key_assignment = key_assignment_on(key_map_layers, layer_mask, i)
+      for is_held in (False, True):
+        engine.layer_mask = layer_mask
+        engine.reload_key_map()
+        for actions in (keyboard, mouse, consumer_control, lambda_actions):
+          actions.clear()
+        layers = dispatch(engine, i, is_held, hold_time)
+        actual = (keyboard[:], mouse[:], consumer_control[:], layers, lambda_actions[:])
+        lambda_actions.clear()
+        expected = interpret(key_assignment, is_held, layer_mask) + (lambda_actions[:],)
+        num_cases += 1
+        if actual != expected:
+          mismatches.append((layer_mask, divmod(i, NUM_COLS), 'hold' if is_held else 'tap', actual, expected))
+  if len(mismatches) == 0:
+    print(f'ok    {name}: {num_cases} taps and holds on {len(key_map_layers)} layers send the same actions')
+  else:
+    layer_mask, key, how, actual, expected = mismatches[0]
+    print(f'FAIL  {name}: {len(mismatches)} of {num_cases} differ, the first is the {how} of {key} on layer mask '
+          f'{layer_mask:#b}: {actual} != {expected}')
+  return len(mismatches)
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  lambda_actions = []
+  num_mismatches = check_key_map('KEY_MAP_LAYERS', app, app['KEY_MAP_LAYERS'], lambda_actions)
+
+  # Every other kind of key, on layers 0 and 1
+  other_keys = with_key_assignments(app, {
+      (0, 1): KeyAssignment(CodeType.MOUSE_MOVE, {'x': 3, 'y': -2}),
+      (1, 1): KeyAssignment(CodeType.MOUSE_MOVE, {'wheel': -1}),
+      (1, 2): KeyAssignment(CodeType.MOUSE_BUTTON, Mouse.LEFT_BUTTON),
+      (0, 2): KeyAssignment(CodeType.CONSUMER_CONTROL, ConsumerControlCode.VOLUME_INCREMENT),
+      (0, 3): LambdaAssignment(lambda: lambda_actions.append('on_press'), lambda: lambda_actions.append('on_release')),
+      (0, 4): LambdaAssignment(None, lambda: lambda_actions.append('on_release')),
+      (0, 5): ComplexModifierAssignment(KeycodeLayer.MO2, Keycode.ESCAPE),
+      (0, 6): ComplexModifierAssignment(Keycode.LEFT_ALT, KeycodeLayer.MO1),
+      (0, 7): KeyAssignment(CodeType.KEYBOARD, KeycodeLayer.MO1),
+  })['KEY_MAP_LAYERS']
+  other_keys[1][1 * NUM_COLS + 2] = KeyAssignment(CodeType.CONSUMER_CONTROL, ConsumerControlCode.MUTE)
+  other_keys[1][0] = KeyAssignment(CodeType.MOUSE_BUTTON, Mouse.RIGHT_BUTTON)
+  # Falls through to layer 1 while it is active
+  other_keys[2][0] = TRANSPARENT
+  num_mismatches += check_key_map('every kind of key', app, other_keys, lambda_actions)
+  sys.exit(1 if num_mismatches > 0 else 0)
+
+
+if __name__ == '__main__':
+  main()
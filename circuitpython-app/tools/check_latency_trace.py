@@ -0,0 +1,146 @@
+"""
+Host-side check of the latency trace of the main loop, and of its summary as parsed by tools/latency_client.py.
+
+  % python tools/check_latency_trace.py
+
+The pauses trace of tools/simulate.py goes idle between its words, and the scan intervals of the summary must only
+count the scans of the scan tick, not the time spent idle. A gap longer than the 16-bit ring holds must saturate,
+not wrap. The marks and end_tick() of the default trace, stamped in milliseconds, must not allocate, which
+time.monotonic_ns() behind ticks_us() does on CircuitPython. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+from itertools import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import simulate  # noqa: E402
+from latency_client import parse_summary  # noqa: E402
+from simulate import APP_DIR, check, find_key_positions, pauses_trace, run  # noqa: E402
+
+import usb_cdc  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap  # noqa: E402
+from octave_pcb.latency_trace import LatencyStage, LatencyTrace  # noqa: E402
+from octave_pcb.ticks import ticks_us  # noqa: E402
+
+
+class StepClock:
+  """
+  Ticks in milliseconds and in microseconds, moved by `advance()`.
+  """
+
+  def __init__(self):
+    self.now_us = 0
+
+  def advance(self, us):
+    self.now_us += us
+
+  def ticks_ms(self):
+    return self.now_us // 1000
+
+  def ticks_us(self):
+    return self.now_us
+
+
+def trace_scans(clock, latency_trace, gaps_ms):
+  # A 200 us scan after each gap
+  for gap_ms in gaps_ms:
+    clock.advance(gap_ms * 1000)
+    latency_trace.start_scan()
+    clock.advance(200)
+    latency_trace.mark(LatencyStage.SCAN_END)
+    latency_trace.end_tick()
+    clock.advance(-200)
+
+
+def trace_ticks(latency_trace, num_ticks):
+  # Ticks with all the stages, as with a key event
+  for _ in repeat(None, num_ticks):
+    latency_trace.start_scan()
+    for stage in (LatencyStage.SCAN_END, LatencyStage.EVENT_DETECTED, LatencyStage.DISPATCH, LatencyStage.REPORT_SENT):
+      latency_trace.mark(stage)
+    latency_trace.end_tick()
+
+
+def measure_allocations(latency_trace, num_ticks):
+  """
+  Return the calls to time.monotonic_ns(), the bytes kept and the peak bytes allocated over `num_ticks` ticks.
+  """
+  monotonic_ns = time.monotonic_ns
+  num_calls = [0]
+
+  def counting_monotonic_ns():
+    num_calls[0] += 1
+    return monotonic_ns()
+
+  time.monotonic_ns = counting_monotonic_ns
+  try:
+    tracemalloc.start()
+    trace_ticks(latency_trace, num_ticks)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+  finally:
+    time.monotonic_ns = monotonic_ns
+  return num_calls[0], retained, peak
+
+
+def main():
+  results = []
+
+  # The intervals of a scan after a skipped one, and after a gap past the 16-bit ring
+  clock = StepClock()
+  latency_trace = LatencyTrace(num_scans=8, ticks_ms=clock.ticks_ms, ticks_us=clock.ticks_us)
+  trace_scans(clock, latency_trace, (0, 1, 1))
+  latency_trace.skip_scan_interval()
+  trace_scans(clock, latency_trace, (2000, 1))
+  summary = {row[0]: row[1:] for row in latency_trace.summarize()}
+  results.append(check('the interval to a scan after skip_scan_interval() is left out',
+                       summary['scan_interval'] == ('ms', 1, 1, 1, 3), str(summary['scan_interval'])))
+  results.append(check('scan durations in microseconds', summary['scan'] == ('us', 200, 200, 200, 5),
+                       str(summary['scan'])))
+  trace_scans(clock, latency_trace, (100000,))
+  maximum = latency_trace.summarize()[-1][4]
+  results.append(check(f'a gap of 100 s saturates at {maximum} ms', maximum == 0xFFFE, ''))
+
+  # The pauses trace through the main loop, with a ring holding all of its scans
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  positions = find_key_positions(CompiledKeyMap(app['KEY_MAP_LAYERS']), 8)
+  simulate_latency_trace = simulate.LatencyTrace
+  simulate.LatencyTrace = lambda **kwargs: simulate_latency_trace(num_scans=1 << 14, **kwargs)
+  try:
+    firmware, result = run(app, pauses_trace(positions))
+  finally:
+    simulate.LatencyTrace = simulate_latency_trace
+  num_wakes = firmware.idle_monitor.num_wakes
+  usb_cdc.data.feed(b's')
+  firmware.tick(firmware.scheduler.wait())
+  summary = parse_summary(usb_cdc.data.written.decode().splitlines())
+  scan_interval = summary['scan_interval']
+  results.append(check(f'{num_wakes} wakes from idle: scan intervals of {scan_interval["max"]} ms at most',
+                       num_wakes > 0 and scan_interval['max'] == app['SCAN_KEY_MATRIX_INTERVAL']
+                       and scan_interval['count'] == result.num_scans - 1 - num_wakes, str(scan_interval)))
+  units = {name: values['unit'] for name, values in summary.items()}
+  results.append(check('the summary served gives the unit of each span, ms by default', set(units.values()) == {'ms'}
+                       and not app['LATENCY_TRACE_IN_US'], str(units)))
+
+  # On a clock standing still at 0 and with rings of 8, every int is one CPython keeps, as CircuitPython keeps the
+  # small ints of ticks_ms in the object itself. The interpreter takes the same few bytes for one tick.
+  latency_trace = LatencyTrace(num_scans=8, num_events=8, ticks_ms=lambda: 0)
+  trace_ticks(latency_trace, 1)
+  _, _, single_peak = measure_allocations(latency_trace, 1)
+  num_calls, retained, peak = measure_allocations(latency_trace, 1000)
+  results.append(check('1000 ticks of marks and end_tick() allocate nothing, with no time.monotonic_ns()',
+                       num_calls == 0 and retained == 0 and peak == single_peak,
+                       f'{num_calls} calls, {retained} B kept, {peak} B at peak, {single_peak} B for one'))
+  num_calls, _, _ = measure_allocations(LatencyTrace(num_scans=8, num_events=8, ticks_ms=lambda: 0, ticks_us=ticks_us),
+                                        10)
+  results.append(check(f'stamped in us, 10 ticks call time.monotonic_ns() {num_calls} times', num_calls == 50, ''))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
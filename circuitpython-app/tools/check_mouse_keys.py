@@ -0,0 +1,98 @@
+"""
+Host-side check of the mouse keys on held-key traces.
+
+  % python tools/check_mouse_keys.py
+
+Each case holds mouse move keys through tools/simulate.py and compares the pointer trajectory and the report rate
+with the ones expected from the speed table. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, check, run, with_key_assignments  # noqa: E402
+
+from octave_pcb.keymap import CodeType, KeyAssignment  # noqa: E402
+from octave_pcb.mouse_keys import SPEED_ONE, MouseKeysCurve, make_speed_table  # noqa: E402
+
+RIGHT = (0, 1)
+DOWN = (1, 1)
+LEFT = (1, 2)
+WHEEL = (0, 0)
+MOUSE_KEYS = {
+    RIGHT: KeyAssignment(CodeType.MOUSE_MOVE, {'x': 3}),
+    DOWN: KeyAssignment(CodeType.MOUSE_MOVE, {'y': 3}),
+    LEFT: KeyAssignment(CodeType.MOUSE_MOVE, {'x': -3}),
+    WHEEL: KeyAssignment(CodeType.MOUSE_MOVE, {'wheel': -1}),
+}
+
+
+def decode_moves(reports):
+  moves = []
+  for _, data in reports:
+    moves.append(tuple(value - 256 if value >= 128 else value for value in data[1:4]))
+  return moves
+
+
+def expected_distance(app, move, num_reports):
+  # The sum of the moves of the first reports, following the speed table with the remainders carried
+  table = make_speed_table(app['MOUSE_KEYS_CURVE'], app['MOUSE_KEYS_MAX_SPEED'], app['MOUSE_KEYS_TIME_TO_MAX'],
+                           app['MOUSE_KEYS_INTERVAL'])
+  total = sum(move * table[min(step, len(table) - 1)] for step in range(num_reports))
+  return total // SPEED_ONE
+
+
+def main():
+  app = with_key_assignments(runpy.run_path(os.path.join(APP_DIR, 'code.py')), MOUSE_KEYS)
+  interval = app['MOUSE_KEYS_INTERVAL']
+  results = []
+
+  for curve_name, curve in (('constant', MouseKeysCurve.CONSTANT), ('linear', MouseKeysCurve.LINEAR),
+                            ('quadratic', MouseKeysCurve.QUADRATIC)):
+    app['MOUSE_KEYS_CURVE'] = curve
+    hold = 1.5
+    firmware, result = run(app, [(0.1, *RIGHT, True), (0.1 + hold, *RIGHT, False)])
+    moves = decode_moves(firmware.mouse_device.sent_reports)
+    times = result.mouse_report_times
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    num_expected = round(hold * 1000 / interval)
+    results.append(check(f'{curve_name}: {len(moves)} reports, one per {interval} ms',
+                         abs(len(moves) - num_expected) <= 1 and set(intervals) == {interval},
+                         f'{len(moves)} reports, intervals {sorted(set(intervals))}'))
+    distance = sum(x for x, _, _ in moves)
+    results.append(check(f'{curve_name}: moves {distance} right', distance == expected_distance(app, 3, len(moves)),
+                         f'expected {expected_distance(app, 3, len(moves))}'))
+    results.append(check(f'{curve_name}: never slows down while held',
+                         all(a <= b + 1 for (a, _, _), (b, _, _) in zip(moves, moves[1:])), str(moves[:20])))
+  app['MOUSE_KEYS_CURVE'] = MouseKeysCurve.QUADRATIC
+
+  firmware, _ = run(app, [(0.1, *RIGHT, True), (0.1, *DOWN, True), (0.6, *RIGHT, False), (0.6, *DOWN, False)])
+  moves = decode_moves(firmware.mouse_device.sent_reports)
+  results.append(check('diagonal: x and y in the same reports', all(x == y and x > 0 for x, y, _ in moves),
+                       str(moves[:10])))
+
+  firmware, _ = run(app, [(0.1, *RIGHT, True), (0.3, *LEFT, True), (0.5, *LEFT, False), (0.7, *RIGHT, False)])
+  moves = decode_moves(firmware.mouse_device.sent_reports)
+  num_stopped = sum(1 for x, y, wheel in moves if x == 0 and y == 0 and wheel == 0)
+  results.append(check('opposite keys cancel without empty reports', num_stopped == 0, f'{num_stopped} empty'))
+
+  firmware, result = run(app, [(0.1, *WHEEL, True), (0.1, *DOWN, True), (1.1, *WHEEL, False), (1.1, *DOWN, False)])
+  moves = decode_moves(firmware.mouse_device.sent_reports)
+  num_wheel = sum(1 for _, _, wheel in moves if wheel != 0)
+  results.append(check(f'wheel: {num_wheel} steps in 1 s with the pointer moving',
+                       abs(num_wheel - 1000 // app['MOUSE_KEYS_WHEEL_INTERVAL']) <= 1
+                       and all(wheel in (0, -1) for _, _, wheel in moves), str(moves[:10])))
+  results.append(check('wheel: combined into the pointer reports',
+                       len(moves) <= round(1000 / interval) + 1, f'{len(moves)} reports'))
+
+  firmware, result = run(app, [(0.1, *RIGHT, True), (0.3, *RIGHT, False)])
+  last_time = result.mouse_report_times[-1] - result.mouse_report_times[0]
+  results.append(check('stops at release', last_time < 200 + interval, f'last report at {last_time} ms'))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,267 @@
+"""
+Host-side check of the NKRO keyboard: its report descriptor, and the bitmap NkroKeyboard sends for every keycode of
+the key map.
+
+  % python tools/check_nkro_keyboard.py
+
+The descriptor is parsed into its report fields, and the bit of each keycode is taken from the fields, not from
+NkroKeyboard. Every keycode resolved by the key map of code.py is then pressed and released through NkroKeyboard, which
+must set and clear that bit alone, and must not allocate. Last, the main loop objects are built on the boot keyboard
+alone, as boot.py enables it for a BIOS. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, MOUSE_KEYS, check, find_key_positions, with_key_assignments  # noqa: E402
+
+import usb_hid  # noqa: E402
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.engine import KeyboardEngine  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap, KeyOp  # noqa: E402
+from octave_pcb.nkro_keyboard import (NKRO_NUM_KEYCODES, NKRO_REPORT_DESCRIPTOR, NKRO_REPORT_ID,  # noqa: E402
+                                      NKRO_REPORT_LENGTH, NkroKeyboard)
+
+INPUT = 0x80
+OUTPUT = 0x90
+
+
+class Field:
+  """
+  An Input or Output main item of a report descriptor, with the global and local items in effect.
+  """
+
+  def __init__(self, kind, flags, report_id, usage_page, usage_minimum, usage_maximum, logical_minimum,
+               logical_maximum, report_size, report_count):
+    self.kind = kind
+    self.flags = flags
+    self.report_id = report_id
+    self.usage_page = usage_page
+    self.usage_minimum = usage_minimum
+    self.usage_maximum = usage_maximum
+    self.logical_minimum = logical_minimum
+    self.logical_maximum = logical_maximum
+    self.report_size = report_size
+    self.report_count = report_count
+
+
+def parse_report_descriptor(descriptor):
+  """
+  Return the fields of `descriptor` in order, the (usage page, usage) of its first collection, and the collection
+  depth left at its end.
+  """
+  fields = []
+  state = {'usage_page': 0, 'report_id': 0, 'logical_minimum': 0, 'logical_maximum': 0, 'report_size': 0,
+           'report_count': 0}
+  usages = []
+  usage_range = [None, None]
+  application = None
+  depth = 0
+  position = 0
+  while position < len(descriptor):
+    prefix = descriptor[position]
+    size = (0, 1, 2, 4)[prefix & 0x03]
+    data = int.from_bytes(descriptor[position + 1:position + 1 + size], 'little')
+    position += 1 + size
+    tag = prefix & 0xFC
+    if tag == 0x04:
+      state['usage_page'] = data
+    elif tag == 0x14:
+      state['logical_minimum'] = data
+    elif tag == 0x24:
+      state['logical_maximum'] = data
+    elif tag == 0x74:
+      state['report_size'] = data
+    elif tag == 0x84:
+      state['report_id'] = data
+    elif tag == 0x94:
+      state['report_count'] = data
+    elif tag == 0x08:
+      usages.append(data)
+    elif tag == 0x18:
+      usage_range[0] = data
+    elif tag == 0x28:
+      usage_range[1] = data
+    elif tag == 0xA0:
+      if application is None:
+        application = (state['usage_page'], usages[0] if usages else None)
+      depth += 1
+    elif tag == 0xC0:
+      depth -= 1
+    elif tag in (INPUT, OUTPUT):
+      fields.append(Field(tag, data, state['report_id'], state['usage_page'], usage_range[0], usage_range[1],
+                          state['logical_minimum'], state['logical_maximum'], state['report_size'],
+                          state['report_count']))
+    else:
+      raise ValueError('Unknown item {:#04x} at {}'.format(prefix, position - 1 - size))
+    if tag in (0xA0, 0xC0, INPUT, OUTPUT):
+      # Local items only apply to the next main item
+      usages = []
+      usage_range = [None, None]
+  return fields, application, depth
+
+
+def keycode_bits(fields):
+  """
+  Return {keycode: bit offset in the input report, after its report ID} of the keyboard usages of `fields`.
+  """
+  bits = {}
+  offset = 0
+  for field in fields:
+    if field.kind != INPUT:
+      continue
+    if field.usage_page == 0x07 and field.usage_minimum is not None:
+      for n in range(field.report_count):
+        usage = field.usage_minimum + n
+        if usage <= field.usage_maximum:
+          bits[usage] = offset + n * field.report_size
+    offset += field.report_size * field.report_count
+  return bits
+
+
+def resolved_keycodes(key_map):
+  """
+  Return the keycodes sent by the keys of every layer mask, and by the combos and macros.
+  """
+  keycodes = set()
+  ops_args = []
+  for layer_mask in range(1, 1 << len(key_map.layers), 2):
+    table = key_map.resolve(layer_mask)
+    ops_args += [(table[i], table[i + 1]) for i in range(0, len(table), 2)]
+  ops_args += [(op, arg) for _, op, arg in key_map.combos]
+  for op, arg in ops_args:
+    if op == KeyOp.KEYBOARD:
+      keycodes.add(arg)
+    elif op == KeyOp.COMPLEX_MODIFIER:
+      keycodes.add(arg >> 8)
+    if op in (KeyOp.COMPLEX_MODIFIER, KeyOp.COMPLEX_LAYER) and arg & 0xFF:
+      keycodes.add(arg & 0xFF)
+  for stream in key_map.macros:
+    position = 0
+    while position < len(stream):
+      keycodes.update(stream[position + 1:position + 1 + stream[position]])
+      position += 1 + stream[position]
+  return sorted(keycodes)
+
+
+class LastReportDevice:
+  """
+  Keeps the last report sent, without copying it, so that sending allocates nothing.
+  """
+
+  def __init__(self):
+    self.report = None
+    self.report_id = None
+
+  def send_report(self, report, report_id=None):
+    self.report = report
+    self.report_id = report_id
+
+  def get_last_received_report(self, report_id=None):
+    return None
+
+
+def measure_allocations(keyboard, keycodes):
+  """
+  Return the bytes kept and the peak bytes allocated while pressing and releasing each of `keycodes`.
+  """
+  tracemalloc.start()
+  for keycode in keycodes:
+    keyboard.press(keycode)
+    keyboard.release(keycode)
+  allocations = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return allocations
+
+
+def set_bits(report):
+  return [n for n in range(len(report) * 8) if report[n // 8] & 1 << n % 8]
+
+
+def main():
+  results = []
+  fields, application, depth = parse_report_descriptor(NKRO_REPORT_DESCRIPTOR)
+  inputs = [field for field in fields if field.kind == INPUT]
+  outputs = [field for field in fields if field.kind == OUTPUT]
+  results.append(check('a keyboard application collection, closed at the end', application == (0x01, 0x06)
+                       and depth == 0, f'{application}, depth {depth}'))
+  report_ids = sorted(set(field.report_id for field in fields))
+  results.append(check(f'every field has report ID {NKRO_REPORT_ID}', report_ids == [NKRO_REPORT_ID], str(report_ids)))
+  input_bits = sum(field.report_size * field.report_count for field in inputs)
+  results.append(check(f'the input report is {NKRO_REPORT_LENGTH} bytes after its ID',
+                       input_bits == NKRO_REPORT_LENGTH * 8, f'{input_bits} bits'))
+  output_bits = sum(field.report_size * field.report_count for field in outputs)
+  results.append(check('the LED output report is 1 byte after its ID', output_bits == 8, f'{output_bits} bits'))
+  ranges = [(field.usage_page, field.usage_minimum, field.usage_maximum, field.report_size, field.report_count)
+            for field in inputs]
+  expected_ranges = [(0x07, 0xE0, 0xE7, 1, 8), (0x07, 0x00, NKRO_NUM_KEYCODES - 1, 1, NKRO_NUM_KEYCODES)]
+  results.append(check('inputs: one bit per modifier, then one bit per keycode 0x00..{:#04x}'.format(
+      NKRO_NUM_KEYCODES - 1), ranges == expected_ranges, str(ranges)))
+  results.append(check('inputs are variable 0..1 values', all(field.flags & 0x03 == 0x02
+                       and (field.logical_minimum, field.logical_maximum) == (0, 1) for field in inputs), ''))
+  leds = [(field.usage_page, field.usage_minimum, field.usage_maximum) for field in outputs if not field.flags & 0x01]
+  results.append(check('outputs: the LEDs Num Lock..Kana', leds == [(0x08, 0x01, 0x05)], str(leds)))
+
+  # Every keycode of the key map, on the bit the descriptor gives it
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  key_map = CompiledKeyMap(app['KEY_MAP_LAYERS'], combos=app['COMBOS'], keyboard_layout=KeyboardLayoutUS(None))
+  keycodes = resolved_keycodes(key_map)
+  bits = keycode_bits(fields)
+  missing = [keycode for keycode in keycodes if keycode not in bits]
+  results.append(check(f'the descriptor covers the {len(keycodes)} keycodes of the key map', missing == [],
+                       str(missing)))
+  device = LastReportDevice()
+  keyboard = NkroKeyboard(device)
+  wrong_keycodes = []
+  for keycode in keycodes:
+    keyboard.press(keycode)
+    pressed = set_bits(device.report)
+    keyboard.release(keycode)
+    if pressed != [bits.get(keycode)] or set_bits(device.report) != [] or device.report_id != NKRO_REPORT_ID:
+      wrong_keycodes.append(keycode)
+  results.append(check('each keycode sets its own bit alone, and clears it on release', wrong_keycodes == [],
+                       str(wrong_keycodes[:5])))
+  keyboard.press(*keycodes)
+  rolled = set_bits(device.report)
+  keyboard.release_all()
+  results.append(check(f'all {len(keycodes)} keycodes at once', rolled == sorted(bits[keycode] for keycode in keycodes)
+                       and len(device.report) == NKRO_REPORT_LENGTH, str(rolled)))
+
+  # The interpreter takes the same few bytes for a loop of one keycode, which are not per report
+  single_peak = measure_allocations(keyboard, keycodes[:1])
+  retained, peak = measure_allocations(keyboard, keycodes)
+  results.append(check(f'{2 * len(keycodes)} presses and releases allocate nothing', retained == 0
+                       and peak == single_peak[1], f'{retained} B kept, {peak} B at peak, {single_peak[1]} B for one'))
+
+  # The boot keyboard alone, as boot.py enables it for a BIOS: the 6-key Keyboard is used, and the mouse keys of the
+  # key map send nothing instead of failing without a mouse device
+  usb_hid.reset()
+  usb_hid.enable((usb_hid.Device.KEYBOARD,), boot_device=1)
+  mouse_app = with_key_assignments(app, MOUSE_KEYS)
+  engine = KeyboardEngine(CompiledKeyMap(mouse_app['KEY_MAP_LAYERS']), 8, 8)
+  mouse_app['attach_hid_objects'](engine, usb_hid.devices)
+  (mouse_row, mouse_col), = [key for key, key_assignment in MOUSE_KEYS.items() if 'x' in key_assignment.code]
+  a_row, a_col = find_key_positions(engine.key_map, 8)[Keycode.A]
+  row_states = bytearray(8)
+  row_states[mouse_row] |= 1 << mouse_col
+  row_states[a_row] |= 1 << a_col
+  usb_hid.Device.KEYBOARD.sent_reports.clear()
+  for current_time in range(2):
+    engine.plan_events(current_time, row_states)
+    engine.dispatch_events(current_time)
+    engine.keyboard_output.flush()
+    row_states = bytearray(8)
+  reports = usb_hid.Device.KEYBOARD.sent_reports
+  expected_reports = [(None, bytes((0, 0, Keycode.A, 0, 0, 0, 0, 0))), (None, bytes(8))]
+  results.append(check('boot keyboard alone: 6-key reports, and no mouse', reports == expected_reports
+                       and engine.mouse is None, str(reports)))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,185 @@
+"""
+Host-side check of the PIO key matrix: its program runs on the rp2pio stand-in, a PIO instruction simulator, against
+the switches of the digitalio stand-in.
+
+  % pip install adafruit-circuitpython-pioasm
+  % python tools/check_pio_key_matrix.py
+
+It prints the time of one scan and exits with a non-zero status if any case fails. Last, the state machine runs freely
+on a virtual clock between scan ticks, as on the RP2040, to compare the program with one that scans without a trigger
+and waits on its full RX FIFO.
+"""
+import os
+import random
+import runpy
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, check, find_key_positions, run, typing_trace  # noqa: E402
+
+import adafruit_pioasm  # noqa: E402
+import digitalio  # noqa: E402
+import rp2pio  # noqa: E402
+from rp2pio import pin_number  # noqa: E402
+from octave_pcb.key_matrix import COL_PINS, ROW_PINS  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap  # noqa: E402
+from octave_pcb.pio_key_matrix import (FIRST_COL_PIN, FIRST_ROW_PIN, PIO_FREQUENCY, PROGRAM,  # noqa: E402
+                                       SETTLE_CYCLES, PioKeyMatrix, decode_snapshot, row_select_words)
+
+NUM_RANDOM_SCANS = 200
+NUM_FREE_RUNNING_TICKS = 200
+
+# The program before scans were triggered: it scans over and over, and waits while its RX FIFO is full
+FREE_RUNNING_PROGRAM = """
+.program key_matrix
+    pull block
+    mov x, osr
+    pull block
+    mov y, osr
+.wrap_target
+    mov osr, x
+row:
+    out pindirs, 8 [{settle_cycles}]
+    mov isr, ::pins
+    mov isr, ~isr
+    in null, 24
+    push block
+    jmp !osre row
+    mov isr, x
+    mov x, y
+    mov y, isr
+.wrap
+"""
+
+
+class TickClock:
+  def __init__(self):
+    self.now_ms = 0
+
+  def ticks_ms(self):
+    return self.now_ms
+
+
+class FreeRunningKeyMatrix:
+  """
+  The scans of FREE_RUNNING_PROGRAM, read out of the RX FIFO as PioKeyMatrix did.
+  """
+
+  def __init__(self):
+    program = adafruit_pioasm.Program(FREE_RUNNING_PROGRAM.format(settle_cycles=SETTLE_CYCLES))
+    num_rows = len(ROW_PINS)
+    self._state_machine = rp2pio.StateMachine(
+        program.assembled, PIO_FREQUENCY,
+        first_out_pin=FIRST_ROW_PIN, out_pin_count=num_rows, initial_out_pin_state=0, initial_out_pin_direction=0,
+        first_in_pin=FIRST_COL_PIN, in_pin_count=len(COL_PINS), pull_in_pin_up=(1 << len(COL_PINS)) - 1,
+        out_shift_right=True, in_shift_right=True, **program.pio_kwargs)
+    self._state_machine.write(row_select_words(num_rows))
+    self._snapshot = array('L', [0] * num_rows)
+    self.row_states = bytearray(num_rows)
+
+  def scan_matrix_rows(self):
+    self._state_machine.readinto(self._snapshot)
+    return decode_snapshot(self._snapshot, self.row_states)
+
+
+def count_stale_scans(create_key_matrix, keys):
+  """
+  Return the number of scans, one per 1 ms tick of a free-running clock, that miss the keys pressed at their tick.
+  """
+  rp2pio.clock = TickClock()
+  try:
+    key_matrix = create_key_matrix()
+    random.seed(2)
+    num_stale_scans = 0
+    for _ in range(NUM_FREE_RUNNING_TICKS):
+      rp2pio.clock.now_ms += 1
+      # The keys change after the state machine has run to where it waits
+      key_matrix._state_machine.in_waiting
+      pressed_keys = random.sample(keys, random.randint(0, 6))
+      if scan(key_matrix, pressed_keys) != expected_row_states(pressed_keys):
+        num_stale_scans += 1
+    key_matrix._state_machine.deinit()
+  finally:
+    rp2pio.clock = None
+  return num_stale_scans
+
+
+def scan(key_matrix, pressed_keys):
+  digitalio.closed_switches.clear()
+  for row, col in pressed_keys:
+    digitalio.closed_switches.add((ROW_PINS[row], COL_PINS[col]))
+  return bytes(key_matrix.scan_matrix_rows())
+
+
+def expected_row_states(pressed_keys):
+  row_states = bytearray(len(ROW_PINS))
+  for row, col in pressed_keys:
+    row_states[row] |= 1 << col
+  return bytes(row_states)
+
+
+def main():
+  results = []
+  program = adafruit_pioasm.Program(PROGRAM.format(settle_cycles=SETTLE_CYCLES))
+  results.append(check(f'the program assembles into {len(program.assembled)} of 32 instructions',
+                       len(program.assembled) <= 32, ''))
+  words = row_select_words(len(ROW_PINS))
+  selections = [words[row // 4] >> 8 * (row % 4) & 0xFF for row in range(len(ROW_PINS))]
+  expected_selections = [1 << pin_number(pin) - pin_number(FIRST_ROW_PIN) for pin in ROW_PINS]
+  results.append(check('each row selects its own pin alone', selections == expected_selections, str(selections)))
+  results.append(check('decoding keeps the columns only', decode_snapshot(array('L', [0x1FF] * 8), bytearray(8))
+                       == bytearray(b'\xff' * 8), ''))
+
+  digitalio.reset()
+  key_matrix = PioKeyMatrix()
+  keys = [(row, col) for row in range(key_matrix.num_rows) for col in range(key_matrix.num_cols)]
+  results.append(check('no key pressed', scan(key_matrix, []) == bytes(8), ''))
+  wrong_keys = [key for key in keys if scan(key_matrix, [key]) != expected_row_states([key])]
+  results.append(check(f'each of the {len(keys)} keys alone', wrong_keys == [], str(wrong_keys[:5])))
+  for name, pressed_keys in (('a row', [(3, col) for col in range(8)]), ('a column', [(row, 5) for row in range(8)]),
+                             ('the diagonal', [(n, n) for n in range(8)]), ('all the keys', keys)):
+    row_states = scan(key_matrix, pressed_keys)
+    results.append(check(f'{name} pressed', row_states == expected_row_states(pressed_keys), row_states.hex()))
+
+  # Every read is a whole scan from row 0, also after the program waited on a full FIFO
+  random.seed(1)
+  misaligned = 0
+  for _ in range(NUM_RANDOM_SCANS):
+    pressed_keys = random.sample(keys, random.randint(0, 6))
+    if scan(key_matrix, pressed_keys) != expected_row_states(pressed_keys):
+      misaligned += 1
+  results.append(check(f'{NUM_RANDOM_SCANS} scans of random keys stay aligned', misaligned == 0, f'{misaligned} wrong'))
+
+  start_cycles = key_matrix._state_machine.cycles
+  scan(key_matrix, [])
+  scan_us = (key_matrix._state_machine.cycles - start_cycles) / PIO_FREQUENCY * 1e6
+  settle_us = (SETTLE_CYCLES + 1) / PIO_FREQUENCY * 1e6
+  results.append(check(f'one scan takes {scan_us:.0f} us of the PIO, {settle_us:.0f} us to settle each row',
+                       scan_us < 1000, ''))
+  key_matrix.deinit()
+
+  # Running freely between scan ticks: a triggered scan is of its tick, while rows 0..3 of a free-running one were
+  # scanned right after the previous read, before the FIFO filled up
+  num_stale_scans = count_stale_scans(PioKeyMatrix, keys)
+  num_free_running_stale_scans = count_stale_scans(FreeRunningKeyMatrix, keys)
+  results.append(check(f'{NUM_FREE_RUNNING_TICKS} ticks of a free-running PIO: {num_stale_scans} stale scans, '
+                       f'{num_free_running_stale_scans} without a trigger', num_stale_scans == 0
+                       and num_free_running_stale_scans > 0, ''))
+
+  # The main loop sends the same reports as with digitalio
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  trace = typing_trace(find_key_positions(CompiledKeyMap(app['KEY_MAP_LAYERS']), 8), 'Hello, PIO!')
+  reports = {}
+  for backend in ('DIGITALIO', 'PIO'):
+    firmware, _ = run(dict(app, KEY_MATRIX_BACKEND=getattr(app['KeyMatrixBackend'], backend)), trace)
+    reports[backend] = list(firmware.nkro_device.sent_reports)
+  results.append(check(f'typing: the same {len(reports["PIO"])} reports as with digitalio',
+                       reports['PIO'] == reports['DIGITALIO'], ''))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,216 @@
+"""
+Host-side fault injection into the HID devices and the main loop.
+
+  % python tools/check_recovery.py
+
+Each case injects a fault through the stand-ins in tools/host while keys are held, runs the main loop of
+tools/simulate.py with its except clause, and prints how long the keyboard was out, against the 3 s sleep that
+restarted the main loop before. As on CircuitPython 8, a send to a host that takes no report blocks for 2 s before it
+fails: a suspended host, which supervisor.runtime tells of, must block no send, and a host that stops taking reports
+must block one. The suspend and the restarts are also checked after 4 days of uptime, past the half period of
+supervisor.ticks_ms() over which ticks compare. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from check_tap_hold import decode_states  # noqa: E402
+from simulate import APP_DIR, Firmware, VirtualClock, check, find_key_positions, with_key_assignments  # noqa: E402
+
+import supervisor  # noqa: E402
+import usb_hid  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.keymap import KeyOp, LambdaAssignment  # noqa: E402
+from octave_pcb.nkro_keyboard import NKRO_REPORT_LENGTH  # noqa: E402
+from octave_pcb.recovery import Recovery  # noqa: E402
+
+# The main loop slept this long after any exception, and started over with no key pressed
+FORMER_RECOVERY_TIME = 3000  # ms
+BUGGY_KEY = (0, 1)
+DAY_MS = 24 * 60 * 60 * 1000
+# (name, uptime in ms at the start of the trace)
+UPTIMES = (('at startup', 0), ('after 4 days', 4 * DAY_MS))
+
+
+def fail_on_press():
+  raise ValueError('Bug in a LambdaAssignment')
+
+
+def run_with_faults(app, trace, faults, end_time, start_ms=0):
+  """
+  Run the main loop on `trace` and apply `faults`, [(time, callable(firmware)), ...], at their times. Return the
+  firmware and the time of each keyboard report in ms since `start_ms`.
+  """
+  clock = VirtualClock(start_ms)
+  firmware = Firmware(app, clock)
+  pressed_keys = set()
+  report_times = []
+  trace = sorted(trace)
+  faults = sorted(faults, key=lambda fault: fault[0])
+  next_event = 0
+  next_fault = 0
+  while clock.elapsed < end_time:
+    current_time = firmware.scheduler.wait()
+    while next_fault < len(faults) and faults[next_fault][0] <= clock.elapsed:
+      faults[next_fault][1](firmware)
+      next_fault += 1
+    while next_event < len(trace) and trace[next_event][0] <= clock.elapsed:
+      _, row, col, is_pressed = trace[next_event]
+      (pressed_keys.add if is_pressed else pressed_keys.discard)((row, col))
+      next_event += 1
+    firmware.set_pressed_keys(pressed_keys)
+    try:
+      firmware.tick(current_time)
+    except Exception as error:
+      firmware.restart(error)
+    while len(report_times) < len(firmware.nkro_device.sent_reports):
+      report_times.append(clock.now_ms - start_ms)
+  return firmware, report_times
+
+
+def first_report_time(firmware, report_times, since_ms, is_expected):
+  # The time of the first report at or after `since_ms` whose state is expected, or None
+  for report, report_time in zip(firmware.nkro_device.sent_reports, report_times):
+    if report_time >= since_ms and is_expected(decode_states([report])[0]):
+      return report_time
+  return None
+
+
+def find_layer_key(key_map, num_cols):
+  # A momentary layer key of layer 0, and a key whose keycode differs on that layer
+  layer_0 = key_map.resolve(1)
+  for i in range(len(layer_0) // 2):
+    if layer_0[2 * i] == KeyOp.LAYER:
+      layer = key_map.resolve(1 | 1 << layer_0[2 * i + 1])
+      for j in range(len(layer) // 2):
+        if layer[2 * j] == KeyOp.KEYBOARD and layer_0[2 * j] == KeyOp.KEYBOARD \
+            and layer[2 * j + 1] != layer_0[2 * j + 1]:
+          return divmod(i, num_cols), divmod(j, num_cols), layer[2 * j + 1]
+  raise ValueError('No momentary layer key in layer 0')
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  results = []
+
+  firmware = Firmware(app, VirtualClock())
+  positions = find_key_positions(firmware.key_map, 8)
+  a = positions[Keycode.A]
+  b = positions[Keycode.B]
+  layer_key, layer_target, layer_keycode = find_layer_key(firmware.key_map, 8)
+
+  # A send fails once, with the endpoint ready: retried after 1 ms
+  def fail_next_send(firmware):
+    firmware.nkro_device.fail_next_send = OSError('USB error')
+
+  firmware, report_times = run_with_faults(app, [(0.1, *a, True), (0.2, *a, False)], [(0.09, fail_next_send)], 0.5)
+  sent_time = first_report_time(firmware, report_times, 100, lambda state: Keycode.A in state)
+  recovery_time = sent_time - 100 if sent_time is not None else None
+  results.append(check(f'one failed send: A sent in {recovery_time} ms (was {FORMER_RECOVERY_TIME} ms)',
+                       recovery_time is not None and recovery_time <= 5 and firmware.recovery.num_retries == 1
+                       and firmware.recovery.num_restarts == 0,
+                       f'{firmware.recovery.num_retries} retries, {firmware.recovery.num_restarts} restarts'))
+
+  # The host is suspended for 300 ms while a layer key is held: the keyboard drops its reports without sending, and is
+  # probed once the host is back
+  def suspend(firmware):
+    supervisor.runtime.usb_connected = False
+    firmware.nkro_device.fail_sends = OSError('USB busy')
+
+  def resume(firmware):
+    supervisor.runtime.usb_connected = True
+    firmware.nkro_device.fail_sends = None
+
+  trace = [
+      (0.1, *layer_key, True),
+      (0.2, *a, True), (0.35, *a, False),
+      (0.6, *layer_target, True), (0.7, *layer_target, False),
+      (0.8, *layer_key, False),
+      (0.9, *b, True), (1.0, *b, False),
+  ]
+  for uptime_name, start_ms in UPTIMES:
+    firmware, report_times = run_with_faults(app, trace, [(0.15, suspend), (0.45, resume)], 1.5, start_ms)
+    recovery = firmware.recovery
+    states = decode_states(firmware.nkro_device.sent_reports)
+    released_time = first_report_time(firmware, report_times, 450, lambda state: state == set())
+    # The probe at the first tick, then the report of the rebuilt keyboard at the next poll of the endpoint
+    recovery_time = released_time - 450 if released_time is not None else None
+    num_timed_out_sends = firmware.nkro_device.num_timed_out_sends
+    results.append(check(f'suspended host {uptime_name}: all-released report {recovery_time} ms after resume '
+                         f'(was {FORMER_RECOVERY_TIME} ms), {num_timed_out_sends} sends blocked',
+                         recovery_time is not None and recovery_time <= 1 + usb_hid.ENDPOINT_INTERVAL
+                         and num_timed_out_sends == 0 and recovery.num_recoveries == 1 and recovery.num_restarts == 0,
+                         f'{recovery.num_recoveries} recoveries, {recovery.num_restarts} restarts'))
+  results.append(check('suspended host: nothing sent while suspended, A dropped', {Keycode.A} not in states,
+                       str(states)))
+  layer_time = first_report_time(firmware, report_times, 600, lambda state: layer_keycode in state)
+  results.append(check('suspended host: the layer held through the suspend is kept', layer_time is not None,
+                       str(states)))
+  results.append(check('suspended host: keys work after the layer is released', states[-2:] == [{Keycode.B}, set()],
+                       str(states)))
+
+  # The host stops taking reports for 3 s, still connected: the send of A times out after 2 s and is not retried, and
+  # the keyboard is probed after probe_interval
+  def stop_taking_reports(firmware):
+    firmware.nkro_device.fail_sends = OSError('USB busy')
+
+  probe_interval = firmware.recovery.probe_interval
+  firmware, report_times = run_with_faults(app, [(0.1, *a, True), (0.2, *a, False)],
+                                           [(0.09, stop_taking_reports), (3.0, resume)], 3.0 + probe_interval / 1000)
+  recovery = firmware.recovery
+  num_timed_out_sends = firmware.nkro_device.num_timed_out_sends
+  released_time = first_report_time(firmware, report_times, 3000, lambda state: state == set())
+  # The send of A at 100 ms, the probe after the timeout and probe_interval, and the report of the rebuilt keyboard at
+  # the next poll of the endpoint
+  latest_time = 100 + usb_hid.SEND_TIMEOUT + probe_interval + 1 + usb_hid.ENDPOINT_INTERVAL
+  results.append(check(f'host not taking reports: {num_timed_out_sends} send blocked for {usb_hid.SEND_TIMEOUT} ms, '
+                       f'{recovery.num_retries} retries, back {released_time} ms into the trace',
+                       num_timed_out_sends == 1 and recovery.num_retries == 0 and recovery.num_recoveries == 1
+                       and released_time is not None and released_time <= latest_time,
+                       f'{recovery.num_recoveries} recoveries'))
+
+  # A bug raises while a key is held: the main loop restarts after 10 ms, then longer for a restart loop
+  app_with_bug = with_key_assignments(app, {BUGGY_KEY: LambdaAssignment(fail_on_press, None)})
+  trace = [(0.1, *a, True), (0.15, *BUGGY_KEY, True), (0.2, *BUGGY_KEY, False), (0.3, *a, False),
+           (0.4, *b, True), (0.5, *b, False)]
+  firmware, report_times = run_with_faults(app_with_bug, trace, [], 1.0)
+  states = decode_states(firmware.nkro_device.sent_reports)
+  restart_time = first_report_time(firmware, report_times, 400, lambda state: Keycode.B in state)
+  results.append(check(f'bug: restarted once, B sent {restart_time - 400 if restart_time else None} ms after press',
+                       firmware.recovery.num_restarts == 1 and restart_time is not None and restart_time - 400 <= 5,
+                       f'{firmware.recovery.num_restarts} restarts, {states}'))
+  results.append(check('bug: restart delays escalate in a row',
+                       [firmware.recovery.restart_delay(ValueError()) for _ in range(4)] == [0.1, 1.0, 3.0, 3.0],
+                       str(firmware.recovery._restart_delays)))
+  results.append(check('bug: a HID send failure that got through restarts without escalating',
+                       firmware.recovery.restart_delay(OSError()) == 0.01, ''))
+
+  # Restarts days apart, with the main loop polling in between: each is a first restart, however the ticks wrapped
+  for uptime_name, start_ms in UPTIMES:
+    clock = VirtualClock(start_ms)
+    recovery = Recovery(firmware.recovery.devices, ticks_ms=clock.ticks_ms, sleep=clock.sleep)
+    delays = []
+    for _ in range(3):
+      delays.append(recovery.restart_delay(ValueError()))
+      for _ in range(4 * 24):
+        clock.sleep(3600)
+        recovery.poll(clock.ticks_ms())
+    results.append(check(f'bug {uptime_name}: restarts 4 days apart do not escalate: {delays} s',
+                         delays == [delays[0]] * 3, ''))
+
+  # The probe of each device sends an all-released report of its own length
+  probes = []
+  for device in firmware.recovery.devices:
+    device.probe()
+    probes.append(len(device.device.sent_reports[-1][1]))
+  expected_probes = [8, NKRO_REPORT_LENGTH, 4, 2]
+  results.append(check(f'probes of the boot keyboard, NKRO keyboard, mouse and consumer control: {probes} bytes',
+                       probes == expected_probes, f'expected {expected_probes}'))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,176 @@
+"""
+Host-side check of the main loop scheduler on virtual clocks.
+
+  % python tools/check_scheduler.py
+
+The scan ticks of Scheduler are compared with the ones of the busy-polling loop it replaced, on the same random work
+per scan, and its wake-ups are checked against requested deadlines. The main loop of tools/simulate.py then runs with
+a scan interval that is not a divisor of the long-press repeat and mouse keys intervals, which only stay exact if the
+loop wakes up at their deadlines. It exits with a non-zero status if any case fails.
+"""
+import os
+import random
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, MOUSE_KEYS, check, find_key_positions, key_repeat_trace, mouse_keys_trace, run, \
+    with_key_assignments  # noqa: E402
+
+from octave_pcb.key_event import LONG_PRESS_REPEAT_INTERVAL  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap  # noqa: E402
+from octave_pcb.scheduler import Scheduler  # noqa: E402
+from octave_pcb.ticks import TICKS_PERIOD, ticks_add  # noqa: E402
+
+NUM_SCANS = 5000
+POLL_US = 20  # One time.monotonic() and compare of the busy-polling loop
+OVERRUN_PROBABILITY = 0.02
+SLOW_SCAN_INTERVAL = 16  # ms, not a divisor of the long-press repeat or the mouse keys intervals
+
+
+class MicrosecondClock:
+  """
+  A virtual clock in microseconds, whose ticks_ms() counts whole milliseconds as supervisor.ticks_ms(). A sleep ends
+  on the millisecond tick it waits for, as time.sleep() of CircuitPython.
+  """
+
+  def __init__(self, start_ms=0):
+    self.now_us = start_ms * 1000
+    self.awake_us = 0
+    self.num_sleeps = 0
+
+  def ticks_ms(self):
+    return self.now_us // 1000 % TICKS_PERIOD
+
+  def sleep(self, seconds):
+    self.num_sleeps += 1
+    self.now_us = (self.now_us // 1000 + round(seconds * 1000)) * 1000
+
+  def work(self, us):
+    self.now_us += us
+    self.awake_us += us
+
+
+def make_workloads(scan_interval):
+  # CPU time of each scan in us, mostly within the scan interval and sometimes overrunning it
+  random.seed(1)
+  return [random.randint(scan_interval * 1000, scan_interval * 3500) if random.random() < OVERRUN_PROBABILITY
+          else random.randint(50, scan_interval * 900) for _ in range(NUM_SCANS)]
+
+
+def scheduled_scan_times(workloads, scan_interval):
+  """
+  Return the start of each scan in us, the delays of the scans that were waited for after their tick, and the clock.
+  """
+  clock = MicrosecondClock()
+  scheduler = Scheduler(scan_interval, clock.ticks_ms, clock.sleep)
+  scan_times = []
+  delays = []
+  for work_us in workloads:
+    num_sleeps = clock.num_sleeps
+    current_time = scheduler.wait()
+    scan_times.append(clock.now_us)
+    if clock.num_sleeps > num_sleeps:
+      delays.append(clock.now_us % 1000)
+    clock.work(work_us)
+    scheduler.schedule_next_scan(current_time)
+  return scan_times, delays, clock
+
+
+def busy_polling_scan_times(workloads, scan_interval):
+  # The main loop before Scheduler, which polled the clock until the next scan tick
+  clock = MicrosecondClock()
+  scan_timing = clock.ticks_ms()
+  scan_times = []
+  delays = []
+  for work_us in workloads:
+    current_time = clock.ticks_ms()
+    if current_time < scan_timing:
+      while current_time < scan_timing:
+        clock.work(POLL_US)
+        current_time = clock.ticks_ms()
+      delays.append(clock.now_us % 1000)
+    scan_times.append(clock.now_us)
+    clock.work(work_us)
+    scan_timing += scan_interval
+    if scan_timing <= current_time:
+      scan_timing = current_time + scan_interval
+  return scan_times, delays, clock
+
+
+def wake_time(scheduler, clock, requests):
+  """
+  Request `requests`, ms after now, wait, and return the ms waited and the number of sleeps.
+  """
+  start_ms = clock.now_us // 1000
+  num_sleeps = clock.num_sleeps
+  for request in requests:
+    scheduler.request(ticks_add(clock.ticks_ms(), request))
+  current_time = scheduler.wait()
+  scheduler.schedule_next_scan(current_time)
+  return clock.now_us // 1000 - start_ms, clock.num_sleeps - num_sleeps
+
+
+def main():
+  results = []
+
+  # Scan ticks against the busy-polling loop, on the same work
+  for scan_interval in (1, 4):
+    workloads = make_workloads(scan_interval)
+    scan_times, delays, clock = scheduled_scan_times(workloads, scan_interval)
+    baseline_scan_times, baseline_delays, baseline_clock = busy_polling_scan_times(workloads, scan_interval)
+    # Jitter: the latest start of a scan after the tick the loop waited for
+    results.append(check(f'{scan_interval} ms scans: jitter {max(delays)} us, busy polling {max(baseline_delays)} us',
+                         max(delays) <= max(baseline_delays), ''))
+    late_scans = [n for n in range(NUM_SCANS) if scan_times[n] > baseline_scan_times[n]]
+    results.append(check(f'{scan_interval} ms scans: none starts later than with busy polling, also after overruns',
+                         late_scans == [], f'{len(late_scans)} later, the first is scan {late_scans[:1]}'))
+    awake = clock.awake_us / clock.now_us
+    baseline_awake = baseline_clock.awake_us / baseline_clock.now_us
+    results.append(check(f'{scan_interval} ms scans: awake {awake:.0%} of the time, busy polling {baseline_awake:.0%}',
+                         clock.awake_us == sum(workloads) and awake < baseline_awake, ''))
+
+  # Wake-ups at the earliest deadline, with a scan tick every 4 ms. Each case starts on a scan tick.
+  for name, start_ms in (('', 0), (' across the ticks wrap', TICKS_PERIOD - 2)):
+    clock = MicrosecondClock(start_ms)
+    scheduler = Scheduler(4, clock.ticks_ms, clock.sleep)
+    # The first scan is due at once
+    wake_time(scheduler, clock, ())
+    cases = (
+        ('the scan tick', (), (4, 1)),
+        ('a long press before the scan tick', (2,), (2, 1)),
+        ('then the scan tick, not one interval after the long press', (), (2, 1)),
+        ('the earliest of a long press and HID work', (3, 1), (1, 1)),
+        ('then the scan tick, as the later request is not kept', (), (3, 1)),
+        ('the scan tick, before a later request', (7,), (4, 1)),
+        ('a deadline already due, without a sleep', (0,), (0, 0)),
+        ('then the scan tick', (), (4, 1)),
+    )
+    for case_name, requests, expected in cases:
+      actual = wake_time(scheduler, clock, requests)
+      results.append(check(f'wakes at {case_name}{name}: {actual[0]} ms, {actual[1]} sleeps', actual == expected,
+                           f'expected {expected[0]} ms, {expected[1]} sleeps'))
+
+  # The main loop with slow scan ticks
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  app['SCAN_KEY_MATRIX_INTERVAL'] = SLOW_SCAN_INTERVAL
+  positions = find_key_positions(CompiledKeyMap(app['KEY_MAP_LAYERS']), 8)
+  _, result = run(app, key_repeat_trace(positions))
+  intervals = sorted(set(result.long_press_intervals))
+  results.append(check(f'{SLOW_SCAN_INTERVAL} ms scans: {len(result.long_press_intervals)} long-press repeats every '
+                       f'{LONG_PRESS_REPEAT_INTERVAL} ms', intervals == [LONG_PRESS_REPEAT_INTERVAL], str(intervals)))
+  mouse_app = with_key_assignments(app, MOUSE_KEYS)
+  _, result = run(mouse_app, mouse_keys_trace(positions))
+  times = result.mouse_report_times
+  # The reports while a move or wheel key is held, leaving out the gaps between the keys
+  intervals = sorted(set(times[n + 1] - times[n] for n in range(len(times) - 1) if times[n + 1] - times[n] < 100))
+  expected_intervals = sorted((mouse_app['MOUSE_KEYS_INTERVAL'], mouse_app['MOUSE_KEYS_WHEEL_INTERVAL']))
+  results.append(check(f'{SLOW_SCAN_INTERVAL} ms scans: mouse reports every {expected_intervals[0]} ms, '
+                       f'wheel ones every {expected_intervals[1]} ms', intervals == expected_intervals, str(intervals)))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
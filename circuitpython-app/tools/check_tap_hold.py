@@ -0,0 +1,97 @@
+"""
+Host-side check of the tap-hold keys (ComplexModifierAssignment) on rollover orderings.
+
+  % python tools/check_tap_hold.py
+
+Each case plays a short trace through tools/simulate.py in both tap-hold modes and compares the keyboard states
+sent to the host with the expected ones. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, run  # noqa: E402
+
+from adafruit_hid.keycode import Keycode  # noqa: E402
+from octave_pcb.tap_hold import TapHoldMode  # noqa: E402
+
+TAPPING_TERM = 200  # ms
+
+LEFT_COMMAND = (3, 3)  # LEFT_GUI / JAPANESE_EISUU
+CAPS_LOCK = (2, 0)  # MO(1) / JAPANESE_EISUU
+A = (2, 3)  # LEFT_ARROW on layer 1
+S = (2, 4)  # DOWN_ARROW on layer 1
+
+EISUU = 0x91
+GUI = 'GUI'
+HOLD = HOLD_ON_OTHER_KEY_PRESS = TapHoldMode.HOLD_ON_OTHER_KEY_PRESS
+PERMISSIVE_HOLD = TapHoldMode.PERMISSIVE_HOLD
+
+# (name, trace [(ms, key, is_pressed)], {mode: expected states}). A modifier pressed in the same scan as a key is
+# sent in a report before it.
+CASES = (
+    ('tap', [(0, LEFT_COMMAND, True), (100, LEFT_COMMAND, False)],
+     {HOLD: [{EISUU}, set()], PERMISSIVE_HOLD: [{EISUU}, set()]}),
+    ('hold past the tapping term', [(0, LEFT_COMMAND, True), (400, LEFT_COMMAND, False)],
+     {HOLD: [{GUI}, set()], PERMISSIVE_HOLD: [{GUI}, set()]}),
+    ('nested', [(0, LEFT_COMMAND, True), (50, A, True), (100, A, False), (150, LEFT_COMMAND, False)],
+     {HOLD: [{GUI}, {GUI, Keycode.A}, {GUI}, set()], PERMISSIVE_HOLD: [{GUI}, {GUI, Keycode.A}, {GUI}, set()]}),
+    ('rolling', [(0, LEFT_COMMAND, True), (50, A, True), (100, LEFT_COMMAND, False), (150, A, False)],
+     {HOLD: [{GUI}, {GUI, Keycode.A}, {Keycode.A}, set()],
+      PERMISSIVE_HOLD: [{EISUU}, set(), {Keycode.A}, set()]}),
+    ('rolling past the tapping term', [(0, LEFT_COMMAND, True), (50, A, True), (300, LEFT_COMMAND, False),
+                                       (350, A, False)],
+     {HOLD: [{GUI}, {GUI, Keycode.A}, {Keycode.A}, set()],
+      PERMISSIVE_HOLD: [{GUI}, {GUI, Keycode.A}, {Keycode.A}, set()]}),
+    ('other key first', [(0, A, True), (50, LEFT_COMMAND, True), (100, A, False), (150, LEFT_COMMAND, False)],
+     {HOLD: [{Keycode.A}, set(), {EISUU}, set()], PERMISSIVE_HOLD: [{Keycode.A}, set(), {EISUU}, set()]}),
+    ('layer nested', [(0, CAPS_LOCK, True), (50, A, True), (70, S, True), (100, A, False), (110, S, False),
+                      (150, CAPS_LOCK, False)],
+     {HOLD: [{Keycode.LEFT_ARROW}, {Keycode.LEFT_ARROW, Keycode.DOWN_ARROW}, {Keycode.DOWN_ARROW}, set()],
+      PERMISSIVE_HOLD: [{Keycode.LEFT_ARROW, Keycode.DOWN_ARROW}, {Keycode.DOWN_ARROW}, set()]}),
+    ('layer rolling', [(0, CAPS_LOCK, True), (50, A, True), (100, CAPS_LOCK, False), (150, A, False)],
+     {HOLD: [{Keycode.LEFT_ARROW}, set()], PERMISSIVE_HOLD: [{EISUU}, set(), {Keycode.A}, set()]}),
+    ('two tap-hold keys', [(0, LEFT_COMMAND, True), (50, CAPS_LOCK, True), (100, CAPS_LOCK, False),
+                           (150, LEFT_COMMAND, False)],
+     {HOLD: [{EISUU}, set(), {EISUU}, set()], PERMISSIVE_HOLD: [{GUI}, {GUI, EISUU}, {GUI}, set()]}),
+)
+
+
+def decode_states(reports):
+  """
+  Return the keyboard states of NKRO reports as sets of keycodes, GUI for either GUI modifier.
+  """
+  states = []
+  for _, data in reports:
+    state = {GUI} if data[0] & 0x88 else set()
+    for keycode in range((len(data) - 1) * 8):
+      if data[1 + keycode // 8] & (1 << (keycode % 8)):
+        state.add(keycode)
+    if not states or states[-1] != state:
+      states.append(state)
+  return states
+
+
+def main():
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  app['TAPPING_TERM'] = TAPPING_TERM
+  num_failures = 0
+  for name, events, expected_states in CASES:
+    trace = [(ms / 1000 + 0.1, row, col, is_pressed) for ms, (row, col), is_pressed in events]
+    for mode, expected in expected_states.items():
+      app['TAP_HOLD_MODE'] = mode
+      firmware, _ = run(app, trace)
+      states = decode_states(firmware.nkro_device.sent_reports)
+      mode_name = 'permissive hold' if mode == PERMISSIVE_HOLD else 'hold on other key press'
+      if states == expected:
+        print(f'ok    {name} ({mode_name})')
+      else:
+        print(f'FAIL  {name} ({mode_name}): {states} != {expected}')
+        num_failures += 1
+  sys.exit(1 if num_failures > 0 else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,68 @@
+"""
+Host-side check of the timing of the main loop after a long uptime, past the wraparound of supervisor.ticks_ms().
+
+  % python tools/check_uptime.py
+
+The virtual clock of tools/simulate.py is fast-forwarded by days and weeks, some of them to just before a wraparound
+of ticks_ms every 2**29 ms (6.2 days), so that the keys are held across it. At every uptime, the long-press repeats
+must stay exactly LONG_PRESS_REPEAT_INTERVAL apart, the scans exactly SCAN_KEY_MATRIX_INTERVAL apart, and the
+keyboard reports must be the ones sent right after startup. It exits with a non-zero status if any case fails.
+"""
+import os
+import runpy
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulate import APP_DIR, check, find_key_positions, key_repeat_trace, run, typing_trace  # noqa: E402
+
+from octave_pcb.key_event import LONG_PRESS_REPEAT_INTERVAL  # noqa: E402
+from octave_pcb.keymap import CompiledKeyMap  # noqa: E402
+from octave_pcb.ticks import TICKS_PERIOD  # noqa: E402
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# (name, uptime in ms at the start of the traces)
+UPTIMES = (
+    ('6.2 days', round(6.2 * DAY_MS)),
+    ('the first wrap, 1.5 s into the repeats', TICKS_PERIOD - 1500),
+    ('the first wrap, between two keystrokes', TICKS_PERIOD - 400),
+    ('3 weeks', 21 * DAY_MS),
+    ('the third wrap, 18.6 days', 3 * TICKS_PERIOD - 1500),
+    ('7 weeks', 49 * DAY_MS),
+)
+
+
+def main():
+  results = []
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  scan_interval = app['SCAN_KEY_MATRIX_INTERVAL']
+  positions = find_key_positions(CompiledKeyMap(app['KEY_MAP_LAYERS']), 8)
+  traces = (('repeats', key_repeat_trace(positions)), ('typing', typing_trace(positions, 'wrap around, twice.')))
+  _, repeat_result = run(app, traces[0][1])
+  expected_num_repeats = len(repeat_result.long_press_intervals)
+  expected_reports = {name: run(app, trace)[0].nkro_device.sent_reports for name, trace in traces}
+
+  for name, start_ms in UPTIMES:
+    spacings = set()
+    wrong_reports = []
+    for trace_name, trace in traces:
+      firmware, result = run(app, trace, start_ms)
+      spacings.update(result.scan_intervals)
+      if firmware.nkro_device.sent_reports != expected_reports[trace_name]:
+        wrong_reports.append(trace_name)
+      if trace_name == 'repeats':
+        intervals = sorted(set(result.long_press_intervals))
+        num_repeats = len(result.long_press_intervals)
+        results.append(check(f'{name}: {num_repeats} repeats every {LONG_PRESS_REPEAT_INTERVAL} ms',
+                             intervals == [LONG_PRESS_REPEAT_INTERVAL] and num_repeats == expected_num_repeats,
+                             f'{intervals}, {num_repeats} of {expected_num_repeats}'))
+    results.append(check(f'{name}: scans {scan_interval} ms apart, and the reports of uptime 0',
+                         sorted(spacings) == [scan_interval] and wrong_reports == [],
+                         f'scan spacings {sorted(spacings)}, different reports in {wrong_reports}'))
+
+  sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,12 @@
+"""
+Host stand-in for the parts of adafruit_hid 6.0.1 used by this app.
+"""
+
+
+def find_device(devices, *, usage_page, usage):
+  if hasattr(devices, 'send_report'):
+    devices = [devices]
+  for device in devices:
+    if device.usage_page == usage_page and device.usage == usage and hasattr(device, 'send_report'):
+      return device
+  raise ValueError('Could not find matching HID device.')
@@ -0,0 +1,18 @@
+"""
+Host stand-in for CircuitPython's `board` module of takayoshiotake_octave_rp2040.
+"""
+
+
+class Pin:
+  def __init__(self, name):
+    self.name = name
+
+  def __repr__(self):
+    return 'board.' + self.name
+
+
+for _number in range(30):
+  globals()['GPIO%d' % _number] = Pin('GPIO%d' % _number)
+
+NEOPIX_POWER = Pin('NEOPIX_POWER')
+NEOPIXEL = Pin('NEOPIXEL')
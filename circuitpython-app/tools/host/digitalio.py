@@ -0,0 +1,69 @@
+"""
+Host stand-in for CircuitPython's `digitalio` module.
+
+Switches are modeled as `closed_switches`, a set of (row pin, column pin) pairs. A pulled-up input reads low while
+it is connected through a closed switch to an output that drives low. Every pin access is counted in `stats`.
+"""
+
+closed_switches = set()
+stats = {'reads': 0, 'writes': 0}
+
+_output_levels = {}
+
+
+class Direction:
+  INPUT = 0
+  OUTPUT = 1
+
+
+class DriveMode:
+  PUSH_PULL = 0
+  OPEN_DRAIN = 1
+
+
+class Pull:
+  UP = 1
+  DOWN = 2
+
+
+def reset():
+  closed_switches.clear()
+  _output_levels.clear()
+  stats['reads'] = 0
+  stats['writes'] = 0
+
+
+class DigitalInOut:
+  def __init__(self, pin):
+    self._pin = pin
+    self.direction = Direction.INPUT
+    self.drive_mode = DriveMode.PUSH_PULL
+    self.pull = None
+
+  def deinit(self):
+    _output_levels.pop(self._pin, None)
+
+  def switch_to_output(self, value=False, drive_mode=DriveMode.PUSH_PULL):
+    self.direction = Direction.OUTPUT
+    self.drive_mode = drive_mode
+    _output_levels[self._pin] = value
+
+  def switch_to_input(self, pull=None):
+    self.direction = Direction.INPUT
+    self.pull = pull
+    _output_levels.pop(self._pin, None)
+
+  @property
+  def value(self):
+    stats['reads'] += 1
+    if self.direction == Direction.OUTPUT:
+      return _output_levels[self._pin]
+    for row_pin, col_pin in closed_switches:
+      if col_pin is self._pin and _output_levels.get(row_pin) is False:
+        return False
+    return self.pull == Pull.UP
+
+  @value.setter
+  def value(self, value):
+    stats['writes'] += 1
+    _output_levels[self._pin] = value
@@ -0,0 +1,76 @@
+"""
+Host stand-in for CircuitPython's `keypad` module.
+
+`KeyMatrix` has no background scanning; it scans the switches of the `digitalio` stand-in whenever its event queue
+is read empty.
+"""
+import time
+
+import digitalio
+
+
+class Event:
+  def __init__(self, key_number=0, pressed=True):
+    self.key_number = key_number
+    self.pressed = pressed
+    self.released = not pressed
+    self.timestamp = 0
+
+
+class EventQueue:
+  def __init__(self, max_events, scan):
+    self._max_events = max_events
+    self._scan = scan
+    self._events = []
+    self.overflowed = False
+
+  def __len__(self):
+    return len(self._events)
+
+  def clear(self):
+    self._events.clear()
+    self.overflowed = False
+
+  def put(self, key_number, pressed, timestamp):
+    if len(self._events) >= self._max_events:
+      self.overflowed = True
+      return
+    self._events.append((key_number, pressed, timestamp))
+
+  def get_into(self, event):
+    if not self._events:
+      self._scan()
+    if not self._events:
+      return False
+    event.key_number, event.pressed, event.timestamp = self._events.pop(0)
+    event.released = not event.pressed
+    return True
+
+  def get(self):
+    event = Event()
+    return event if self.get_into(event) else None
+
+
+class KeyMatrix:
+  def __init__(self, row_pins, column_pins, columns_to_anodes=True, interval=0.02, max_events=64):
+    self._row_pins = tuple(row_pins)
+    self._column_pins = tuple(column_pins)
+    self._pressed = [False] * (len(self._row_pins) * len(self._column_pins))
+    self.key_count = len(self._pressed)
+    self.events = EventQueue(max_events, self._scan)
+
+  def deinit(self):
+    pass
+
+  def reset(self):
+    self._pressed = [False] * self.key_count
+
+  def _scan(self):
+    timestamp = (time.monotonic_ns() // 1000000) & ((1 << 29) - 1)
+    num_cols = len(self._column_pins)
+    for key_number in range(self.key_count):
+      row, col = divmod(key_number, num_cols)
+      is_pressed = (self._row_pins[row], self._column_pins[col]) in digitalio.closed_switches
+      if is_pressed != self._pressed[key_number]:
+        self._pressed[key_number] = is_pressed
+        self.events.put(key_number, is_pressed, timestamp)
@@ -0,0 +1,29 @@
+"""
+Host stand-in for CircuitPython's `microcontroller` module. `nvm` is 4 KB like on the RP2040 and, like
+nvm.ByteArray, supports len() and subscripts but no buffer protocol. `nvm.num_writes` counts the writes to flash.
+"""
+
+
+class ByteArray:
+  def __init__(self, size):
+    self._data = bytearray(b'\xff' * size)
+    self.num_writes = 0
+
+  def __len__(self):
+    return len(self._data)
+
+  def __getitem__(self, index):
+    return self._data[index]
+
+  def __setitem__(self, index, value):
+    if isinstance(index, slice) and len(range(*index.indices(len(self._data)))) != len(value):
+      raise ValueError('Slice and value have different lengths')
+    self._data[index] = value
+    self.num_writes += 1
+
+  def reset(self):
+    self._data[:] = b'\xff' * len(self._data)
+    self.num_writes = 0
+
+
+nvm = ByteArray(4096)
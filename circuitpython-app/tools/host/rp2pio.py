@@ -0,0 +1,305 @@
+"""
+Host stand-in for CircuitPython's `rp2pio` module, with an instruction simulator of one PIO state machine.
+
+The state machine runs while the stand-in waits on it, in `write()`, `readinto()` and `write_readinto()`, and counts its
+cycles in `cycles`. With a `clock` set, it also runs freely in time: before these calls and `in_waiting`, it catches up
+with the clock at its frequency, stalling where the program waits, as on the RP2040 between two calls of the main loop.
+The GPIO levels come from the `digitalio` stand-in: a pulled-up input reads low while it is connected through a closed
+switch to a pin the state machine drives low. As on CircuitPython 8, there is no `background_read()`.
+
+Only the instructions and options the programs of `octave_pcb` use are simulated; the others raise
+NotImplementedError.
+"""
+import digitalio
+
+NUM_PINS = 30
+FIFO_DEPTH = 4
+# The instructions readinto() and write() wait for the FIFO, after which the program is taken as stalled
+MAX_WAIT_STEPS = 1_000_000
+
+# An object with ticks_ms(), e.g. the virtual clock of tools/simulate.py, or None to run only in the calls
+clock = None
+
+
+def pin_number(pin):
+  return int(pin.name[len('GPIO'):])
+
+
+class StateMachine:
+  def __init__(self, program, frequency, *, init=None, first_out_pin=None, out_pin_count=1, initial_out_pin_state=0,
+               initial_out_pin_direction=0xFFFFFFFF, first_in_pin=None, in_pin_count=1, pull_in_pin_up=0,
+               pull_in_pin_down=0, first_set_pin=None, set_pin_count=1, initial_set_pin_state=0,
+               initial_set_pin_direction=0x1F, auto_pull=False, pull_threshold=32, out_shift_right=True,
+               auto_push=False, push_threshold=32, in_shift_right=True, wrap_target=0, wrap=-1, **kwargs):
+    if init is not None or auto_pull or auto_push or pull_in_pin_down:
+      raise NotImplementedError('init, auto_pull, auto_push and pull_in_pin_down')
+    if kwargs.get('sideset_enable'):
+      raise NotImplementedError('side-set')
+    self._program = tuple(program)
+    self.frequency = frequency
+    self._out_base = pin_number(first_out_pin) if first_out_pin is not None else 0
+    self._out_count = out_pin_count
+    self._set_base = pin_number(first_set_pin) if first_set_pin is not None else 0
+    self._set_count = set_pin_count
+    self._in_base = pin_number(first_in_pin) if first_in_pin is not None else 0
+    self._pull_ups = pull_in_pin_up << self._in_base
+    self._pull_threshold = pull_threshold
+    self._out_shift_right = out_shift_right
+    self._in_shift_right = in_shift_right
+    self._wrap_target = wrap_target
+    self._wrap = wrap if wrap >= 0 else len(self._program) - 1
+    self._pin_values = 0
+    self._pin_directions = 0
+    self._write_pins(self._out_base, self._out_count, initial_out_pin_state, initial_out_pin_direction)
+    if first_set_pin is not None:
+      self._write_pins(self._set_base, self._set_count, initial_set_pin_state, initial_set_pin_direction)
+    self.cycles = 0
+    # The clock time of cycle 0, in cycles
+    self._start_cycles = clock.ticks_ms() * frequency // 1000 if clock is not None else 0
+    self.restart()
+
+  def deinit(self):
+    self._program = ()
+
+  def restart(self):
+    self._pc = 0
+    self._x = 0
+    self._y = 0
+    self._isr = 0
+    self._isr_count = 0
+    self._osr = 0
+    # Empty, as after a pull with nothing left to shift
+    self._osr_count = 32
+    self._tx_fifo = []
+    self._rx_fifo = []
+
+  @property
+  def in_waiting(self):
+    self._catch_up()
+    return len(self._rx_fifo)
+
+  def clear_rxfifo(self):
+    self._rx_fifo.clear()
+
+  def write(self, buffer):
+    self._catch_up()
+    size = _item_size(buffer)
+    for value in buffer:
+      self._run_until(lambda: len(self._tx_fifo) < FIFO_DEPTH)
+      self._tx_fifo.append(value & ((1 << 8 * size) - 1))
+
+  def readinto(self, buffer, *, start=0, end=None, swap=False):
+    self._catch_up()
+    size = _item_size(buffer)
+    end = len(buffer) if end is None else end
+    for n in range(start, end):
+      self._run_until(lambda: len(self._rx_fifo) > 0)
+      value = self._rx_fifo.pop(0)
+      # As the DMA of CircuitPython, narrow reads take the bytes the program shifted in last
+      buffer[n] = value >> 8 * (4 - size) if self._in_shift_right else value & ((1 << 8 * size) - 1)
+
+  def write_readinto(self, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0, in_end=None):
+    # The words written fit in the TX FIFO, so writing them before reading is the same as the DMA of both at once
+    out_end = len(buffer_out) if out_end is None else out_end
+    self.write(buffer_out[out_start:out_end])
+    self.readinto(buffer_in, start=in_start, end=in_end)
+
+  def read_pins(self):
+    """
+    Return the levels of all the GPIO pins, bit n for GPIO n.
+    """
+    levels = self._pin_values & self._pin_directions | self._pull_ups & ~self._pin_directions
+    for row_pin, col_pin in digitalio.closed_switches:
+      row, col = pin_number(row_pin), pin_number(col_pin)
+      if self._pin_directions >> row & 1 and not self._pin_values >> row & 1 and not self._pin_directions >> col & 1:
+        levels &= ~(1 << col)
+    return levels
+
+  def _catch_up(self):
+    # Run the cycles since the last call, which the program spends scanning or stalled
+    if clock is None:
+      return
+    end_cycles = clock.ticks_ms() * self.frequency // 1000 - self._start_cycles
+    while self.cycles < end_cycles:
+      self._step()
+
+  def _run_until(self, is_ready):
+    for _ in range(MAX_WAIT_STEPS):
+      if is_ready():
+        return
+      self._step()
+    raise RuntimeError('PIO program stalled at {}'.format(self._pc))
+
+  def _write_pins(self, base, count, values, directions):
+    mask = _rotate_left((1 << count) - 1, base)
+    if directions is not None:
+      self._pin_directions = self._pin_directions & ~mask | _rotate_left(directions, base) & mask
+    if values is not None:
+      self._pin_values = self._pin_values & ~mask | _rotate_left(values, base) & mask
+
+  def _step(self):
+    # The instruction at the program counter, which stays there for a cycle while it stalls. Nothing else runs in the
+    # meantime, so its delay cycles pass at once.
+    self.cycles += 1
+    instruction = self._program[self._pc]
+    opcode = instruction >> 13
+    delay = instruction >> 8 & 0x1F
+    jump_to = None
+    if opcode == 0:  # JMP
+      if self._condition(instruction >> 5 & 0x7):
+        jump_to = instruction & 0x1F
+    elif opcode == 1:  # WAIT
+      if instruction >> 5 & 0x3 != 0:
+        raise NotImplementedError('WAIT on a pin or an IRQ')
+      if (self.read_pins() >> (instruction & 0x1F) & 1) != instruction >> 7 & 1:
+        return
+    elif opcode == 2:  # IN
+      self._shift_in(self._source(instruction >> 5 & 0x7, is_in=True), _bit_count(instruction))
+    elif opcode == 3:  # OUT
+      destination = instruction >> 5 & 0x7
+      bit_count = _bit_count(instruction)
+      value = self._shift_out(bit_count)
+      jump_to = self._write(destination, value, bit_count, is_out=True)
+    elif opcode == 4:  # PUSH or PULL
+      if_full_or_empty = instruction >> 6 & 1
+      block = instruction >> 5 & 1
+      if instruction >> 7 & 1 == 0:
+        if if_full_or_empty:
+          raise NotImplementedError('PUSH IFFULL')
+        if len(self._rx_fifo) >= FIFO_DEPTH:
+          if block:
+            return
+        else:
+          self._rx_fifo.append(self._isr)
+        self._isr = 0
+        self._isr_count = 0
+      else:
+        if if_full_or_empty:
+          raise NotImplementedError('PULL IFEMPTY')
+        if self._tx_fifo:
+          self._osr = self._tx_fifo.pop(0)
+        elif block:
+          return
+        else:
+          self._osr = self._x
+        self._osr_count = 0
+    elif opcode == 5:  # MOV
+      value = self._source(instruction & 0x7, is_in=False)
+      operation = instruction >> 3 & 0x3
+      if operation == 1:
+        value = ~value & 0xFFFFFFFF
+      elif operation == 2:
+        value = int('{:032b}'.format(value)[::-1], 2)
+      jump_to = self._write(instruction >> 5 & 0x7, value, 32, is_out=False)
+    elif opcode == 7:  # SET
+      jump_to = self._write(instruction >> 5 & 0x7, instruction & 0x1F, 5, is_set=True)
+    else:
+      raise NotImplementedError('IRQ')
+    self.cycles += delay
+    if jump_to is not None:
+      self._pc = jump_to
+    elif self._pc == self._wrap:
+      self._pc = self._wrap_target
+    else:
+      self._pc += 1
+
+  def _condition(self, condition):
+    if condition == 0:
+      return True
+    if condition == 1:
+      return self._x == 0
+    if condition == 2:
+      is_zero = self._x == 0
+      self._x = (self._x - 1) & 0xFFFFFFFF
+      return not is_zero
+    if condition == 3:
+      return self._y == 0
+    if condition == 4:
+      is_zero = self._y == 0
+      self._y = (self._y - 1) & 0xFFFFFFFF
+      return not is_zero
+    if condition == 5:
+      return self._x != self._y
+    if condition == 6:
+      raise NotImplementedError('JMP PIN')
+    return self._osr_count < self._pull_threshold
+
+  def _source(self, source, is_in):
+    if source == 0:
+      pins = self.read_pins()
+      # Rotated so that the first in pin is bit 0
+      return _rotate_left(pins, 32 - self._in_base)
+    if source == 1:
+      return self._x
+    if source == 2:
+      return self._y
+    if source == 3:
+      return 0
+    if source == 6:
+      return self._isr
+    if source == 7:
+      return self._osr
+    raise NotImplementedError('Source {} of {}'.format(source, 'IN' if is_in else 'MOV'))
+
+  def _write(self, destination, value, bit_count, is_out=False, is_set=False):
+    # Return the jump target of a write to PC, otherwise None
+    if destination == 1:
+      self._x = value
+    elif destination == 2:
+      self._y = value
+    elif destination == 0:
+      base, count = (self._set_base, self._set_count) if is_set else (self._out_base, self._out_count)
+      self._write_pins(base, min(bit_count, count), value, None)
+    elif destination == 3 and is_out:
+      pass
+    elif destination == 4 and (is_out or is_set):
+      base, count = (self._out_base, self._out_count) if is_out else (self._set_base, self._set_count)
+      self._write_pins(base, min(bit_count, count), None, value)
+    elif destination == 5 and not is_set:
+      return value & 0x1F
+    elif destination == 6 and not is_set:
+      if is_out:
+        self._shift_in(value, bit_count)
+      else:
+        self._isr = value
+        self._isr_count = 0
+    elif destination == 7 and not is_out and not is_set:
+      self._osr = value
+      self._osr_count = 0
+    else:
+      raise NotImplementedError('Destination {}'.format(destination))
+    return None
+
+  def _shift_in(self, value, bit_count):
+    value &= (1 << bit_count) - 1
+    if self._in_shift_right:
+      self._isr = (self._isr >> bit_count | value << (32 - bit_count)) & 0xFFFFFFFF
+    else:
+      self._isr = (self._isr << bit_count | value) & 0xFFFFFFFF
+    self._isr_count = min(self._isr_count + bit_count, 32)
+
+  def _shift_out(self, bit_count):
+    mask = (1 << bit_count) - 1
+    if self._out_shift_right:
+      value = self._osr & mask
+      self._osr = self._osr >> bit_count
+    else:
+      value = self._osr >> (32 - bit_count) & mask
+      self._osr = self._osr << bit_count & 0xFFFFFFFF
+    self._osr_count = min(self._osr_count + bit_count, 32)
+    return value
+
+
+def _rotate_left(value, n):
+  value &= 0xFFFFFFFF
+  return (value << n | value >> (32 - n)) & 0xFFFFFFFF
+
+
+def _bit_count(instruction):
+  # A bit count of 0 encodes 32
+  return instruction & 0x1F or 32
+
+
+def _item_size(buffer):
+  # Transfers are 32 bits at most, as an array of CPython may have 64-bit items
+  return min(getattr(buffer, 'itemsize', 1), 4)
@@ -0,0 +1,25 @@
+"""
+Host stand-in for CircuitPython's `supervisor` module. The clock is `time.monotonic()`, so replacing that also
+replaces `ticks_ms()`.
+"""
+import time
+
+_TICKS_PERIOD = 1 << 29
+
+
+class Runtime:
+  def __init__(self):
+    self.usb_connected = True
+    self.serial_connected = False
+    self.serial_bytes_available = 0
+
+
+runtime = Runtime()
+
+
+def ticks_ms():
+  return int(time.monotonic() * 1000) % _TICKS_PERIOD
+
+
+def reload():
+  pass
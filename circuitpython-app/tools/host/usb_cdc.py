@@ -0,0 +1,51 @@
+"""
+Host stand-in for CircuitPython's `usb_cdc` module. `Serial` is an in-memory loopback: `feed()` queues bytes to be
+read by the app, and what the app writes is collected in `written`. A read of more bytes than have arrived would wait
+for `timeout` seconds on the keyboard, and is counted in `num_short_reads`.
+"""
+
+
+class Serial:
+  def __init__(self):
+    self._incoming = bytearray()
+    self.written = bytearray()
+    self.timeout = 1
+    self.write_timeout = None
+    self.connected = True
+    self.num_short_reads = 0
+
+  @property
+  def in_waiting(self):
+    return len(self._incoming)
+
+  def feed(self, data):
+    self._incoming.extend(data)
+
+  def read(self, size=1):
+    if size > len(self._incoming):
+      self.num_short_reads += 1
+    data = bytes(self._incoming[:size])
+    del self._incoming[:size]
+    return data
+
+  def readinto(self, buffer):
+    size = min(len(buffer), len(self._incoming))
+    buffer[:size] = self._incoming[:size]
+    del self._incoming[:size]
+    return size
+
+  def write(self, data):
+    self.written.extend(data)
+    return len(data)
+
+  def reset_input_buffer(self):
+    self._incoming.clear()
+
+
+console = None
+data = None
+
+
+def enable(console=True, data=False):
+  globals()['console'] = Serial() if console else None
+  globals()['data'] = Serial() if data else None
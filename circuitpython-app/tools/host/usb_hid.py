@@ -0,0 +1,100 @@
+"""
+Host stand-in for CircuitPython's `usb_hid` module. Every report sent is appended to `Device.sent_reports`.
+
+With a `clock` set, e.g. the virtual clock of tools/simulate.py, the devices share one interrupt IN endpoint, as in
+the HID interface of CircuitPython 8, which the host polls every ENDPOINT_INTERVAL ms, its bInterval. A report is
+taken at the next poll, and a report sent before that blocks until then, as send_report() waits for the endpoint; it
+is counted in `Device.num_blocked_sends` of its device. A send to a device whose sends fail, e.g. while
+the host is suspended, blocks for SEND_TIMEOUT before it raises, as send_report() of CircuitPython 8 waits that long
+for the endpoint to be ready; it is counted in `Device.num_timed_out_sends`.
+"""
+
+# An object with ticks_ms() and sleep(seconds), or None for sends that never block
+clock = None
+SEND_TIMEOUT = 2000  # ms
+ENDPOINT_INTERVAL = 8  # ms
+_TICKS_PERIOD = 1 << 29
+# The clock ticks of the poll that takes the last report, or None
+_endpoint_poll_time = None
+
+
+class Device:
+  KEYBOARD = None
+  MOUSE = None
+  CONSUMER_CONTROL = None
+
+  # in_report_lengths is taken but not kept, as usb_hid.Device of CircuitPython has no attribute for it
+  def __init__(self, *, report_descriptor=b'', usage_page=0, usage=0, report_ids=(0,), in_report_lengths=(0,),
+               out_report_lengths=(0,)):
+    self.report_descriptor = bytes(report_descriptor)
+    self.usage_page = usage_page
+    self.usage = usage
+    self.report_ids = tuple(report_ids)
+    self.out_report_lengths = tuple(out_report_lengths)
+    self.sent_reports = []
+    self.last_received_report = None
+    # Set to an exception instance to make the next send_report() raise it at once
+    self.fail_next_send = None
+    # Set to an exception instance to make every send_report() raise it after SEND_TIMEOUT, e.g. while the host is
+    # suspended
+    self.fail_sends = None
+    self.num_blocked_sends = 0
+    self.num_timed_out_sends = 0
+
+  def send_report(self, report, report_id=None):
+    global _endpoint_poll_time
+    if self.fail_next_send is not None:
+      error, self.fail_next_send = self.fail_next_send, None
+      raise error
+    if self.fail_sends is not None:
+      if clock is not None:
+        clock.sleep(SEND_TIMEOUT / 1000)
+      self.num_timed_out_sends += 1
+      raise self.fail_sends
+    if clock is not None:
+      now = clock.ticks_ms()
+      if _endpoint_poll_time is not None and 0 < (_endpoint_poll_time - now) % _TICKS_PERIOD <= ENDPOINT_INTERVAL:
+        self.num_blocked_sends += 1
+        clock.sleep((_endpoint_poll_time - now) % _TICKS_PERIOD / 1000)
+        now = clock.ticks_ms()
+      _endpoint_poll_time = (now - now % ENDPOINT_INTERVAL + ENDPOINT_INTERVAL) % _TICKS_PERIOD
+    self.sent_reports.append((report_id, bytes(report)))
+
+  def get_last_received_report(self, report_id=None):
+    return self.last_received_report
+
+
+Device.KEYBOARD = Device(usage_page=0x01, usage=0x06, report_ids=(1,), out_report_lengths=(1,))
+Device.MOUSE = Device(usage_page=0x01, usage=0x02, report_ids=(2,), out_report_lengths=(0,))
+Device.CONSUMER_CONTROL = Device(usage_page=0x0C, usage=0x01, report_ids=(3,), out_report_lengths=(0,))
+
+devices = (Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL)
+_boot_device = 0
+
+
+def enable(new_devices, boot_device=0):
+  global devices, _boot_device
+  devices = tuple(new_devices)
+  _boot_device = boot_device
+
+
+def disable():
+  global devices
+  devices = ()
+
+
+def get_boot_device():
+  return _boot_device
+
+
+def reset():
+  global clock, _endpoint_poll_time
+  clock = None
+  _endpoint_poll_time = None
+  for device in (Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL):
+    device.sent_reports.clear()
+    device.fail_next_send = None
+    device.fail_sends = None
+    device.num_blocked_sends = 0
+    device.num_timed_out_sends = 0
+  enable((Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL))
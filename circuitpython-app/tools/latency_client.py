@@ -0,0 +1,72 @@
+"""
+Host-side client of the latency summary served over the usb_cdc data channel. Requires pyserial.
+
+  % python tools/latency_client.py /dev/tty.usbmodem1234563
+  % python tools/latency_client.py --clear /dev/tty.usbmodem1234563
+
+The data channel is the second serial port of the keyboard; the first one is the REPL console.
+"""
+import argparse
+import sys
+
+
+def parse_summary(lines):
+  """
+  Parse the lines of a summary into {span name: {'unit': 'us' or 'ms', 'p50': t, 'p99': t, 'max': t, 'count': n}}.
+  """
+  summary = {}
+  header = None
+  for line in lines:
+    line = line.strip()
+    if line == '' or line == '.':
+      continue
+    fields = line.split()
+    if header is None:
+      header = fields
+      if header[0] != 'span':
+        raise ValueError('Unexpected header: {}'.format(line))
+      continue
+    if len(fields) != len(header):
+      raise ValueError('Unexpected line: {}'.format(line))
+    summary[fields[0]] = {key: value if key == 'unit' else int(value) for key, value in zip(header[1:], fields[1:])}
+  return summary
+
+
+def request(port, command, timeout):
+  import serial
+
+  with serial.Serial(port, timeout=timeout) as connection:
+    connection.reset_input_buffer()
+    connection.write(command)
+    lines = []
+    while True:
+      line = connection.readline()
+      if line == b'':
+        raise TimeoutError('No response from {}'.format(port))
+      line = line.decode().strip()
+      if line == '.':
+        return lines
+      lines.append(line)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('port', help='serial port of the usb_cdc data channel')
+  parser.add_argument('--clear', action='store_true', help='clear the buffers on the keyboard')
+  parser.add_argument('--timeout', type=float, default=2.0)
+  args = parser.parse_args()
+
+  if args.clear:
+    request(args.port, b'c', args.timeout)
+    return 0
+
+  summary = parse_summary(request(args.port, b's', args.timeout))
+  print(f'{"span":<20} {"p50":>6} {"p99":>6} {"max":>6} {"count":>7}')
+  for name, values in summary.items():
+    print(f'{name:<20} {values["p50"]:6d} {values["p99"]:6d} {values["max"]:6d} {values["count"]:7d}  '
+          f'({values["unit"]})')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
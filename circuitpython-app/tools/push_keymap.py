@@ -0,0 +1,281 @@
+"""
+Host-side tool to push a key map to the keyboard over the usb_cdc data channel, without remounting or rebooting.
+Requires pyserial.
+
+  % python tools/push_keymap.py /dev/tty.usbmodem1234563 ../vial-porting/keymaps/vial/keymap.c
+  % python tools/push_keymap.py /dev/tty.usbmodem1234563 five_octave.vil   # a layout saved by Vial
+  % python tools/push_keymap.py --dry-run - ../vial-porting/keymaps/vial/keymap.c
+  % python tools/push_keymap.py --reset /dev/tty.usbmodem1234563          # back to KEY_MAP_LAYERS of code.py
+
+The keys of a keymap.c are in the order of the LAYOUT() macro, matched to the matrix with the layout of vial.json.
+QMK keycodes are converted into the (op, arg) records of octave_pcb.binary_keymap: basic keycodes, KC_NO, KC_TRNS,
+MO(n), LT(n, kc), MT(mod, kc) and the mod-tap shorthands like LGUI_T(kc), mouse buttons and media keys. Keys that
+are not in the source keep their current records.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, APP_DIR)
+
+from octave_pcb.binary_keymap import RECORD_LENGTH, encode_record  # noqa: E402
+from octave_pcb.keymap import KeyOp  # noqa: E402
+from octave_pcb.keymap_server import KeymapCommand  # noqa: E402
+
+DEFAULT_LAYOUT = os.path.join(APP_DIR, '..', 'vial-porting', 'keymaps', 'vial', 'vial.json')
+# Records per SET_BUFFER; each one is a write to the flash
+CHUNK_SIZE = 63 * RECORD_LENGTH
+
+BASIC_KEYCODES = {
+    'ENTER': 0x28, 'ENT': 0x28, 'ESCAPE': 0x29, 'ESC': 0x29, 'BACKSPACE': 0x2A, 'BSPC': 0x2A, 'TAB': 0x2B,
+    'SPACE': 0x2C, 'SPC': 0x2C, 'MINUS': 0x2D, 'MINS': 0x2D, 'EQUAL': 0x2E, 'EQL': 0x2E, 'LEFT_BRACKET': 0x2F,
+    'LBRC': 0x2F, 'RIGHT_BRACKET': 0x30, 'RBRC': 0x30, 'BACKSLASH': 0x31, 'BSLS': 0x31, 'NONUS_HASH': 0x32,
+    'NUHS': 0x32, 'SEMICOLON': 0x33, 'SCLN': 0x33, 'QUOTE': 0x34, 'QUOT': 0x34, 'GRAVE': 0x35, 'GRV': 0x35,
+    'COMMA': 0x36, 'COMM': 0x36, 'DOT': 0x37, 'SLASH': 0x38, 'SLSH': 0x38, 'CAPS_LOCK': 0x39, 'CAPS': 0x39,
+    'PRINT_SCREEN': 0x46, 'PSCR': 0x46, 'SCROLL_LOCK': 0x47, 'SCRL': 0x47, 'PAUSE': 0x48, 'PAUS': 0x48,
+    'INSERT': 0x49, 'INS': 0x49, 'HOME': 0x4A, 'PAGE_UP': 0x4B, 'PGUP': 0x4B, 'DELETE': 0x4C, 'DEL': 0x4C,
+    'END': 0x4D, 'PAGE_DOWN': 0x4E, 'PGDN': 0x4E, 'RIGHT': 0x4F, 'RGHT': 0x4F, 'LEFT': 0x50, 'DOWN': 0x51,
+    'UP': 0x52, 'NUM_LOCK': 0x53, 'NUM': 0x53, 'NONUS_BACKSLASH': 0x64, 'NUBS': 0x64, 'APPLICATION': 0x65,
+    'APP': 0x65, 'LANGUAGE_1': 0x90, 'LNG1': 0x90, 'LANG1': 0x90, 'LANGUAGE_2': 0x91, 'LNG2': 0x91, 'LANG2': 0x91,
+    'LEFT_CTRL': 0xE0, 'LCTL': 0xE0, 'LEFT_SHIFT': 0xE1, 'LSFT': 0xE1, 'LEFT_ALT': 0xE2, 'LALT': 0xE2, 'LOPT': 0xE2,
+    'LEFT_GUI': 0xE3, 'LGUI': 0xE3, 'LCMD': 0xE3, 'LWIN': 0xE3, 'RIGHT_CTRL': 0xE4, 'RCTL': 0xE4,
+    'RIGHT_SHIFT': 0xE5, 'RSFT': 0xE5, 'RIGHT_ALT': 0xE6, 'RALT': 0xE6, 'ROPT': 0xE6, 'ALGR': 0xE6,
+    'RIGHT_GUI': 0xE7, 'RGUI': 0xE7, 'RCMD': 0xE7, 'RWIN': 0xE7,
+}
+BASIC_KEYCODES.update({chr(ord('A') + n): 0x04 + n for n in range(26)})
+BASIC_KEYCODES.update({str((n + 1) % 10): 0x1E + n for n in range(10)})
+BASIC_KEYCODES.update({'F{}'.format(n + 1): 0x3A + n for n in range(12)})
+BASIC_KEYCODES.update({'F{}'.format(n + 13): 0x68 + n for n in range(12)})
+BASIC_KEYCODES.update({'INTERNATIONAL_{}'.format(n + 1): 0x87 + n for n in range(5)})
+BASIC_KEYCODES.update({'INT{}'.format(n + 1): 0x87 + n for n in range(5)})
+MOUSE_BUTTONS = {'BTN{}'.format(n + 1): 1 << n for n in range(5)}
+MOUSE_BUTTONS.update({'MS_BTN{}'.format(n + 1): 1 << n for n in range(5)})
+CONSUMER_CONTROL_CODES = {
+    'AUDIO_MUTE': 0xE2, 'MUTE': 0xE2, 'AUDIO_VOL_UP': 0xE9, 'VOLU': 0xE9, 'AUDIO_VOL_DOWN': 0xEA, 'VOLD': 0xEA,
+    'MEDIA_NEXT_TRACK': 0xB5, 'MNXT': 0xB5, 'MEDIA_PREV_TRACK': 0xB6, 'MPRV': 0xB6, 'MEDIA_STOP': 0xB7, 'MSTP': 0xB7,
+    'MEDIA_PLAY_PAUSE': 0xCD, 'MPLY': 0xCD, 'BRIGHTNESS_UP': 0x6F, 'BRIU': 0x6F, 'BRIGHTNESS_DOWN': 0x70,
+    'BRID': 0x70,
+}
+MODIFIERS = {'CTL': 0xE0, 'SFT': 0xE1, 'ALT': 0xE2, 'OPT': 0xE2, 'GUI': 0xE3, 'CMD': 0xE3, 'WIN': 0xE3}
+
+
+def to_record(keycode):
+  """
+  Return the (op, arg) of a QMK keycode, e.g. 'KC_A' or 'LT(1, KC_LNG2)', or an int as in .vil files (-1: none).
+  """
+  if isinstance(keycode, int):
+    if keycode == -1 or keycode == 0:
+      return KeyOp.NONE, 0
+    if keycode == 1:
+      return KeyOp.TRANSPARENT, 0
+    if 0x04 <= keycode <= 0xE7:
+      return KeyOp.KEYBOARD, keycode
+    raise ValueError('Unsupported keycode: 0x{:04X}'.format(keycode))
+  keycode = keycode.replace(' ', '')
+  if keycode in ('KC_NO', 'XXXXXXX'):
+    return KeyOp.NONE, 0
+  if keycode in ('KC_TRNS', 'KC_TRANSPARENT', '_______'):
+    return KeyOp.TRANSPARENT, 0
+  match = re.fullmatch(r'MO\((\d+)\)', keycode)
+  if match:
+    return KeyOp.LAYER, int(match.group(1))
+  match = re.fullmatch(r'LT\((\d+),(.+)\)', keycode) or re.fullmatch(r'LT(\d+)\((.+)\)', keycode)
+  if match:
+    return KeyOp.COMPLEX_LAYER, int(match.group(1)) << 8 | _to_basic_keycode(match.group(2))
+  match = re.fullmatch(r'MT\(MOD_([LR])(\w+),(.+)\)', keycode) or re.fullmatch(r'([LR])(\w+)_T\((.+)\)', keycode)
+  if match and match.group(2) in MODIFIERS:
+    modifier = MODIFIERS[match.group(2)] + (4 if match.group(1) == 'R' else 0)
+    return KeyOp.COMPLEX_MODIFIER, modifier << 8 | _to_basic_keycode(match.group(3))
+  name = keycode[3:] if keycode.startswith('KC_') else None
+  if name in MOUSE_BUTTONS:
+    return KeyOp.MOUSE_BUTTON, MOUSE_BUTTONS[name]
+  if name in CONSUMER_CONTROL_CODES:
+    return KeyOp.CONSUMER_CONTROL, CONSUMER_CONTROL_CODES[name]
+  return KeyOp.KEYBOARD, _to_basic_keycode(keycode)
+
+
+def _to_basic_keycode(keycode):
+  if keycode.startswith('KC_') and keycode[3:] in BASIC_KEYCODES:
+    return BASIC_KEYCODES[keycode[3:]]
+  raise ValueError('Unsupported keycode: {}'.format(keycode))
+
+
+def load_layout(path):
+  """
+  Return the matrix size and the (row, col) of each key of vial.json, in the order of the LAYOUT() macro.
+  """
+  with open(path) as f:
+    vial = json.load(f)
+  positions = []
+  for row in vial['layouts']['keymap']:
+    for key in row:
+      if isinstance(key, str):
+        row_col = key.split('\n')[0]
+        positions.append(tuple(int(value) for value in row_col.split(',')))
+  return vial['matrix']['rows'], vial['matrix']['cols'], positions
+
+
+def load_keymap_c(path, positions):
+  """
+  Return the layers of a QMK keymap.c as [{(row, col): keycode}], resolving its simple #defines.
+  """
+  with open(path) as f:
+    source = re.sub(r'//[^\n]*|/\*.*?\*/', '', f.read(), flags=re.DOTALL)
+  defines = dict(re.findall(r'^\s*#define\s+(\w+)\s+(.+?)\s*$', source, flags=re.MULTILINE))
+  layers = []
+  for match in re.finditer(r'\[\d+\]\s*=\s*LAYOUT\w*\(', source):
+    keycodes = [_expand(keycode.strip(), defines) for keycode in _split_arguments(source, match.end())]
+    if len(keycodes) != len(positions):
+      raise ValueError('{} keys in a layer, not the {} of the layout'.format(len(keycodes), len(positions)))
+    layers.append(dict(zip(positions, keycodes)))
+  return layers
+
+
+def _split_arguments(source, start):
+  # The arguments of the call whose '(' ends at `start`, split at the commas outside parentheses
+  arguments = []
+  depth = 0
+  for n in range(start, len(source)):
+    char = source[n]
+    if char == '(':
+      depth += 1
+    elif char == ')' and depth > 0:
+      depth -= 1
+    elif char in ',)' and depth == 0:
+      arguments.append(source[start:n])
+      start = n + 1
+      if char == ')':
+        return arguments
+  raise ValueError('Unterminated LAYOUT()')
+
+
+def _expand(keycode, defines):
+  for _ in range(8):
+    expanded = re.sub(r'\w+', lambda match: defines.get(match.group(0), match.group(0)), keycode)
+    if expanded == keycode:
+      break
+    keycode = expanded
+  return keycode
+
+
+def load_vil(path):
+  """
+  Return the layers of a layout saved by Vial as [{(row, col): keycode}].
+  """
+  with open(path) as f:
+    vil = json.load(f)
+  return [{(row, col): keycode for row, cols in enumerate(layer) for col, keycode in enumerate(cols)}
+          for layer in vil['layout']]
+
+
+def build_records(records, layers, num_rows, num_cols):
+  """
+  Return `records` with the keys of `layers` overwritten, for as many layers as `records` holds.
+  """
+  records = bytearray(records)
+  num_layers = len(records) // (num_rows * num_cols * RECORD_LENGTH)
+  if len(layers) > num_layers:
+    raise ValueError('{} layers, the keyboard has {}'.format(len(layers), num_layers))
+  for layer, keycodes in enumerate(layers):
+    for (row, col), keycode in keycodes.items():
+      position = ((layer * num_rows + row) * num_cols + col) * RECORD_LENGTH
+      records[position:position + RECORD_LENGTH] = encode_record(*to_record(keycode), num_layers)
+  return bytes(records)
+
+
+class KeymapClient:
+  """
+  The client of octave_pcb.keymap_server.KeymapServer on a pyserial-like `connection`.
+  """
+
+  def __init__(self, connection):
+    self.connection = connection
+
+  def request(self, command, arguments=b'', reply_size=0):
+    self.connection.write(bytes((command,)) + arguments)
+    reply = self.connection.read(1)
+    if reply == b'':
+      raise TimeoutError('No reply to command 0x{:02X}'.format(command))
+    if reply[0] != command:
+      raise ValueError('Command 0x{:02X} failed'.format(command))
+    reply += self.connection.read(reply_size)
+    if len(reply) != 1 + reply_size:
+      raise TimeoutError('Short reply to command 0x{:02X}'.format(command))
+    return reply[1:]
+
+  def get_layer_count(self):
+    return self.request(KeymapCommand.GET_LAYER_COUNT, reply_size=1)[0]
+
+  def get_buffer(self, size):
+    records = b''
+    for offset in range(0, size, CHUNK_SIZE):
+      chunk = min(CHUNK_SIZE, size - offset)
+      records += self.request(KeymapCommand.GET_BUFFER, bytes((offset >> 8, offset & 0xFF, chunk)), 3 + chunk)[3:]
+    return records
+
+  def set_buffer(self, records, old_records=None):
+    # Only the chunks that differ from `old_records` are written
+    for offset in range(0, len(records), CHUNK_SIZE):
+      chunk = records[offset:offset + CHUNK_SIZE]
+      if old_records is not None and old_records[offset:offset + CHUNK_SIZE] == chunk:
+        continue
+      self.request(KeymapCommand.SET_BUFFER, bytes((offset >> 8, offset & 0xFF, len(chunk))) + chunk, 3)
+
+  def reset(self):
+    self.request(KeymapCommand.RESET)
+
+
+def push(client, layers, num_rows, num_cols):
+  """
+  Write `layers` to the keyboard and read them back. Return the number of keys changed.
+  """
+  size = client.get_layer_count() * num_rows * num_cols * RECORD_LENGTH
+  old_records = client.get_buffer(size)
+  records = build_records(old_records, layers, num_rows, num_cols)
+  client.set_buffer(records, old_records)
+  if client.get_buffer(size) != records:
+    raise ValueError('The key map read back differs')
+  return sum(1 for position in range(0, size, RECORD_LENGTH)
+             if records[position:position + RECORD_LENGTH] != old_records[position:position + RECORD_LENGTH])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('port', help='serial port of the usb_cdc data channel, - with --dry-run')
+  parser.add_argument('keymap', nargs='?', help='QMK keymap.c, or .vil saved by Vial')
+  parser.add_argument('--layout', default=DEFAULT_LAYOUT, help='vial.json of the keyboard')
+  parser.add_argument('--reset', action='store_true', help='erase the key map in NVM, back to code.py')
+  parser.add_argument('--dry-run', action='store_true', help='print the records instead of pushing them')
+  parser.add_argument('--timeout', type=float, default=2.0)
+  args = parser.parse_args()
+
+  num_rows, num_cols, positions = load_layout(args.layout)
+  if not args.reset:
+    if args.keymap is None:
+      parser.error('keymap is required without --reset')
+    layers = load_vil(args.keymap) if args.keymap.endswith('.vil') else load_keymap_c(args.keymap, positions)
+    if args.dry_run:
+      for layer, keycodes in enumerate(layers):
+        for (row, col), keycode in sorted(keycodes.items()):
+          op, arg = to_record(keycode)
+          print(f'{layer} {row} {col} {keycode:<20} op {op:2d} arg 0x{arg:04X}')
+      return 0
+
+  import serial
+
+  with serial.Serial(args.port, timeout=args.timeout) as connection:
+    connection.reset_input_buffer()
+    client = KeymapClient(connection)
+    if args.reset:
+      client.reset()
+      print('Reset to the key map of code.py')
+    else:
+      print(f'{push(client, layers, num_rows, num_cols)} keys changed')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
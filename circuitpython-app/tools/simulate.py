@@ -0,0 +1,522 @@
+"""
+Host-side simulation harness of the firmware main loop.
+
+The firmware modules run against the stand-ins in tools/host and a virtual clock, fed with synthetic or recorded key
+traces. For each trace it reports the CPU time and the memory allocated per tick, and the HID reports sent.
+
+  % python tools/simulate.py                          # all synthetic traces
+  % python tools/simulate.py typing rolls             # some of them
+  % python tools/simulate.py --uptime-days 21 key_repeat
+  % python tools/simulate.py --trace-file trace.json  # recorded trace: [[time_ms, row, col, is_pressed], ...]
+  % python tools/simulate.py --dump-reports typing    # print every report, e.g. to diff two revisions
+  % python tools/simulate.py macro                    # a MacroAssignment typing the corpus, while typing along
+  % python tools/simulate.py mouse_keys               # held mouse move keys
+  % python tools/simulate.py --no-idle pauses         # without the idle mode, to compare scans and pin accesses
+  % python tools/simulate.py --key-matrix pio typing  # another KEY_MATRIX_BACKEND
+
+Allocations are measured with tracemalloc on CPython, which also counts objects MicroPython does not allocate, such
+as range iterators and boxed ints. Compare them between revisions rather than with gc.mem_free() on the device.
+"""
+import argparse
+import json
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'host'))
+sys.path.insert(0, APP_DIR)
+
+import digitalio  # noqa: E402
+import microcontroller  # noqa: E402
+import supervisor  # noqa: E402
+import usb_cdc  # noqa: E402
+import usb_hid  # noqa: E402
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS  # noqa: E402
+from adafruit_hid.keycode import Keycode  # noqa: E402
+
+from octave_pcb.binary_keymap import BinaryKeyMap  # noqa: E402
+from octave_pcb.combo import ComboEngine  # noqa: E402
+from octave_pcb.engine import KeyboardEngine  # noqa: E402
+from octave_pcb.idle import IdleMonitor  # noqa: E402
+from octave_pcb.key_event import Debouncer, KeyEvent  # noqa: E402
+from octave_pcb.key_matrix import COL_PINS, ROW_PINS, KeyMatrix  # noqa: E402
+from octave_pcb.keymap import CodeType, CompiledKeyMap, KeyAssignment, KeyOp, MacroAssignment  # noqa: E402
+from octave_pcb.keymap_server import KeymapServer  # noqa: E402
+from octave_pcb.latency_trace import LatencyTrace  # noqa: E402
+from octave_pcb.main_loop import MainLoop  # noqa: E402
+from octave_pcb.macro import MacroEngine  # noqa: E402
+from octave_pcb.mouse_keys import MouseKeysEngine  # noqa: E402
+from octave_pcb.nkro_keyboard import create_nkro_device, find_nkro_device  # noqa: E402
+from octave_pcb.recovery import Recovery  # noqa: E402
+from octave_pcb.scheduler import Scheduler  # noqa: E402
+from octave_pcb.tap_hold import TapHoldEngine  # noqa: E402
+from octave_pcb.ticks import TICKS_PERIOD, ticks_diff, ticks_us  # noqa: E402
+
+CORPUS = (
+    'the quick brown fox jumps over the lazy dog. '
+    'pack my box with five dozen liquor jugs, then sing "hello, world!" twice. '
+    'def scan_matrix(self): return [row for row in range(8)]\n'
+)
+
+
+class VirtualClock:
+  """
+  Milliseconds since `start_ms`, wrapped like supervisor.ticks_ms().
+  """
+
+  def __init__(self, start_ms=0):
+    self.start_ms = start_ms
+    self.now_ms = start_ms
+
+  @property
+  def elapsed(self):
+    return (self.now_ms - self.start_ms) / 1000
+
+  def sleep(self, seconds):
+    self.now_ms += round(seconds * 1000)
+
+  def ticks_ms(self):
+    return self.now_ms % TICKS_PERIOD
+
+
+def create_key_matrix(app):
+  # As code.py does for KEY_MATRIX_BACKEND
+  if app['KEY_MATRIX_BACKEND'] == app['KeyMatrixBackend'].KEYPAD:
+    from octave_pcb.keypad_key_matrix import KeypadKeyMatrix
+    return KeypadKeyMatrix(app['SCAN_KEY_MATRIX_INTERVAL'] / 1000)
+  elif app['KEY_MATRIX_BACKEND'] == app['KeyMatrixBackend'].PIO:
+    from octave_pcb.pio_key_matrix import PioKeyMatrix
+    return PioKeyMatrix()
+  return KeyMatrix()
+
+
+class Firmware:
+  """
+  The objects of code.py wired to the stand-in devices, and the MainLoop of code.py, one iteration per `tick()`.
+
+  The key map stored in the stand-in of microcontroller.nvm, if any, replaces KEY_MAP_LAYERS as on the keyboard.
+  """
+
+  def __init__(self, app, clock):
+    usb_hid.reset()
+    usb_hid.clock = clock
+    usb_hid.enable((usb_hid.Device.KEYBOARD, create_nkro_device(usb_hid), usb_hid.Device.MOUSE,
+                    usb_hid.Device.CONSUMER_CONTROL))
+    digitalio.reset()
+    usb_cdc.enable(console=True, data=True)
+    usb_cdc.data.timeout = 0
+    supervisor.runtime.usb_connected = True
+    self.clock = clock
+    self.key_matrix = create_key_matrix(app)
+    self.debouncer = Debouncer(self.key_matrix.num_rows, self.key_matrix.num_cols, app['DEBOUNCE_ALGORITHM'],
+                               app['DEBOUNCE_TIME'])
+    self.key_map = CompiledKeyMap(app['KEY_MAP_LAYERS'], combos=app['COMBOS'], keyboard_layout=KeyboardLayoutUS(None))
+    num_rows = self.key_matrix.num_rows
+    num_cols = self.key_matrix.num_cols
+    if app['KEY_MAP_IN_NVM']:
+      self.keymap_server = KeymapServer(BinaryKeyMap(microcontroller.nvm, num_rows, num_cols), self.key_map,
+                                        lambda: app['reload_key_map'](self.engine, self.recovery.devices))
+    else:
+      self.keymap_server = None
+    self.engine = KeyboardEngine(self.key_map, num_rows, num_cols,
+                                 TapHoldEngine(app['TAPPING_TERM'], app['TAP_HOLD_MODE']),
+                                 ComboEngine(self.key_map.combos, num_rows, num_cols, app['COMBO_TERM']),
+                                 MacroEngine(self.key_map.macros, app['MACRO_REPORT_INTERVAL']),
+                                 MouseKeysEngine(app['MOUSE_KEYS_INTERVAL'], app['MOUSE_KEYS_CURVE'],
+                                                 app['MOUSE_KEYS_MAX_SPEED'], app['MOUSE_KEYS_TIME_TO_MAX'],
+                                                 app['MOUSE_KEYS_WHEEL_INTERVAL']))
+    if app['LATENCY_TRACE_ENABLED']:
+      # Spans in us are of the CPU time on the host, as the virtual clock only moves when the loop sleeps
+      self.latency_trace = LatencyTrace(ticks_ms=clock.ticks_ms,
+                                        ticks_us=ticks_us if app['LATENCY_TRACE_IN_US'] else None)
+    else:
+      self.latency_trace = None
+    # The stand-in devices, which record the reports
+    self.nkro_device = find_nkro_device(usb_hid.devices)
+    self.mouse_device = usb_hid.Device.MOUSE
+    self.consumer_control_device = usb_hid.Device.CONSUMER_CONTROL
+    self.recovery = Recovery(usb_hid.devices, supervisor.runtime, ticks_ms=clock.ticks_ms, sleep=clock.sleep)
+    self.app = app
+    if app['IDLE_TIMEOUT'] is not None and app['KEY_MATRIX_BACKEND'] == app['KeyMatrixBackend'].DIGITALIO:
+      self.idle_monitor = IdleMonitor(self.key_matrix, app['IDLE_TIMEOUT'], app['IDLE_SCAN_INTERVAL'])
+    else:
+      self.idle_monitor = None
+    self.main_loop = MainLoop(self.key_matrix, self.debouncer, self.engine, self.recovery,
+                              lambda device: app['rebuild_hid_object'](self.engine, device, self.recovery.devices),
+                              usb_cdc.data, self.keymap_server, self.latency_trace, self.idle_monitor)
+    self.attach()
+    for device in usb_hid.devices:
+      device.sent_reports.clear()
+
+  def attach(self):
+    self.app['attach_hid_objects'](self.engine, self.recovery.devices)
+    self.keyboard_output = self.engine.keyboard_output
+    self.scheduler = Scheduler(self.app['SCAN_KEY_MATRIX_INTERVAL'], self.clock.ticks_ms, self.clock.sleep)
+    self.main_loop.scheduler = self.scheduler
+
+  def restart(self, error):
+    """
+    The except clause of the main loop: sleep, then start over with new HID objects and a new scheduler.
+    """
+    self.clock.sleep(self.recovery.restart_delay(error))
+    self.attach()
+
+  def set_pressed_keys(self, pressed_keys):
+    digitalio.closed_switches.clear()
+    for row, col in pressed_keys:
+      digitalio.closed_switches.add((ROW_PINS[row], COL_PINS[col]))
+
+  def tick(self, current_time):
+    """
+    Return False if the tick was idle, without a scan.
+    """
+    return self.main_loop.tick(current_time)
+
+
+def find_key_positions(key_map, num_cols):
+  """
+  Return {keycode: (row, col)} of the keys of layer 0.
+  """
+  positions = {}
+  layer_table = key_map.layers[0]
+  for i in range(len(layer_table) // 2):
+    op = layer_table[2 * i]
+    arg = layer_table[2 * i + 1]
+    if op == KeyOp.KEYBOARD and arg not in positions:
+      positions[arg] = divmod(i, num_cols)
+    elif op == KeyOp.COMPLEX_MODIFIER and arg >> 8 not in positions:
+      positions[arg >> 8] = divmod(i, num_cols)
+  return positions
+
+
+def typing_trace(positions, text, interval=0.09, hold=0.06, start=0.1):
+  """
+  Type `text` one key at a time, with shift for shifted characters.
+  """
+  layout = KeyboardLayoutUS(None)
+  trace = []
+  t = start
+  for char in text:
+    keycodes = layout.keycodes(char)
+    keys = [positions[keycode] for keycode in keycodes]
+    for n, (row, col) in enumerate(keys):
+      trace.append((t + n * 0.01, row, col, True))
+    for n, (row, col) in enumerate(reversed(keys)):
+      trace.append((t + hold + n * 0.01, row, col, False))
+    t += interval
+  return trace
+
+
+def rolls_trace(positions, words=('asdf', 'jkl;', 'qwer', 'uiop', 'zxcv'), repeat=10, gap=0.012, hold=0.07):
+  """
+  Fast rolls: each key goes down before the previous one is released.
+  """
+  layout = KeyboardLayoutUS(None)
+  trace = []
+  t = 0.1
+  for _ in range(repeat):
+    for word in words:
+      for n, char in enumerate(word):
+        row, col = positions[layout.keycodes(char)[-1]]
+        trace.append((t + n * gap, row, col, True))
+        trace.append((t + n * gap + hold, row, col, False))
+      t += len(word) * gap + hold + 0.1
+  return trace
+
+
+def held_modifiers_trace(positions, repeat=10):
+  """
+  Shortcuts with held modifiers, including the complex modifier on left command.
+  """
+  trace = []
+  t = 0.1
+  chords = (
+      (Keycode.LEFT_SHIFT, 'helloworld'),
+      (Keycode.LEFT_CONTROL, 'acv'),
+      (Keycode.LEFT_GUI, 'zsx'),
+  )
+  layout = KeyboardLayoutUS(None)
+  for _ in range(repeat):
+    for modifier, chars in chords:
+      modifier_row, modifier_col = positions[modifier]
+      trace.append((t, modifier_row, modifier_col, True))
+      t += 0.05
+      for char in chars:
+        row, col = positions[layout.keycodes(char)[-1]]
+        trace.append((t, row, col, True))
+        trace.append((t + 0.05, row, col, False))
+        t += 0.08
+      trace.append((t, modifier_row, modifier_col, False))
+      t += 0.2
+  return trace
+
+
+def key_repeat_trace(positions, hold=3.0, repeat=3):
+  """
+  Hold single keys long enough to repeat.
+  """
+  trace = []
+  t = 0.1
+  for keycode in (Keycode.A, Keycode.BACKSPACE, Keycode.SPACE)[:repeat]:
+    row, col = positions[keycode]
+    trace.append((t, row, col, True))
+    trace.append((t + hold, row, col, False))
+    t += hold + 0.2
+  return trace
+
+
+def pauses_trace(positions, words=('hello', 'world', 'pause', 'think', 'resume'), pause=3.0):
+  """
+  Words typed after long pauses, e.g. reading in between. The first key of each word wakes up the idle mode.
+  """
+  trace = []
+  t = 0.1
+  for word in words:
+    trace += typing_trace(positions, word, start=t)
+    t += len(word) * 0.09 + pause
+  return trace
+
+
+def with_key_assignments(app, key_assignments):
+  """
+  Return a copy of the code.py globals with {(row, col): key_assignment} on layer 0.
+  """
+  key_map_layers = [list(key_map_layer) for key_map_layer in app['KEY_MAP_LAYERS']]
+  for (row, col), key_assignment in key_assignments.items():
+    key_map_layers[0][row * 8 + col] = key_assignment
+  return dict(app, KEY_MAP_LAYERS=key_map_layers)
+
+
+def macro_trace(positions, row=1, col=1):
+  """
+  Start the macro on (row, col) and keep typing on other keys while it plays.
+  """
+  trace = [(0.1, row, col, True), (0.15, row, col, False)]
+  trace += typing_trace(positions, 'typing along', start=0.12)
+  return trace
+
+
+MOUSE_KEYS = {
+    (0, 1): KeyAssignment(CodeType.MOUSE_MOVE, {'x': 2}),
+    (1, 1): KeyAssignment(CodeType.MOUSE_MOVE, {'y': 2}),
+    (1, 2): KeyAssignment(CodeType.MOUSE_MOVE, {'wheel': -1}),
+}
+
+
+def mouse_keys_trace(positions):
+  """
+  Hold a mouse move key, then two of them for a diagonal, then the wheel, on the keys of MOUSE_KEYS.
+  """
+  return [
+      (0.1, 0, 1, True), (1.6, 0, 1, False),
+      (1.8, 0, 1, True), (1.8, 1, 1, True), (2.3, 0, 1, False), (2.3, 1, 1, False),
+      (2.5, 1, 2, True), (3.0, 1, 2, False),
+  ]
+
+
+def count_chords(stream):
+  num_chords = 0
+  position = 0
+  while position < len(stream):
+    position += 1 + stream[position]
+    num_chords += 1
+  return num_chords
+
+
+def load_trace_file(path):
+  with open(path) as f:
+    return [(time_ms / 1000, row, col, bool(is_pressed)) for time_ms, row, col, is_pressed in json.load(f)]
+
+
+class Result:
+  def __init__(self):
+    self.tick_ns = []
+    self.tick_allocations = []
+    self.tick_key_events = []
+    self.scan_intervals = []
+    self.long_press_intervals = []
+    self.macro_durations = []
+    # Time of each mouse report
+    self.mouse_report_times = []
+    self.num_scans = 0
+    self.num_idle_ticks = 0
+    self.num_pin_accesses = 0
+    # From a press while idle to its key event
+    self.wake_latencies = []
+
+
+def run(app, trace, start_ms=0, measure_allocations=False):
+  clock = VirtualClock(start_ms)
+  firmware = Firmware(app, clock)
+  result = Result()
+  trace = sorted(trace)
+  end_time = (trace[-1][0] if trace else 0.0) + 1.0
+  pressed_keys = set()
+  next_event = 0
+  last_scan_time = None
+  last_long_press_times = {}
+  macro_start_time = None
+  waking_presses = {}
+  if measure_allocations:
+    tracemalloc.start()
+  # Until 1 s after the last event, and the macros have played
+  while clock.elapsed < end_time or firmware.engine.macro.is_playing:
+    current_time = firmware.scheduler.wait()
+    while next_event < len(trace) and trace[next_event][0] <= clock.elapsed:
+      event_time, row, col, is_pressed = trace[next_event]
+      (pressed_keys.add if is_pressed else pressed_keys.discard)((row, col))
+      if is_pressed and firmware.idle_monitor is not None and firmware.idle_monitor.is_idle:
+        waking_presses[row * 8 + col] = event_time
+      next_event += 1
+    firmware.set_pressed_keys(pressed_keys)
+    if measure_allocations:
+      tracemalloc.reset_peak()
+      before, _ = tracemalloc.get_traced_memory()
+      is_scanned = firmware.tick(current_time)
+      _, peak = tracemalloc.get_traced_memory()
+      result.tick_allocations.append(peak - before)
+    else:
+      start = time.perf_counter_ns()
+      is_scanned = firmware.tick(current_time)
+      result.tick_ns.append(time.perf_counter_ns() - start)
+    if not is_scanned:
+      result.num_idle_ticks += 1
+      result.tick_key_events.append(0)
+      last_scan_time = None
+      continue
+    result.num_scans += 1
+    if last_scan_time is not None:
+      result.scan_intervals.append(ticks_diff(current_time, last_scan_time))
+    last_scan_time = current_time
+    result.tick_key_events.append(firmware.engine.num_key_events)
+    mouse_reports = firmware.mouse_device.sent_reports
+    while len(result.mouse_report_times) < len(mouse_reports):
+      result.mouse_report_times.append(clock.now_ms)
+    if firmware.engine.macro.is_playing and macro_start_time is None:
+      macro_start_time = current_time
+    elif not firmware.engine.macro.is_playing and macro_start_time is not None:
+      result.macro_durations.append(ticks_diff(current_time, macro_start_time))
+      macro_start_time = None
+    for n in range(firmware.engine.num_key_events):
+      i = firmware.engine._key_event_indices[n]
+      key_event = firmware.engine._key_events[n]
+      if key_event == KeyEvent.PRESS and i in waking_presses:
+        result.wake_latencies.append(clock.elapsed * 1000 - waking_presses.pop(i) * 1000)
+      if key_event == KeyEvent.LONG_PRESS:
+        if i in last_long_press_times:
+          result.long_press_intervals.append(ticks_diff(current_time, last_long_press_times[i]))
+        last_long_press_times[i] = current_time
+      else:
+        last_long_press_times.pop(i, None)
+  if measure_allocations:
+    tracemalloc.stop()
+  result.num_pin_accesses = digitalio.stats['reads'] + digitalio.stats['writes']
+  return firmware, result
+
+
+def check(name, condition, detail):
+  # A case of the tools/check_*.py scripts: print it, with `detail` if it failed, and return `condition`
+  print(f'{"ok  " if condition else "FAIL"}  {name}{"" if condition else ": " + detail}')
+  return condition
+
+
+def percentile(values, q):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * q))] if values else 0
+
+
+def report(name, app, trace, dump_reports, start_ms=0):
+  firmware, result = run(app, trace, start_ms)
+  _, allocation_result = run(app, trace, start_ms, measure_allocations=True)
+  tick_ns = result.tick_ns
+  tick_allocations = allocation_result.tick_allocations
+  num_keystrokes = sum(1 for _, _, _, is_pressed in trace if is_pressed)
+  keyboard_reports = firmware.nkro_device.sent_reports
+  mouse_reports = firmware.mouse_device.sent_reports
+  consumer_reports = firmware.consumer_control_device.sent_reports
+  is_released = keyboard_reports == [] or not any(keyboard_reports[-1][1])
+
+  print(name)
+  print(f'  ticks            {len(tick_ns):8d}  keystrokes {num_keystrokes}')
+  print(f'  cpu per tick     p50 {percentile(tick_ns, 0.5) / 1000:7.1f} us'
+        f'  p99 {percentile(tick_ns, 0.99) / 1000:7.1f} us  max {max(tick_ns) / 1000:7.1f} us')
+  print(f'  alloc per tick   p50 {percentile(tick_allocations, 0.5):7d} B'
+        f'   p99 {percentile(tick_allocations, 0.99):7d} B   max {max(tick_allocations):7d} B')
+  print(f'  scan interval    min {min(result.scan_intervals)} ms  max {max(result.scan_intervals)} ms')
+  print(f'  scans            {result.num_scans} ({result.num_idle_ticks} idle ticks)'
+        f'  pin accesses {result.num_pin_accesses}')
+  if result.wake_latencies:
+    print(f'  wake latency     max {max(result.wake_latencies):.0f} ms  ({len(result.wake_latencies)} wakes)')
+  if result.long_press_intervals:
+    print(f'  repeat interval  min {min(result.long_press_intervals)} ms  max {max(result.long_press_intervals)} ms'
+          f'  ({len(result.long_press_intervals)} repeats)')
+  if result.macro_durations:
+    num_chords = sum(count_chords(stream) for stream in firmware.key_map.macros)
+    duration = sum(result.macro_durations)
+    print(f'  macro            {num_chords} chords in {duration} ms'
+          f' ({num_chords * 1000 / max(1, duration):.0f} chars/s)')
+  if len(result.mouse_report_times) > 1:
+    mouse_intervals = [b - a for a, b in zip(result.mouse_report_times, result.mouse_report_times[1:])]
+    print(f'  mouse interval   min {min(mouse_intervals)} ms  p50 {percentile(mouse_intervals, 0.5)} ms')
+  print(f'  reports          keyboard {len(keyboard_reports)} ({len(keyboard_reports) / max(1, num_keystrokes):.2f}'
+        f' per keystroke)  mouse {len(mouse_reports)}  consumer {len(consumer_reports)}')
+  num_blocked_sends = sum(device.num_blocked_sends for device in (firmware.nkro_device, firmware.mouse_device,
+                                                                   firmware.consumer_control_device))
+  print(f'  blocked sends    {num_blocked_sends}  (a report sent before the host polled the previous one, every '
+        f'{usb_hid.ENDPOINT_INTERVAL} ms)')
+  print(f'  all released     {is_released}')
+  if dump_reports:
+    for report_id, data in keyboard_reports:
+      print(f'    {report_id} {data.hex()}')
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('traces', nargs='*',
+                      help='synthetic traces: typing, rolls, held_modifiers, key_repeat, macro, mouse_keys, pauses')
+  parser.add_argument('--trace-file', action='append', default=[], help='recorded trace in JSON')
+  parser.add_argument('--text-file', help='corpus of the typing trace')
+  parser.add_argument('--dump-reports', action='store_true', help='print every keyboard report')
+  parser.add_argument('--uptime-days', type=float, default=0.0,
+                      help='start the virtual clock after this uptime, e.g. past the wraparound of ticks_ms')
+  parser.add_argument('--no-idle', action='store_true', help='scan all the time, as with IDLE_TIMEOUT = None')
+  parser.add_argument('--key-matrix', choices=('digitalio', 'keypad', 'pio'),
+                      help='KEY_MATRIX_BACKEND, e.g. pio with the rp2pio stand-in, which needs adafruit_pioasm')
+  args = parser.parse_args()
+
+  app = runpy.run_path(os.path.join(APP_DIR, 'code.py'))
+  if args.no_idle:
+    app['IDLE_TIMEOUT'] = None
+  if args.key_matrix is not None:
+    app['KEY_MATRIX_BACKEND'] = getattr(app['KeyMatrixBackend'], args.key_matrix.upper())
+  key_map = CompiledKeyMap(app['KEY_MAP_LAYERS'])
+  positions = find_key_positions(key_map, len(KeyMatrix().col_ios))
+  text = open(args.text_file).read() if args.text_file else CORPUS
+
+  synthetic_traces = {
+      'typing': lambda: typing_trace(positions, text),
+      'rolls': lambda: rolls_trace(positions),
+      'held_modifiers': lambda: held_modifiers_trace(positions),
+      'key_repeat': lambda: key_repeat_trace(positions),
+      'macro': lambda: macro_trace(positions),
+      'mouse_keys': lambda: mouse_keys_trace(positions),
+      'pauses': lambda: pauses_trace(positions),
+  }
+  trace_key_assignments = {
+      'macro': {(1, 1): MacroAssignment((text,))},
+      'mouse_keys': MOUSE_KEYS,
+  }
+  names = args.traces if args.traces or args.trace_file else list(synthetic_traces)
+  start_ms = round(args.uptime_days * 24 * 60 * 60 * 1000)
+  for name in names:
+    trace_app = with_key_assignments(app, trace_key_assignments[name]) if name in trace_key_assignments else app
+    report(name, trace_app, synthetic_traces[name](), args.dump_reports, start_ms)
+  for path in args.trace_file:
+    report(path, app, load_trace_file(path), args.dump_reports, start_ms)
+
+
+if __name__ == '__main__':
+  main()